@@ -1,19 +1,19 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Salon, Channel, Message
+from .models import Salon, Channel, Message, SalonMembership, StoredFile
 
 
 @admin.register(Salon)
 class SalonAdmin(admin.ModelAdmin):
-	list_display = ("nom", "slug")
+	list_display = ("nom", "slug", "channel_count", "message_count", "last_message_at", "retention_jours", "retention_messages")
 	search_fields = ("nom", "description")
 	prepopulated_fields = {"slug": ("nom",)}
 
 
 @admin.register(Channel)
 class ChannelAdmin(admin.ModelAdmin):
-	list_display = ("nom", "salon", "slug")
+	list_display = ("nom", "salon", "slug", "message_count", "last_message_at")
 	search_fields = ("nom", "description", "salon__nom")
 	list_filter = ("salon",)
 	prepopulated_fields = {"slug": ("nom",)}
@@ -33,3 +33,20 @@ class MessageAdmin(admin.ModelAdmin):
 			return f"{obj.contenu[:72]}..."
 		return obj.contenu
 	short_contenu.short_description = "Contenu"
+
+
+@admin.register(SalonMembership)
+class SalonMembershipAdmin(admin.ModelAdmin):
+	list_display = ("user", "salon", "message_count", "first_message_at", "last_message_at")
+	search_fields = ("user__username", "salon__nom")
+	list_filter = ("salon",)
+	raw_id_fields = ("user",)
+	list_select_related = ("user", "salon")
+	ordering = ("-last_message_at",)
+
+
+@admin.register(StoredFile)
+class StoredFileAdmin(admin.ModelAdmin):
+	list_display = ("name", "ref_count")
+	search_fields = ("name",)
+	ordering = ("-ref_count",)
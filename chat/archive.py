@@ -0,0 +1,205 @@
+"""Rétention des messages et archive compressée.
+
+Chaque salon peut limiter son historique « chaud » (table `chat_message`) à
+N jours (`retention_jours`) et/ou N messages par conversation
+(`retention_messages`). `archive_messages` (commande à lancer
+périodiquement) déplace les messages plus anciens, par lots, dans
+`ArchivedMessageBatch` : une ligne par lot de messages consécutifs, leur
+JSON compressé par zlib. Les listes de messages continuent dans l'archive
+quand le client remonte l'historique (`archived_page`) et dans les
+fenêtres d'historique en streaming (`archived_entries`, `aarchived_entries`).
+
+Les messages archivés gardent leurs ids, leurs pièces jointes (l'archive
+reprend leurs références dans `StoredFile`) mais ne sont plus modifiables ni
+trouvés par la recherche plein texte.
+"""
+import json
+import time
+import zlib
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Salon, Channel, Message, SalonMembership, ArchivedMessageBatch
+from .serializers import attachment_data
+
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_FIELDS = ('id', 'auteur_id', 'auteur__username', 'contenu', 'date_envoi', 'fichier',
+                  'fichier_nom', 'miniature', 'largeur', 'hauteur')
+FILE_FIELDS = ('fichier', 'fichier_nom', 'miniature', 'largeur', 'hauteur')
+
+
+def _conversation(salon=None, channel=None):
+    return {'channel': channel} if channel is not None else {'salon': salon}
+
+
+def archive_cutoff(salon, qs, now=None):
+    """Plus grand id à archiver dans la conversation `qs`, ou None si rien ne dépasse."""
+    cutoffs = []
+    if salon.retention_jours is not None:
+        limit = (now or timezone.now()) - timedelta(days=salon.retention_jours)
+        cutoff = qs.filter(date_envoi__lt=limit).order_by('-id').values_list('id', flat=True).first()
+        if cutoff is not None:
+            cutoffs.append(cutoff)
+    if salon.retention_messages is not None:
+        keep = salon.retention_messages
+        cutoff = list(qs.order_by('-id').values_list('id', flat=True)[keep:keep + 1])
+        cutoffs.extend(cutoff)
+    return max(cutoffs) if cutoffs else None
+
+
+def _encode(row):
+    entry = {
+        'id': row['id'],
+        'auteur_id': row['auteur_id'],
+        'auteur': row['auteur__username'],
+        'contenu': row['contenu'],
+        'date_envoi': row['date_envoi'].isoformat(),
+    }
+    if row['fichier']:
+        entry.update({field: row[field] for field in FILE_FIELDS})
+    return entry
+
+
+def _archive_rows(rows, salon, channel):
+    entries = [_encode(row) for row in rows]
+    dates = [row['date_envoi'] for row in rows]
+    ArchivedMessageBatch.objects.create(
+        salon=salon, channel=channel,
+        first_id=rows[0]['id'], last_id=rows[-1]['id'],
+        first_date=min(dates), last_date=max(dates), message_count=len(rows),
+        data=encode(entries),
+    )
+    # Suppression sans les signaux message par message (chat/signals.py) :
+    # l'archive reprend les références aux pièces jointes telles quelles
+    # (`StoredFile` inchangé), participations et version sont mises à jour
+    # une fois pour le lot. Les messages restent visibles (dans l'archive) :
+    # seule `messages_version` change, pas `changes_version`
+    qs = Message.objects.filter(id__in=[row['id'] for row in rows])
+    qs._raw_delete(qs.db)
+    salon_id = salon.pk if salon is not None else channel.salon_id
+    for user_id, count in Counter(row['auteur_id'] for row in rows).items():
+        SalonMembership.record_deletion(salon_id, user_id, count)
+    entity = Channel.objects.filter(pk=channel.pk) if channel is not None else Salon.objects.filter(pk=salon.pk)
+    entity.update(messages_version=F('messages_version') + 1)
+
+
+def archive_conversation(salon, channel=None, batch_size=ARCHIVE_BATCH_SIZE, now=None, pause=0):
+    """Archive les messages hors rétention du salon (ou d'un de ses canaux).
+
+    Un lot par transaction ; `pause` (secondes) entre deux lots laisse
+    respirer la base. Retourne le nombre de messages archivés.
+    """
+    qs = Message.objects.filter(**_conversation(salon, channel))
+    cutoff = archive_cutoff(salon, qs, now)
+    if cutoff is None:
+        return 0
+    total = 0
+    while True:
+        rows = list(qs.filter(id__lte=cutoff).order_by('id').values(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            break
+        with transaction.atomic():
+            _archive_rows(rows, None if channel is not None else salon, channel)
+            Salon.count_messages(salon.pk, channel.pk if channel is not None else None, -len(rows))
+        total += len(rows)
+        if pause:
+            time.sleep(pause)
+    if total:
+        # Les compteurs ne portent que sur la table chaude (comme
+        # `Salon.reconcile_counters`) : le dernier message a pu être archivé
+        Salon.refresh_last_message(salon.pk, channel.pk if channel is not None else None)
+    return total
+
+
+def archive_salon(salon, **kwargs):
+    """Applique la rétention du salon à sa conversation et à tous ses canaux."""
+    total = archive_conversation(salon, **kwargs)
+    for channel in salon.channels.all():
+        total += archive_conversation(salon, channel=channel, **kwargs)
+    return total
+
+
+def encode(entries):
+    return zlib.compress(json.dumps(entries, ensure_ascii=False).encode(), 6)
+
+
+def decode(batch):
+    return json.loads(zlib.decompress(bytes(batch.data)))
+
+
+def archived_page(salon=None, channel=None, before_id=None, count=50):
+    """Les `count` derniers messages archivés avant `before_id`, en ordre chronologique.
+
+    Retourne (entrées, il en reste d'autres). Avec `count=0`, indique
+    seulement s'il existe des messages archivés avant `before_id`.
+    """
+    batches = ArchivedMessageBatch.objects.filter(**_conversation(salon, channel))
+    if before_id is not None:
+        batches = batches.filter(first_id__lt=before_id)
+    result = []
+    for batch in batches.order_by('-last_id').iterator(chunk_size=4):
+        entries = [e for e in decode(batch) if before_id is None or e['id'] < before_id]
+        if len(entries) > count:
+            return entries[len(entries) - count:] + result, True
+        result = entries + result
+        count -= len(entries)
+    return result, False
+
+
+def _window_batches(salon, channel, after_id, before_id):
+    batches = ArchivedMessageBatch.objects.filter(**_conversation(salon, channel))
+    if after_id is not None:
+        batches = batches.filter(last_id__gt=after_id)
+    if before_id is not None:
+        batches = batches.filter(first_id__lt=before_id)
+    return batches.order_by('first_id')
+
+
+def _window_entries(batch, after_id, before_id):
+    return [entry for entry in decode(batch)
+            if (after_id is None or entry['id'] > after_id) and (before_id is None or entry['id'] < before_id)]
+
+
+def archived_entries(salon=None, channel=None, after_id=None, before_id=None):
+    """Messages archivés entre `after_id` et `before_id` (exclus), en ordre chronologique.
+
+    Générateur : un lot décompressé à la fois en mémoire.
+    """
+    for batch in _window_batches(salon, channel, after_id, before_id).iterator(chunk_size=4):
+        yield from _window_entries(batch, after_id, before_id)
+
+
+async def aarchived_entries(salon=None, channel=None, after_id=None, before_id=None):
+    """Comme `archived_entries`, en générateur asynchrone (ASGI)."""
+    async for batch in _window_batches(salon, channel, after_id, before_id).aiterator(chunk_size=4):
+        for entry in _window_entries(batch, after_id, before_id):
+            yield entry
+
+
+def find_archived(message_id):
+    """(salon, entrée) d'un message archivé, ou None."""
+    batches = (ArchivedMessageBatch.objects.filter(first_id__lte=message_id, last_id__gte=message_id)
+               .select_related('salon', 'channel__salon'))
+    for batch in batches:
+        for entry in decode(batch):
+            if entry['id'] == message_id:
+                return batch.salon or batch.channel.salon, entry
+    return None
+
+
+def archived_message_data(entry):
+    """Même format JSON que les messages de la table chaude."""
+    data = {
+        'id': entry['id'],
+        'auteur': entry['auteur'],
+        'contenu': entry['contenu'],
+        'date_envoi': entry['date_envoi'],
+        'archive': True,
+    }
+    data.update(attachment_data(entry['id'], entry.get('fichier'), entry.get('fichier_nom'),
+                                entry.get('miniature'), entry.get('largeur'), entry.get('hauteur')))
+    return data
@@ -0,0 +1,100 @@
+"""Conversations : un salon, ou l'un de ses canaux.
+
+Un message appartient à exactement une conversation : `Message.salon` ou
+`Message.channel`, jamais les deux ni aucun (contrainte
+`chat_message_one_conversation`). `Conversation` regroupe ce qui en dépend
+(salon de rattachement pour les permissions et les compteurs, messages,
+sujet temps réel, version des ETag), pour que les vues de l'API servent les
+deux types par le même code.
+
+`resolve` charge la conversation désignée par l'URL en une requête : le
+canal avec son salon (`select_related('salon')`), ou le salon seul.
+"""
+from django.db.models import Q
+from django.shortcuts import aget_object_or_404, get_object_or_404
+
+from .models import Salon, Channel, Message
+from .realtime import topic_for
+
+
+class Conversation:
+    """Un salon (`channel` à None) ou un canal et son salon."""
+
+    __slots__ = ('salon', 'channel')
+
+    def __init__(self, salon, channel=None):
+        self.salon = salon
+        self.channel = channel
+
+    @property
+    def entity(self):
+        """Le canal, ou le salon pour sa propre conversation."""
+        return self.channel if self.channel is not None else self.salon
+
+    @property
+    def kind(self):
+        return 'channel' if self.channel is not None else 'salon'
+
+    @property
+    def channel_id(self):
+        return self.channel.id if self.channel is not None else None
+
+    @property
+    def owner(self):
+        """Champ de `Message` qui désigne la conversation : {'salon': ...} ou {'channel': ...}."""
+        return {self.kind: self.entity}
+
+    @property
+    def owner_ids(self):
+        """Comme `owner`, par id : {'salon_id': ...} ou {'channel_id': ...}."""
+        return {f'{self.kind}_id': self.entity.id}
+
+    @property
+    def topic(self):
+        return topic_for(self.salon.id, self.channel_id)
+
+    @property
+    def version(self):
+        return self.entity.messages_version
+
+    @property
+    def changes_version(self):
+        return self.entity.changes_version
+
+    def messages(self):
+        return self.entity.messages.all()
+
+    def scope(self):
+        """Messages visibles depuis la conversation : ceux du canal, ou du salon et de tous ses canaux."""
+        if self.channel is not None:
+            return self.channel.messages.all()
+        return Message.objects.filter(Q(salon=self.salon) | Q(channel__salon=self.salon))
+
+
+def conversation_query(salon_slug, channel_slug=None):
+    """Requête de `resolve` (aussi auditée par la commande explain_queries)."""
+    if channel_slug is None:
+        return Salon.objects.filter(slug=salon_slug)
+    return Channel.objects.select_related('salon').filter(slug=channel_slug, salon__slug=salon_slug)
+
+
+def _conversation(entity):
+    return Conversation(entity.salon, entity) if isinstance(entity, Channel) else Conversation(entity)
+
+
+def resolve(salon_slug, channel_slug=None):
+    """Conversation désignée par l'URL (une requête) ; Http404 si elle n'existe pas."""
+    return _conversation(get_object_or_404(conversation_query(salon_slug, channel_slug)))
+
+
+async def aresolve(salon_slug, channel_slug=None):
+    return _conversation(await aget_object_or_404(conversation_query(salon_slug, channel_slug)))
+
+
+def get_conversation(request, salon_slug, channel_slug=None):
+    """`resolve` mémorisé sur la requête : la fonction d'ETag et la vue partagent la requête SQL."""
+    memo = request.__dict__.setdefault('_conversations', {})
+    key = (salon_slug, channel_slug)
+    if key not in memo:
+        memo[key] = resolve(salon_slug, channel_slug)
+    return memo[key]
@@ -0,0 +1,58 @@
+"""Annuaire des salons de la page d'accueil.
+
+Les salons sont listés par pages de `DIRECTORY_PAGE_SIZE`, filtrés par nom
+ou description. Chacun affiche son nombre de canaux, de messages (salon et
+canaux) et la date de son dernier message, lus dans ses compteurs
+dénormalisés (`Salon.message_count`...) : aucun COUNT(*) par salon.
+
+Le fragment HTML de la liste est mis en cache (`{% cache %}`, clé :
+version de l'annuaire, recherche, page) et la page n'est évaluée qu'en cas
+d'absence du cache. La version change à chaque création, modification
+ou suppression de salon ou de canal (chat/signals.py). Les compteurs
+peuvent avoir jusqu'à `CHAT_DIRECTORY_CACHE_TTL` secondes de retard.
+"""
+import time
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+from .models import Salon
+
+DIRECTORY_PAGE_SIZE = 24
+VERSION_KEY = 'chat:directory-version'
+
+
+def directory_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Valeur jamais utilisée auparavant, même si la clé a été évincée du cache
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_directory_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+
+
+def salon_directory(q=''):
+    """Salons triés par nom, avec seulement les colonnes affichées."""
+    salons = Salon.objects.only('nom', 'slug', 'description', 'channel_count', 'message_count', 'last_message_at')
+    if q:
+        salons = salons.filter(Q(nom__icontains=q) | Q(description__icontains=q))
+    return salons.order_by('nom')
+
+
+def page_number(value):
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return 1
+
+
+def directory_page(q, number):
+    return Paginator(salon_directory(q), DIRECTORY_PAGE_SIZE).get_page(number)
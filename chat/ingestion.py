@@ -0,0 +1,323 @@
+"""Écriture différée (write-behind) des messages texte.
+
+Avec `CHAT_WRITE_BEHIND`, un message sans pièce jointe n'est pas inséré
+pendant la requête : la vue le valide, `Ingester.submit` lui attribue un id
+et une date, l'ajoute au journal local (écriture puis `fsync`) et la vue
+répond aussitôt (202). Un thread insère les messages en attente par
+`bulk_create`, un lot par transaction, au plus toutes les
+`CHAT_WRITE_BEHIND_INTERVAL` secondes ou dès `CHAT_WRITE_BEHIND_BATCH`
+messages ; participations, versions (ETag) et événements `message.created`
+suivent dans la même transaction.
+
+Ids : réservés par blocs dans la séquence de la table (`sqlite_sequence` ou
+séquence PostgreSQL), un `create()` ordinaire ne peut donc pas les
+reprendre. Les messages avec pièce jointe restent insérés dans la requête
+(`Ingester.write_now`) : ils prennent l'id suivant de la file, la file est
+vidée avant eux et aucun lot ne s'insère entre-temps, pour que les ids
+restent dans l'ordre d'insertion.
+
+Journal : un fichier par processus et par lot (`<pid>-<n>.jsonl` dans
+`CHAT_WRITE_BEHIND_JOURNAL`), verrouillé tant qu'il est en attente et
+supprimé une fois le lot inséré. Au démarrage (et avec la commande
+`replay_ingest_journal`), les journaux laissés par un processus arrêté
+brutalement sont rejoués ; les messages déjà en base sont ignorés.
+
+Comme `InMemoryBroker`, ce mode suppose un seul processus par base : des
+processus différents réserveraient des blocs d'ids qui se croisent, et un
+client qui lit par `after_id` pourrait sauter un message inséré en retard.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import locks
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Salon, Channel, Message, SalonMembership
+from .realtime import publish, topic_for
+
+logger = logging.getLogger(__name__)
+
+ID_BLOCK_SIZE = 100
+
+
+def write_behind_enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+
+def reserve_ids(count):
+    """Réserve `count` ids de message dans la séquence de la table, en ordre croissant."""
+    table = Message._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # Sous le verrou d'écriture (transaction IMMEDIATE) : pas de concurrence
+            cursor.execute("UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s", [count, table])
+            if not cursor.rowcount:
+                cursor.execute(
+                    f"INSERT INTO sqlite_sequence (name, seq) SELECT %s, COALESCE(MAX(id), 0) + %s FROM {table}",
+                    [table, count])
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            last = cursor.fetchone()[0]
+            return list(range(last - count + 1, last + 1))
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                           [table, count])
+            return sorted(row[0] for row in cursor.fetchall())
+    raise ImproperlyConfigured("CHAT_WRITE_BEHIND nécessite SQLite ou PostgreSQL.")
+
+
+def message_payload(entry):
+    """Même JSON que la réponse d'un envoi direct."""
+    return {
+        'id': entry['id'],
+        'auteur': entry['auteur'],
+        'contenu': entry['contenu'],
+        'date_envoi': entry['date_envoi'],
+    }
+
+
+def _insert(entries):
+    channel_salons = dict(Channel.objects.filter(
+        id__in={e['channel'] for e in entries if e['channel']}).values_list('id', 'salon_id'))
+    rows, memberships, conversations = [], {}, {}
+    for e in entries:
+        date_envoi = parse_datetime(e['date_envoi'])
+        rows.append(Message(id=e['id'], salon_id=e['salon'], channel_id=e['channel'],
+                            auteur_id=e['auteur_id'], contenu=e['contenu'], date_envoi=date_envoi))
+        salon_id = channel_salons.get(e['channel']) if e['channel'] else e['salon']
+        key = (salon_id, e['auteur_id'])
+        memberships[key] = (memberships.get(key, (0, None))[0] + 1, date_envoi)
+        # Entrées dans l'ordre des ids : la dernière vue est la plus récente
+        key = (salon_id, e['channel'])
+        conversations[key] = (conversations.get(key, (0,))[0] + 1, e['id'], date_envoi)
+    Message.objects.bulk_create(rows)
+    for (salon_id, user_id), (count, last) in memberships.items():
+        SalonMembership.record_message(salon_id, user_id, last, count)
+    for (salon_id, channel_id), (count, last_id, last_at) in conversations.items():
+        Salon.count_messages(salon_id, channel_id, count, last_id, last_at)
+    Salon.objects.filter(pk__in={e['salon'] for e in entries if e['salon']}).update(
+        messages_version=F('messages_version') + 1)
+    Channel.objects.filter(pk__in={e['channel'] for e in entries if e['channel']}).update(
+        messages_version=F('messages_version') + 1)
+    for e in entries:
+        publish(topic_for(e['salon'], e['channel']), {'type': 'message.created', 'message': message_payload(e)})
+
+
+def _still_valid(entries):
+    salons = set(Salon.objects.filter(id__in={e['salon'] for e in entries}).values_list('id', flat=True))
+    channels = set(Channel.objects.filter(id__in={e['channel'] for e in entries}).values_list('id', flat=True))
+    users = set(User.objects.filter(id__in={e['auteur_id'] for e in entries}).values_list('id', flat=True))
+    valid = [e for e in entries if e['auteur_id'] in users and (e['channel'] in channels or e['salon'] in salons)]
+    if len(valid) < len(entries):
+        logger.warning("%d queued messages dropped: salon, channel or author deleted",
+                       len(entries) - len(valid))
+    return valid
+
+
+def write_entries(entries):
+    """Insère les messages journalisés qui ne sont pas déjà en base. Retourne leur nombre."""
+    existing = set(Message.objects.filter(id__in=[e['id'] for e in entries]).values_list('id', flat=True))
+    entries = [e for e in entries if e['id'] not in existing]
+    if not entries:
+        return 0
+    try:
+        with transaction.atomic():
+            _insert(entries)
+    except IntegrityError:
+        # Salon, canal ou auteur supprimé entre l'envoi et l'insertion
+        entries = _still_valid(entries)
+        if entries:
+            with transaction.atomic():
+                _insert(entries)
+    return len(entries)
+
+
+def _read_journal(fh):
+    for line in fh:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Ligne coupée par un arrêt brutal : jamais confirmée au client
+            logger.warning("Skipping truncated journal line in %s", fh.name)
+
+
+def replay_journals(journal_dir, batch_size=500):
+    """Insère les messages des journaux abandonnés (processus arrêté), puis les supprime.
+
+    Les journaux encore verrouillés par un processus vivant sont laissés.
+    Retourne le nombre de messages insérés.
+    """
+    total = 0
+    for path in sorted(Path(journal_dir).glob('*.jsonl')):
+        with open(path, 'rb') as fh:
+            if not locks.lock(fh, locks.LOCK_EX | locks.LOCK_NB):
+                continue
+            entries = list(_read_journal(fh))
+            for i in range(0, len(entries), batch_size):
+                total += write_entries(entries[i:i + batch_size])
+        path.unlink()
+    return total
+
+
+class Ingester:
+    """File d'attente des messages d'un processus, avec son journal et son thread d'insertion."""
+
+    def __init__(self, journal_dir, batch_size=500, interval=0.05, fsync=True):
+        self.journal_dir = Path(journal_dir)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._queue = []
+        self._pending = set()
+        self._ids = []
+        self._segment = None
+        self._closed = []
+        self._counter = 0
+        self._thread = None
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+
+    def start(self):
+        replay_journals(self.journal_dir, self.batch_size)
+        self._thread = threading.Thread(target=self._run, name='chat-ingestion', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception:
+            # Le journal reste : il sera rejoué au prochain démarrage
+            logger.exception("Write-behind flush failed at shutdown")
+
+    def submit(self, user, contenu, salon_id=None, channel_id=None):
+        """Journalise un message et retourne son JSON (id et date définitifs)."""
+        with self._lock:
+            entry = {
+                'id': self._next_id(), 'salon': salon_id, 'channel': channel_id,
+                'auteur_id': user.id, 'auteur': user.username, 'contenu': contenu,
+                'date_envoi': timezone.now().isoformat(),
+            }
+            self._append(entry)
+            self._queue.append(entry)
+            self._pending.add(entry['id'])
+            full = len(self._queue) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return message_payload(entry)
+
+    def write_now(self, create):
+        """Insère un message pendant la requête, à son rang parmi ceux en attente.
+
+        `create(id)` reçoit l'id suivant de la file et doit insérer le
+        message avec cet id ; les messages en attente (ids plus petits) sont
+        insérés avant lui, les suivants après. Retourne le résultat de `create`.
+        """
+        with self._flush_lock:
+            with self._lock:
+                message_id = self._next_id()
+            self._flush()
+            return create(message_id)
+
+    def _next_id(self):
+        # Appelé sous self._lock
+        if not self._ids:
+            self._ids = reserve_ids(ID_BLOCK_SIZE)
+        return self._ids.pop(0)
+
+    def _append(self, entry):
+        if self._segment is None:
+            self._counter += 1
+            path = self.journal_dir / f'{os.getpid()}-{self._counter}.jsonl'
+            fh = open(path, 'ab')
+            locks.lock(fh, locks.LOCK_EX | locks.LOCK_NB)
+            self._segment = (path, fh)
+        fh = self._segment[1]
+        fh.write(json.dumps(entry, ensure_ascii=False).encode() + b'\n')
+        fh.flush()
+        if self.fsync:
+            os.fsync(fh.fileno())
+
+    def flush(self):
+        """Insère tout ce qui est en attente. Retourne le nombre de messages insérés."""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        # Appelé sous self._flush_lock
+        with self._lock:
+            entries, self._queue = self._queue, []
+            if self._segment is not None:
+                self._closed.append(self._segment)
+                self._segment = None
+            segments, self._closed = self._closed, []
+        if not entries:
+            return 0
+        try:
+            count = write_entries(entries)
+        except Exception:
+            # Réessayé au prochain passage ; le journal reste en place
+            with self._lock:
+                self._queue[:0] = entries
+                self._closed[:0] = segments
+            raise
+        with self._lock:
+            self._pending.difference_update(e['id'] for e in entries)
+        for path, fh in segments:
+            fh.close()
+            path.unlink(missing_ok=True)
+        return count
+
+    def ensure_written(self, message_id):
+        """Insère la file si `message_id` y attend encore (modification, suppression)."""
+        if message_id in self._pending:
+            self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed, retrying")
+                connection.close_if_unusable_or_obsolete()
+                self._stopped.wait(1)
+        connection.close()
+
+
+_ingester = None
+_ingester_lock = threading.Lock()
+
+
+def get_ingester():
+    """Ingester du processus, démarré au premier message."""
+    global _ingester
+    if _ingester is None:
+        with _ingester_lock:
+            if _ingester is None:
+                ingester = Ingester(
+                    settings.CHAT_WRITE_BEHIND_JOURNAL,
+                    batch_size=settings.CHAT_WRITE_BEHIND_BATCH,
+                    interval=settings.CHAT_WRITE_BEHIND_INTERVAL,
+                    fsync=settings.CHAT_WRITE_BEHIND_FSYNC,
+                )
+                ingester.start()
+                _ingester = ingester
+    return _ingester
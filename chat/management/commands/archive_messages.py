@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from chat.archive import ARCHIVE_BATCH_SIZE, archive_salon
+from chat.models import Salon
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves messages beyond each salon's retention policy (retention_jours / "
+        "retention_messages) into the compressed archive, in batches. Run it periodically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salon', help="Only this salon (slug).")
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        salons = Salon.objects.filter(Q(retention_jours__isnull=False) | Q(retention_messages__isnull=False))
+        if options['salon']:
+            salons = Salon.objects.filter(slug=options['salon'])
+            if not salons.exists():
+                raise CommandError(f"Unknown salon '{options['salon']}'.")
+        total = 0
+        for salon in salons.order_by('id'):
+            count = archive_salon(salon, batch_size=options['batch_size'], pause=options['pause'])
+            if count:
+                self.stdout.write(f"{salon.slug}: {count} messages archived.")
+            total += count
+        self.stdout.write(self.style.SUCCESS(f"{total} messages archived."))
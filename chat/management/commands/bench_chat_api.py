@@ -0,0 +1,270 @@
+import json
+import statistics
+import subprocess
+import time
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from chat import urls as chat_urls
+from chat.models import Salon, Message, SalonRole, Ban
+
+# Messages demandés aux vues d'historique en streaming
+STREAM_BENCH_LIMIT = 10000
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Scenario:
+    """Une requête mesurée : `setup` (non chronométré) prépare l'état,
+    `request` retourne (méthode, url, kwargs du client de test)."""
+
+    def __init__(self, name, request, setup=None):
+        self.name = name
+        self.request = request
+        self.setup = setup
+
+
+class Context:
+    def __init__(self, salon, channel, user, target):
+        self.salon = salon
+        self.channel = channel
+        self.user = user
+        self.target = target
+        self.own_message = Message.objects.create(salon=salon, auteur=user, contenu="bench")
+        # Curseur de poll : aucun message plus récent
+        self.last_id = self.own_message.id
+
+    def latest_id(self, entity):
+        """Curseur d'un long-poll qui attend vraiment : le dernier message, envois des scénarios compris."""
+        return entity.messages.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def new_message(self):
+        return Message.objects.create(salon=self.salon, auteur=self.user, contenu="à supprimer")
+
+
+def json_post(data):
+    return {'data': json.dumps(data), 'content_type': 'application/json'}
+
+
+def build_scenarios(ctx):
+    """Scénarios par nom de route de chat/urls.py (plusieurs variantes possibles)."""
+    s, c = ctx.salon.slug, ctx.channel.slug
+    return {
+        'api_exemple': [Scenario('api_exemple', lambda: ('get', reverse('api_exemple'), {}))],
+        'api_messages_list': [
+            Scenario('api_messages_list', lambda: ('get', reverse('api_messages_list', args=[s]), {})),
+            Scenario('api_messages_list?after_id', lambda: (
+                'get', reverse('api_messages_list', args=[s]), {'data': {'after_id': ctx.last_id}})),
+        ],
+        'api_messages_wait': [Scenario('api_messages_wait', lambda: (
+            'get', reverse('api_messages_wait', args=[s]),
+            {'data': {'after_id': ctx.latest_id(ctx.salon), 'timeout': 0}}))],
+        # Fenêtre large : le coût suit la taille de l'historique, pas d'une page
+        'api_messages_stream': [Scenario('api_messages_stream', lambda: (
+            'get', reverse('api_messages_stream', args=[s]), {'data': {'limit': STREAM_BENCH_LIMIT}}))],
+        'api_messages_search': [Scenario('api_messages_search', lambda: (
+            'get', reverse('api_messages_search', args=[s]), {'data': {'q': 'message'}}))],
+        'api_messages_post': [Scenario('api_messages_post', lambda: (
+            'post', reverse('api_messages_post', args=[s]), json_post({'contenu': 'bench'})))],
+        'api_channel_messages_list': [
+            Scenario('api_channel_messages_list', lambda: (
+                'get', reverse('api_channel_messages_list', args=[s, c]), {})),
+        ],
+        'api_channel_messages_wait': [Scenario('api_channel_messages_wait', lambda: (
+            'get', reverse('api_channel_messages_wait', args=[s, c]),
+            {'data': {'after_id': ctx.latest_id(ctx.channel), 'timeout': 0}}))],
+        'api_channel_messages_stream': [Scenario('api_channel_messages_stream', lambda: (
+            'get', reverse('api_channel_messages_stream', args=[s, c]), {'data': {'limit': STREAM_BENCH_LIMIT}}))],
+        'api_channel_messages_search': [Scenario('api_channel_messages_search', lambda: (
+            'get', reverse('api_channel_messages_search', args=[s, c]), {'data': {'q': 'message'}}))],
+        'api_channel_messages_post': [Scenario('api_channel_messages_post', lambda: (
+            'post', reverse('api_channel_messages_post', args=[s, c]), json_post({'contenu': 'bench'})))],
+        'api_messages_edit': [Scenario('api_messages_edit', lambda: (
+            'post', reverse('api_messages_edit', args=[ctx.own_message.id]), json_post({'contenu': 'modifié'})))],
+        'api_messages_delete': [Scenario(
+            'api_messages_delete',
+            lambda: ('post', reverse('api_messages_delete', args=[ctx.pending.id]), {}),
+            setup=lambda: setattr(ctx, 'pending', ctx.new_message()),
+        )],
+        'api_salon_ban': [Scenario(
+            'api_salon_ban',
+            lambda: ('post', reverse('api_salon_ban', args=[s]), json_post({'user_id': ctx.target.id})),
+            setup=lambda: Ban.objects.filter(salon=ctx.salon, user=ctx.target).update(is_active=False),
+        )],
+        'api_salon_unban': [Scenario(
+            'api_salon_unban',
+            lambda: ('post', reverse('api_salon_unban', args=[s]), json_post({'user_id': ctx.target.id})),
+            setup=lambda: Ban.objects.update_or_create(
+                salon=ctx.salon, user=ctx.target, defaults={'banned_by': ctx.user, 'is_active': True}),
+        )],
+        'api_salon_promote': [Scenario(
+            'api_salon_promote',
+            lambda: ('post', reverse('api_salon_promote', args=[s]), json_post({'user_id': ctx.target.id})),
+            setup=lambda: SalonRole.objects.filter(salon=ctx.salon, user=ctx.target).delete(),
+        )],
+        'api_salon_demote': [Scenario(
+            'api_salon_demote',
+            lambda: ('post', reverse('api_salon_demote', args=[s]), json_post({'user_id': ctx.target.id})),
+            setup=lambda: SalonRole.objects.get_or_create(
+                salon=ctx.salon, user=ctx.target, defaults={'role': 'moderator'}),
+        )],
+        'api_salon_users': [Scenario('api_salon_users', lambda: (
+            'get', reverse('api_salon_users', args=[s]), {}))],
+        'api_salon_my_permissions': [Scenario('api_salon_my_permissions', lambda: (
+            'get', reverse('api_salon_my_permissions', args=[s]), {}))],
+        'api_salon_export': [Scenario('api_salon_export', lambda: (
+            'get', reverse('api_salon_export', args=[s]), {}))],
+    }
+
+
+def api_route_names():
+    return [p.name for p in chat_urls.urlpatterns if p.name and p.name.startswith('api_')]
+
+
+def read_body(response):
+    """Corps complet de la réponse, en streaming (synchrone ou asynchrone) ou non."""
+    if not response.streaming:
+        return response.content
+    if response.is_async:
+        async def collect():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(collect)()
+    return b''.join(response.streaming_content)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks every API endpoint of chat/urls.py (latency percentiles, query counts, "
+        "response sizes). Writes to the configured database: run it on a generated dataset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salon', help="Slug of the salon to use (default: most recent salon).")
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', nargs='*', help="Only run these scenario names.")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--compare', help="Previous JSON report to compare against.")
+
+    # On mesure le coût des vues, pas la limitation de débit
+    @override_settings(CHAT_RATELIMIT_ENABLED=False)
+    def handle(self, *args, **options):
+        salon = self.pick_salon(options['salon'])
+        channel = salon.channels.order_by('id').first()
+        if channel is None:
+            raise CommandError(f"Salon '{salon.slug}' has no channel.")
+        target = User.objects.exclude(id=salon.createur_id).order_by('id').first()
+        if target is None:
+            raise CommandError("At least two users are required.")
+
+        ctx = Context(salon, channel, salon.createur, target)
+        client = Client()
+        client.force_login(ctx.user)
+
+        scenarios = build_scenarios(ctx)
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'date': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'salon': salon.slug,
+                'salon_messages': Message.objects.filter(salon=salon).count(),
+                'iterations': options['iterations'],
+            },
+            'endpoints': {},
+            'skipped': [],
+        }
+        for route in api_route_names():
+            if route not in scenarios:
+                report['skipped'].append(route)
+                continue
+            for scenario in scenarios[route]:
+                if options['only'] and scenario.name not in options['only']:
+                    continue
+                result = self.run_scenario(client, scenario, options['iterations'], options['warmup'])
+                report['endpoints'][scenario.name] = result
+                self.stdout.write(
+                    f"{scenario.name:32} p50={result['p50_ms']:8.2f}ms p90={result['p90_ms']:8.2f}ms "
+                    f"p99={result['p99_ms']:8.2f}ms queries={result['queries']:4} bytes={result['bytes']}"
+                )
+        for route in report['skipped']:
+            self.stderr.write(f"No benchmark scenario for route '{route}'.")
+
+        ctx.own_message.delete()
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def pick_salon(self, slug):
+        if slug:
+            try:
+                return Salon.objects.get(slug=slug)
+            except Salon.DoesNotExist:
+                raise CommandError(f"Unknown salon '{slug}'.")
+        salon = Salon.objects.order_by('-id').first()
+        if salon is None:
+            raise CommandError("No salon: run generate_chat_data first.")
+        return salon
+
+    def run_scenario(self, client, scenario, iterations, warmup):
+        timings, queries, sizes, statuses = [], [], [], set()
+        for i in range(warmup + iterations):
+            if scenario.setup:
+                scenario.setup()
+            method, url, kwargs = scenario.request()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, **kwargs)
+                body = read_body(response)
+                elapsed = time.perf_counter() - start
+            if i < warmup:
+                continue
+            timings.append(elapsed * 1000)
+            queries.append(len(captured))
+            sizes.append(len(body))
+            statuses.add(response.status_code)
+        return {
+            'p50_ms': percentile(timings, 50),
+            'p90_ms': percentile(timings, 90),
+            'p99_ms': percentile(timings, 99),
+            'mean_ms': statistics.fmean(timings),
+            'max_ms': max(timings),
+            'queries': max(queries),
+            'bytes': round(statistics.fmean(sizes)),
+            'status': sorted(statuses),
+        }
+
+    def compare(self, report, path):
+        with open(path) as fh:
+            previous = json.load(fh)
+        self.stdout.write(f"\nCompared to {previous['meta'].get('revision')} ({path}):")
+        for name, result in report['endpoints'].items():
+            before = previous['endpoints'].get(name)
+            if not before:
+                continue
+            delta = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            self.stdout.write(
+                f"{name:32} p50 {before['p50_ms']:8.2f} -> {result['p50_ms']:8.2f}ms ({delta:+.0f}%) "
+                f"queries {before['queries']} -> {result['queries']} bytes {before['bytes']} -> {result['bytes']}"
+            )
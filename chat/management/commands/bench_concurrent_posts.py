@@ -0,0 +1,120 @@
+import json
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.ingestion import get_ingester
+from chat.models import Salon, Message
+
+from .bench_chat_api import git_revision, percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures message post throughput with concurrent clients (one thread and one "
+        "database connection each), to compare database backends and settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salon', help="Slug of the salon to post into (default: most recent salon).")
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--posts', type=int, default=100, help="Posts per thread.")
+        parser.add_argument('--write-behind', action='store_true',
+                            help="Post through the write-behind queue (CHAT_WRITE_BEHIND).")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+
+    # On mesure le coût des vues, pas la limitation de débit
+    @override_settings(CHAT_RATELIMIT_ENABLED=False)
+    def handle(self, *args, **options):
+        if options['write_behind']:
+            with override_settings(CHAT_WRITE_BEHIND=True):
+                return self.run(options)
+        return self.run(options)
+
+    def run(self, options):
+        salon = Salon.objects.filter(slug=options['salon']).first() if options['salon'] \
+            else Salon.objects.order_by('-id').first()
+        if salon is None:
+            raise CommandError("No salon: run generate_chat_data first (or pass --salon).")
+        url = reverse('api_messages_post', args=[salon.slug])
+        start_id = Message.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        timings, statuses, errors = [], [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+
+        def worker():
+            client = Client()
+            client.force_login(salon.createur)
+            local_timings, local_statuses = [], []
+            try:
+                barrier.wait()
+                for i in range(options['posts']):
+                    begin = time.perf_counter()
+                    try:
+                        response = client.post(url, data=json.dumps({'contenu': f'bench {i}'}),
+                                               content_type='application/json')
+                        local_statuses.append(response.status_code)
+                    except Exception as exc:
+                        # Typiquement « database is locked » sans busy_timeout
+                        with lock:
+                            errors.append(repr(exc))
+                    local_timings.append((time.perf_counter() - begin) * 1000)
+            finally:
+                connection.close()
+                with lock:
+                    timings.extend(local_timings)
+                    statuses.extend(local_statuses)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        begin = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - begin
+        if options['write_behind']:
+            # Débit d'acquittement ; la file est vidée avant de compter les messages
+            get_ingester().flush()
+
+        created = Message.objects.filter(salon=salon, id__gt=start_id, contenu__startswith='bench ')
+        ok = sum(1 for status in statuses if status in (200, 202))
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'date': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'settings': {k: v for k, v in connection.settings_dict.get('OPTIONS', {}).items()},
+                'threads': options['threads'],
+                'posts_per_thread': options['posts'],
+                'write_behind': options['write_behind'],
+            },
+            'posts_per_s': ok / elapsed if elapsed else 0,
+            'ok': ok,
+            'failed': len(statuses) - ok + len(errors),
+            'errors': sorted(set(errors))[:5],
+            'p50_ms': percentile(timings, 50) if timings else None,
+            'p99_ms': percentile(timings, 99) if timings else None,
+            'mean_ms': statistics.fmean(timings) if timings else None,
+            'stored': created.count(),
+        }
+        created.delete()
+        # La suppression en bloc ne tient pas les compteurs du salon (message_count, last_message_*)
+        salon.reconcile_counters()
+
+        self.stdout.write(
+            f"{connection.vendor}: {report['posts_per_s']:.1f} posts/s with {options['threads']} threads, "
+            f"{report['ok']} ok, {report['failed']} failed, p50={report['p50_ms'] or 0:.2f}ms "
+            f"p99={report['p99_ms'] or 0:.2f}ms"
+        )
+        for error in report['errors']:
+            self.stderr.write(error)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2, default=str)
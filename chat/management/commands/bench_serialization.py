@@ -0,0 +1,83 @@
+import importlib.util
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import JsonResponse
+from django.utils import timezone
+
+from chat.models import Salon, Message
+from chat.serializers import dumps, message_data, message_rows
+
+from .bench_chat_api import git_revision
+
+
+def legacy_page(qs):
+    """Sérialisation d'avant chat/serializers.py : instances, isoformat, JsonResponse."""
+    data = []
+    for m in qs.select_related('auteur'):
+        msg_data = {
+            'id': m.id,
+            'auteur': m.auteur.username,
+            'contenu': m.contenu,
+            'date_envoi': m.date_envoi.isoformat(),
+        }
+        msg_data.update(m.file_data())
+        data.append(msg_data)
+    return JsonResponse({'messages': data, 'has_more': False}).content
+
+
+def rows_page(qs, encoder):
+    return encoder({'messages': [message_data(row) for row in message_rows(qs)], 'has_more': False})
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the CPU time per message of a message list page (fetch and encode): "
+        "model instances with JsonResponse against .values() rows with each available encoder."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salon', help="Slug of the salon to read (default: the salon with the most messages).")
+        parser.add_argument('--messages', type=int, default=200, help="Messages per page.")
+        parser.add_argument('--rounds', type=int, default=30)
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        salons = Salon.objects.filter(slug=options['salon']) if options['salon'] else \
+            Salon.objects.order_by('-message_count')
+        salon = salons.first()
+        if salon is None:
+            raise CommandError("No salon: run generate_chat_data first (or pass --salon).")
+        qs = Message.objects.filter(salon=salon).order_by('-id')[:options['messages']]
+        count = qs.count()
+        if not count:
+            raise CommandError(f"Salon '{salon.slug}' has no message.")
+
+        variants = {
+            'instances+JsonResponse': lambda: legacy_page(qs),
+            'values+json': lambda: rows_page(qs, dumps),
+        }
+        if importlib.util.find_spec('orjson'):
+            import orjson
+            variants['values+orjson'] = lambda: rows_page(qs, orjson.dumps)
+
+        report = {
+            'meta': {'revision': git_revision(), 'date': timezone.now().isoformat(),
+                     'salon': salon.slug, 'messages': count, 'rounds': options['rounds']},
+            'variants': {},
+        }
+        for name, run in variants.items():
+            run()
+            timings = []
+            for _ in range(options['rounds']):
+                begin = time.process_time()
+                size = len(run())
+                timings.append((time.process_time() - begin) / count * 1e6)
+            result = {'cpu_us_per_message': statistics.median(timings), 'bytes': size}
+            report['variants'][name] = result
+            self.stdout.write(f"{name:24} {result['cpu_us_per_message']:7.2f} µs CPU/message  bytes={size}")
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
@@ -0,0 +1,121 @@
+import os
+from collections import Counter
+
+from django.core.files.base import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from chat.archive import decode, encode
+from chat.models import Message, ArchivedMessageBatch, StoredFile
+from chat.storage import attachment_storage, file_digest, hashed_name, is_hashed_name
+
+FILE_FIELDS = ('fichier', 'miniature')
+
+
+def archived_files():
+    """Nombre de références par nom de fichier dans les lots archivés."""
+    counts = Counter()
+    for batch in ArchivedMessageBatch.objects.only('data').iterator(chunk_size=100):
+        for entry in decode(batch):
+            counts.update(entry[field] for field in FILE_FIELDS if entry.get(field))
+    return counts
+
+
+def rename_archived(renames):
+    """Remplace les anciens noms de fichiers par leur nom adressé dans les lots archivés."""
+    for batch in ArchivedMessageBatch.objects.only('data').iterator(chunk_size=100):
+        entries = decode(batch)
+        changed = False
+        for entry in entries:
+            for field in FILE_FIELDS:
+                name = entry.get(field)
+                if name in renames:
+                    if field == 'fichier' and not entry.get('fichier_nom'):
+                        entry['fichier_nom'] = os.path.basename(name)
+                    entry[field] = renames[name]
+                    changed = True
+        if changed:
+            ArchivedMessageBatch.objects.filter(pk=batch.pk).update(data=encode(entries))
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves attachments stored before content addressing to their digest name "
+        "(one copy per content), in messages and archived batches, then recounts "
+        "the StoredFile references."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be done.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved = duplicates = saved = missing = 0
+        archived = archived_files()
+        renames = {}
+        for field in FILE_FIELDS:
+            prefix = Message._meta.get_field(field).upload_to
+            names = set(Message.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                        .values_list(field, flat=True).distinct())
+            names.update(name for name in archived if name.startswith(prefix))
+            for name in sorted(n for n in names if not is_hashed_name(n)):
+                if not attachment_storage.exists(name):
+                    missing += 1
+                    self.stderr.write(f"Missing file: {name}")
+                    continue
+                with attachment_storage.open(name, 'rb') as fh:
+                    content = File(fh, name)
+                    content.sha256 = file_digest(content)
+                    target = hashed_name(content.sha256, prefix + os.path.basename(name))
+                    exists = attachment_storage.exists(target)
+                    if exists:
+                        duplicates += 1
+                        saved += attachment_storage.size(name)
+                    moved += 1
+                    if dry_run:
+                        continue
+                    if not exists:
+                        target = attachment_storage.save(prefix + os.path.basename(name), content)
+                with transaction.atomic():
+                    if field == 'fichier':
+                        Message.objects.filter(fichier=name, fichier_nom='').update(
+                            fichier_nom=os.path.basename(name))
+                    Message.objects.filter(**{field: name}).update(**{field: target})
+                renames[name] = target
+
+        if not dry_run:
+            # Les anciens fichiers ne sont supprimés qu'une fois plus
+            # référencés, ni par un message ni par l'archive
+            with transaction.atomic():
+                rename_archived(renames)
+                self.recount()
+            for name in renames:
+                attachment_storage.delete(name)
+        verb = "would be" if dry_run else "were"
+        self.stdout.write(self.style.SUCCESS(
+            f"{moved} files {verb} moved to content-addressed names, {duplicates} duplicates "
+            f"({saved} bytes) {verb} removed, {missing} missing files."
+        ))
+
+    def recount(self):
+        """Recalcule `StoredFile` depuis les messages et l'archive (répare aussi un comptage faussé)."""
+        counts = {name: n for name, n in archived_files().items() if is_hashed_name(name)}
+        for field in FILE_FIELDS:
+            rows = (Message.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                    .values_list(field).annotate(n=Count('id')).order_by())
+            for name, n in rows:
+                if is_hashed_name(name):
+                    counts[name] = counts.get(name, 0) + n
+        with transaction.atomic():
+            existing = dict(StoredFile.objects.values_list('name', 'ref_count'))
+            stale = [name for name in existing if name not in counts]
+            for i in range(0, len(stale), 500):
+                StoredFile.objects.filter(name__in=stale[i:i + 500]).delete()
+            StoredFile.objects.bulk_create(
+                [StoredFile(name=name, ref_count=n) for name, n in counts.items() if name not in existing],
+                batch_size=1000,
+            )
+            for name, n in counts.items():
+                if name in existing and existing[name] != n:
+                    StoredFile.objects.filter(name=name).update(ref_count=n)
@@ -0,0 +1,82 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from chat.conversations import conversation_query
+from chat.models import Salon, Message, SalonMembership, SalonRole, Ban
+from chat.views import MESSAGES_PAGE_SIZE
+
+# Motifs signalant un parcours complet ou un tri hors index, par moteur
+PLAN_PROBLEMS = {
+    'sqlite': [
+        (re.compile(r'\bSCAN (\w+)'), 'full scan'),
+        (re.compile(r'USE TEMP B-TREE FOR ORDER BY'), 'filesort'),
+    ],
+    'postgresql': [
+        (re.compile(r'Seq Scan on (\w+)'), 'full scan'),
+        (re.compile(r'^\s*(?:->\s*)?Sort\b', re.M), 'filesort'),
+    ],
+}
+
+
+def hot_queries(salon_id, channel_id, user_id):
+    """Requêtes exécutées à chaque poll / envoi par chat.views."""
+    page = MESSAGES_PAGE_SIZE + 1
+    salon_messages = Message.objects.filter(salon_id=salon_id).select_related('auteur')
+    channel_messages = Message.objects.filter(channel_id=channel_id).select_related('auteur')
+    return [
+        # Conversation de l'URL, chargée une fois par requête (ETag puis vue)
+        ('conversation: salon', conversation_query('x')),
+        ('conversation: channel', conversation_query('x', 'y')),
+        ('users / permissions etag', Salon.objects.filter(slug='x').values_list('id', 'users_version')),
+        ('salon messages: latest page', salon_messages.order_by('-id')[:page]),
+        ('salon messages: after_id', salon_messages.filter(id__gt=0).order_by('id')[:page]),
+        ('salon messages: before_id', salon_messages.filter(id__lt=2 ** 62).order_by('-id')[:page]),
+        ('channel messages: latest page', channel_messages.order_by('-id')[:page]),
+        ('channel messages: after_id', channel_messages.filter(id__gt=0).order_by('id')[:page]),
+        ('channel messages: before_id', channel_messages.filter(id__lt=2 ** 62).order_by('-id')[:page]),
+        ('author history', Message.objects.filter(auteur_id=user_id).order_by('-date_envoi')[:page]),
+        ('salon users: memberships', SalonMembership.objects.filter(salon_id=salon_id).values_list('user_id')),
+        ('salon users: roles', SalonRole.objects.filter(salon_id=salon_id).values_list('user_id', 'role')),
+        ('salon users: bans', Ban.objects.filter(salon_id=salon_id, is_active=True).values_list('user_id')),
+        ('permissions', Salon.objects.filter(pk=salon_id).annotate(
+            user_role=Subquery(SalonRole.objects.filter(salon=OuterRef('pk'), user_id=user_id).values('role')[:1]),
+            user_banned=Exists(Ban.objects.filter(salon=OuterRef('pk'), user_id=user_id, is_active=True)),
+        ).values_list('user_role', 'user_banned')),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Runs EXPLAIN on the hot chat queries and fails on full scans or filesorts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan.")
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in PLAN_PROBLEMS:
+            raise CommandError(f"Unsupported database vendor: {vendor}")
+
+        problems = []
+        with transaction.atomic():
+            if vendor == 'postgresql':
+                # Sur de petites tables le planificateur préfère toujours un
+                # Seq Scan : on le lui interdit pour vérifier qu'un index existe.
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, qs in hot_queries(salon_id=1, channel_id=1, user_id=1):
+                plan = qs.explain()
+                if options['verbose_plans']:
+                    self.stdout.write(f"-- {name}\n{plan}\n")
+                for pattern, label in PLAN_PROBLEMS[vendor]:
+                    match = pattern.search(plan)
+                    if match:
+                        problems.append(f"{name}: {label} ({match.group(0).strip()})")
+
+        if problems:
+            for problem in problems:
+                self.stderr.write(problem)
+            raise CommandError(f"{len(problems)} query plan problem(s) found.")
+        self.stdout.write(self.style.SUCCESS("All hot queries use an index."))
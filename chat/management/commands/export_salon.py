@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.models import Salon
+from chat.transfer import EXPORT_CHUNK_SIZE, export_salon
+
+
+class Command(BaseCommand):
+    help = "Exports a salon (channels, roles, bans, messages) as NDJSON, streamed with constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug')
+        parser.add_argument('--output', '-o', help="Output file (default: stdout).")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            salon = Salon.objects.select_related('createur').get(slug=options['slug'])
+        except Salon.DoesNotExist:
+            raise CommandError(f"Unknown salon '{options['slug']}'.")
+        lines = export_salon(salon, chunk_size=options['chunk_size'])
+        if not options['output']:
+            # Pas de self.stdout : il ajoute un saut de ligne à chaque écriture
+            sys.stdout.writelines(lines)
+            return
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8') as fh:
+            for line in lines:
+                fh.write(line)
+                count += 1
+        self.stderr.write(f"{count} lines written to {options['output']}.")
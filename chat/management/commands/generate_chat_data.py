@@ -0,0 +1,101 @@
+import random
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chat.directory import bump_directory_version
+from chat.models import Salon, Channel, Message, SalonMembership, SalonRole, Ban
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "Generates a synthetic dataset (salons × channels × messages, users, roles, bans) for benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salons', type=int, default=10)
+        parser.add_argument('--channels', type=int, default=3, help="Channels per salon.")
+        parser.add_argument('--messages', type=int, default=1000, help="Messages per salon and per channel.")
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--moderators', type=int, default=2, help="Moderators per salon.")
+        parser.add_argument('--bans', type=int, default=2, help="Banned users per salon.")
+        parser.add_argument('--prefix', default='bench', help="Prefix for generated names and slugs.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        with transaction.atomic():
+            users = self.create_users(prefix, options['users'])
+            salons = Salon.objects.bulk_create([
+                Salon(nom=f"{prefix} salon {i}", slug=f"{prefix}-salon-{i}",
+                      description=f"Salon généré n°{i}", createur=rng.choice(users))
+                for i in range(options['salons'])
+            ])
+            channels = Channel.objects.bulk_create([
+                Channel(nom=f"canal {j}", slug=f"{prefix}-salon-{i}-canal-{j}", salon=salon)
+                for i, salon in enumerate(salons)
+                for j in range(options['channels'])
+            ])
+
+            message_count = self.create_messages(rng, users, salons, channels, options['messages'])
+            self.create_roles_and_bans(rng, users, salons, options['moderators'], options['bans'])
+            # bulk_create ne passe ni par les compteurs ni par les signaux
+            for salon in salons:
+                salon.reconcile_counters()
+        bump_directory_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(users)} users, {len(salons)} salons, {len(channels)} channels, "
+            f"{message_count} messages generated (prefix '{prefix}')."
+        ))
+
+    def create_users(self, prefix, count):
+        existing = {u.username: u for u in User.objects.filter(username__startswith=f"{prefix}_user_")}
+        new = [
+            User(username=f"{prefix}_user_{i}", password='!')
+            for i in range(count) if f"{prefix}_user_{i}" not in existing
+        ]
+        User.objects.bulk_create(new, batch_size=BATCH_SIZE)
+        return list(User.objects.filter(username__startswith=f"{prefix}_user_").order_by('id'))
+
+    def create_messages(self, rng, users, salons, channels, per_target):
+        memberships = defaultdict(int)
+        batch = []
+        total = 0
+        targets = [('salon', s, s.id) for s in salons] + [('channel', c, c.salon_id) for c in channels]
+        for field, target, salon_id in targets:
+            for k in range(per_target):
+                auteur = rng.choice(users)
+                batch.append(Message(**{field: target}, auteur=auteur, contenu=f"Message {k} de {auteur.username}"))
+                memberships[(salon_id, auteur.id)] += 1
+                if len(batch) >= BATCH_SIZE:
+                    Message.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+        Message.objects.bulk_create(batch)
+        total += len(batch)
+
+        now = timezone.now()
+        SalonMembership.objects.bulk_create([
+            SalonMembership(salon_id=salon_id, user_id=user_id, message_count=count,
+                            first_message_at=now, last_message_at=now)
+            for (salon_id, user_id), count in memberships.items()
+        ], batch_size=BATCH_SIZE)
+        return total
+
+    def create_roles_and_bans(self, rng, users, salons, moderators, bans):
+        roles, ban_rows = [], []
+        for salon in salons:
+            others = [u for u in users if u.id != salon.createur_id]
+            picked = rng.sample(others, min(len(others), moderators + bans))
+            for user in picked[:moderators]:
+                roles.append(SalonRole(salon=salon, user=user, role='moderator'))
+            for user in picked[moderators:]:
+                ban_rows.append(Ban(salon=salon, user=user, banned_by=salon.createur, reason="Généré"))
+        SalonRole.objects.bulk_create(roles, batch_size=BATCH_SIZE)
+        Ban.objects.bulk_create(ban_rows, batch_size=BATCH_SIZE)
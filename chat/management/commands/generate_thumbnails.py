@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import Message
+from chat.thumbnails import generate_thumbnail, is_image
+
+
+class Command(BaseCommand):
+    help = "Generates missing thumbnails and dimensions for image attachments (messages sent before thumbnailing)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Regenerate thumbnails that already exist.")
+
+    def handle(self, *args, **options):
+        qs = Message.objects.exclude(fichier='').exclude(fichier__isnull=True)
+        if not options['all']:
+            qs = qs.filter(largeur__isnull=True)
+        done = skipped = 0
+        for message_id, name in qs.values_list('id', 'fichier').iterator(chunk_size=500):
+            if is_image(name) and generate_thumbnail(message_id):
+                done += 1
+            else:
+                skipped += 1
+        self.stdout.write(self.style.SUCCESS(f"{done} thumbnails generated, {skipped} attachments skipped."))
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.transfer import IMPORT_BATCH_SIZE, TransferError, import_salon
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports a salon from an NDJSON export (see export_salon). Users are matched by "
+        "username and created without a usable password when missing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, or '-' for stdin.")
+        parser.add_argument('--slug', help="Import under this slug instead of the exported one.")
+        parser.add_argument('--nom', help="Import under this name instead of the exported one.")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        fh = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            salon, stats = import_salon(fh, slug=options['slug'], nom=options['nom'],
+                                        batch_size=options['batch_size'])
+        except TransferError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if fh is not sys.stdin:
+                fh.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Salon '{salon.slug}' imported: {stats['messages']} messages, {stats['channels']} channels, "
+            f"{stats['roles']} roles, {stats['bans']} bans, {stats['users_created']} users created."
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chat.models import Salon
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the denormalized counters of salons and channels (message_count, "
+        "channel_count, last_message_id, last_message_at) from the messages, and reports drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--salon', help="Only this salon (slug).")
+
+    def handle(self, *args, **options):
+        salons = Salon.objects.all()
+        if options['salon']:
+            salons = salons.filter(slug=options['salon'])
+            if not salons.exists():
+                raise CommandError(f"Unknown salon '{options['salon']}'.")
+        fields = ('message_count', 'channel_count', 'last_message_id', 'last_message_at')
+        fixed = 0
+        for salon in salons.order_by('id').iterator():
+            before = [getattr(salon, field) for field in fields]
+            with transaction.atomic():
+                salon.reconcile_counters()
+            salon.refresh_from_db(fields=fields)
+            if [getattr(salon, field) for field in fields] != before:
+                fixed += 1
+                self.stdout.write(f"{salon.slug}: counters fixed.")
+        self.stdout.write(self.style.SUCCESS(f"{fixed} salons had drifted counters."))
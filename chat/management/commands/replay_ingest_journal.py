@@ -0,0 +1,26 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.ingestion import replay_journals
+
+
+class Command(BaseCommand):
+    help = (
+        "Inserts the messages left in the write-behind journal by a process that "
+        "stopped before flushing them (CHAT_WRITE_BEHIND). Journals still locked by a "
+        "running process are skipped; messages already in the database are ignored."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journal', default=settings.CHAT_WRITE_BEHIND_JOURNAL,
+                            help="Journal directory (default: CHAT_WRITE_BEHIND_JOURNAL).")
+        parser.add_argument('--batch-size', type=int, default=settings.CHAT_WRITE_BEHIND_BATCH)
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['journal']):
+            self.stdout.write("No journal to replay.")
+            return
+        count = replay_journals(options['journal'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"{count} messages replayed."))
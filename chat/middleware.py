@@ -0,0 +1,36 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise utilisable dans une pile de middlewares asynchrone.
+
+    `WhiteNoiseMiddleware` n'est que synchrone : sous ASGI, Django exécute
+    alors toute la pile (et les vues async) dans le thread des appels
+    synchrones, et une requête de long-poll bloque ce thread pour tout le
+    processus. Ici la recherche du fichier reste en mémoire (sans
+    `autorefresh`) et la suite de la pile est attendue sans changer de thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
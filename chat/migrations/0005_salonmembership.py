@@ -0,0 +1,88 @@
+# Generated by Django 6.0 on 2026-10-18 08:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+from django.db.models.functions import Coalesce
+
+
+def backfill_memberships(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+    SalonMembership = apps.get_model("chat", "SalonMembership")
+
+    # Un seul salon par message, même s'il a `salon` et `channel` (le canal
+    # l'emporte, comme dans 0014) : il n'est compté qu'une fois
+    rows = (
+        Message.objects.annotate(salon_key=Coalesce("channel__salon_id", "salon_id"))
+        .filter(salon_key__isnull=False)
+        .values("salon_key", "auteur_id")
+        .annotate(first=Min("date_envoi"), last=Max("date_envoi"), count=Count("id"))
+        .order_by()
+    )
+    stats = {
+        (row["salon_key"], row["auteur_id"]): (row["first"], row["last"], row["count"])
+        for row in rows
+    }
+
+    SalonMembership.objects.bulk_create(
+        [
+            SalonMembership(
+                salon_id=salon_id,
+                user_id=user_id,
+                first_message_at=first,
+                last_message_at=last,
+                message_count=count,
+            )
+            for (salon_id, user_id), (first, last, count) in stats.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_salon_createur_ban_salonrole"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SalonMembership",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_message_at", models.DateTimeField()),
+                ("last_message_at", models.DateTimeField()),
+                ("message_count", models.PositiveIntegerField(default=0)),
+                (
+                    "salon",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="memberships",
+                        to="chat.salon",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="salon_memberships",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("salon", "user")},
+            },
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+    ]
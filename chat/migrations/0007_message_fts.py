@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 10:05
+
+from django.db import migrations
+
+from chat.search import install_fts, uninstall_fts
+
+
+def create_fts(apps, schema_editor):
+    install_fts(schema_editor, rebuild=True)
+
+
+def drop_fts(apps, schema_editor):
+    uninstall_fts(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0006_message_composite_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_message_fts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="salon",
+            name="messages_version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="salon",
+            name="users_version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="channel",
+            name="messages_version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
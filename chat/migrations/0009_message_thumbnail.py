@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_message_list_versions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="miniature",
+            field=models.ImageField(blank=True, null=True, upload_to="chat_thumbs/%Y/%m/%d/"),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="largeur",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="hauteur",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
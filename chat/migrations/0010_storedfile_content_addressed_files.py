@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 12:05
+
+import chat.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0009_message_thumbnail"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredFile",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="fichier_nom",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        # Stockage et upload_to n'existent pas en base : état seulement, sans
+        # reconstruire chat_message sous SQLite
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="message",
+                    name="fichier",
+                    field=models.FileField(blank=True, null=True, storage=chat.storage.ContentAddressedStorage(), upload_to="chat_files/"),
+                ),
+                migrations.AlterField(
+                    model_name="message",
+                    name="miniature",
+                    field=models.ImageField(blank=True, null=True, storage=chat.storage.ContentAddressedStorage(), upload_to="chat_thumbs/"),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-18 13:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0010_storedfile_content_addressed_files"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="salon",
+            name="retention_jours",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="salon",
+            name="retention_messages",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="ArchivedMessageBatch",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("first_id", models.BigIntegerField()),
+                ("last_id", models.BigIntegerField()),
+                ("first_date", models.DateTimeField()),
+                ("last_date", models.DateTimeField()),
+                ("message_count", models.PositiveIntegerField()),
+                ("data", models.BinaryField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                ("channel", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name="archives", to="chat.channel")),
+                ("salon", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name="archives", to="chat.salon")),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["salon", "last_id"], name="chat_archive_salon_idx"),
+                    models.Index(fields=["channel", "last_id"], name="chat_archive_channel_idx"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 15:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0011_salon_retention_archivedmessagebatch"),
+    ]
+
+    operations = [
+        # Valeur par défaut côté Python seulement : rien ne change en base
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="message",
+                    name="date_envoi",
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 6.0 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(qs, group):
+    return Coalesce(Subquery(qs.order_by().values(group).annotate(n=Count("id")).values("n")), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    """Compteurs initiaux : une mise à jour par sous-requêtes et par table, pas une par salon."""
+    Salon = apps.get_model("chat", "Salon")
+    Channel = apps.get_model("chat", "Channel")
+    Message = apps.get_model("chat", "Message")
+    channel_messages = Message.objects.filter(channel=OuterRef("pk"))
+    Channel.objects.update(
+        message_count=_count(channel_messages, "channel"),
+        last_message_id=Subquery(channel_messages.order_by("-id").values("id")[:1]),
+    )
+    salon_messages = Message.objects.filter(Q(salon=OuterRef("pk")) | Q(channel__salon=OuterRef("pk")))
+    Salon.objects.update(
+        message_count=_count(salon_messages.annotate(g=Value(1)), "g"),
+        channel_count=_count(Channel.objects.filter(salon=OuterRef("pk")), "salon"),
+        last_message_id=Subquery(salon_messages.order_by("-id").values("id")[:1]),
+    )
+    # Date du dernier message, une fois son id connu
+    for model in (Channel, Salon):
+        model.objects.filter(last_message_id__isnull=False).update(last_message_at=Subquery(
+            Message.objects.filter(id=OuterRef("last_message_id")).values("date_envoi")[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0012_message_date_envoi_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="salon",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="salon",
+            name="channel_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="salon",
+            name="last_message_id",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="salon",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="channel",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="channel",
+            name="last_message_id",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="channel",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-18 18:40
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_conversations(apps, schema_editor):
+    """Un message rattaché à un salon et à un canal garde son canal (les
+    compteurs le comptaient déjà ainsi). Un message rattaché à aucun
+    n'apparaît dans aucune conversation : la migration s'arrête plutôt que
+    de le supprimer, à l'administrateur de le rattacher ou de l'effacer."""
+    Message = apps.get_model("chat", "Message")
+    orphans = list(Message.objects.filter(salon__isnull=True, channel__isnull=True).values_list("id", flat=True))
+    if orphans:
+        raise RuntimeError(
+            f"{len(orphans)} message(s) sans salon ni canal (ids : {', '.join(map(str, orphans[:20]))}"
+            f"{', ...' if len(orphans) > 20 else ''}). Rattachez-les à un salon ou à un canal, ou "
+            "supprimez-les (Message.objects.filter(salon=None, channel=None).delete()), puis relancez "
+            "la migration."
+        )
+    moved = Message.objects.filter(salon__isnull=False, channel__isnull=False).update(salon=None)
+    if moved:
+        logger.warning("%d message(s) rattachés à un salon et à un canal : seul le canal est gardé.", moved)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0013_salon_channel_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_conversations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="message",
+            constraint=models.CheckConstraint(
+                condition=models.Q(
+                    models.Q(("channel__isnull", True), ("salon__isnull", False)),
+                    models.Q(("channel__isnull", False), ("salon__isnull", True)),
+                    _connector="OR",
+                ),
+                name="chat_message_one_conversation",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0014_message_one_conversation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="salon",
+            name="changes_version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="channel",
+            name="changes_version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -1,7 +1,13 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Case, When, Value, Count, Max
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 from django.core.exceptions import ValidationError
+from .permissions import resolve_permissions
+from .storage import attachment_storage
+from .serializers import attachment_data
 
 # Le salon de discussion
 class Salon(models.Model):
@@ -9,6 +15,23 @@ class Salon(models.Model):
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True, null=True)
     createur = models.ForeignKey(User, on_delete=models.CASCADE, related_name='salons_crees')
+    # Compteurs de version servant d'ETag (listes de messages / d'utilisateurs)
+    messages_version = models.PositiveBigIntegerField(default=0)
+    users_version = models.PositiveBigIntegerField(default=0)
+    # Modifications et suppressions de messages seulement : un client qui
+    # suit la liste par polling (`after_id`) recharge alors ce qu'il affiche
+    changes_version = models.PositiveBigIntegerField(default=0)
+    # Rétention : au-delà, les messages partent dans l'archive compressée
+    # (chat/archive.py). Vide = tout garder
+    retention_jours = models.PositiveIntegerField(null=True, blank=True)
+    retention_messages = models.PositiveIntegerField(null=True, blank=True)
+    # Compteurs dénormalisés, salon et canaux compris (mis à jour par F() dans
+    # les chemins d'écriture, `reconcile_counters` corrige une dérive). Ils
+    # décrivent la table chaude : les messages archivés n'y figurent plus
+    message_count = models.PositiveIntegerField(default=0)
+    channel_count = models.PositiveIntegerField(default=0)
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
 
     # Pour créer le lien vers le salon automatiquement
     def get_absolute_url(self):
@@ -18,25 +41,89 @@ class Salon(models.Model):
     def __str__(self):
         return self.nom
 
+    @staticmethod
+    def bump_users_version(salon_id):
+        """Invalide l'ETag de la liste des utilisateurs du salon."""
+        Salon.objects.filter(pk=salon_id).update(users_version=F('users_version') + 1)
+
+    @staticmethod
+    def count_messages(salon_id, channel_id=None, count=1, last_id=None, last_at=None):
+        """Ajoute `count` messages (négatif : en retire) aux compteurs du salon et du canal.
+
+        `last_id` / `last_at` : dernier message ajouté ; il ne remplace le
+        dernier connu que s'il est plus récent (envois concurrents).
+        """
+        if count >= 0:
+            updates = {'message_count': F('message_count') + count}
+        else:
+            updates = {'message_count': Greatest(F('message_count') + count, Value(0),
+                                                 output_field=models.PositiveIntegerField())}
+        if last_id is not None:
+            newer = Q(last_message_id__isnull=True) | Q(last_message_id__lt=last_id)
+            updates['last_message_id'] = Case(When(newer, then=Value(last_id)), default=F('last_message_id'),
+                                              output_field=models.BigIntegerField())
+            updates['last_message_at'] = Case(When(newer, then=Value(last_at)), default=F('last_message_at'),
+                                              output_field=models.DateTimeField())
+        Salon.objects.filter(pk=salon_id).update(**updates)
+        if channel_id is not None:
+            Channel.objects.filter(pk=channel_id).update(**updates)
+
+    @staticmethod
+    def refresh_last_message(salon_id, channel_id=None):
+        """Recherche le dernier message après la suppression de celui qui l'était."""
+        if channel_id is not None:
+            last = Message.objects.filter(channel_id=channel_id).order_by('-id').values('id', 'date_envoi').first()
+            Channel.objects.filter(pk=channel_id).update(
+                last_message_id=last and last['id'], last_message_at=last and last['date_envoi'])
+        candidates = [Message.objects.filter(salon_id=salon_id).order_by('-id').values_list('id', 'date_envoi').first()]
+        candidates += Channel.objects.filter(salon_id=salon_id, last_message_id__isnull=False).values_list(
+            'last_message_id', 'last_message_at')
+        last = max((c for c in candidates if c), default=(None, None))
+        Salon.objects.filter(pk=salon_id).update(last_message_id=last[0], last_message_at=last[1])
+
+    def reconcile_counters(self):
+        """Recalcule les compteurs du salon et de ses canaux depuis les messages."""
+        stats = {row['channel_id']: row for row in Message.objects.filter(
+            Q(salon=self) | Q(channel__salon=self)).values('channel_id').annotate(
+            n=Count('id'), last=Max('id')).order_by()}
+        dates = dict(Message.objects.filter(id__in=[row['last'] for row in stats.values()]).values_list(
+            'id', 'date_envoi'))
+        for channel in self.channels.all():
+            row = stats.get(channel.id, {'n': 0, 'last': None})
+            Channel.objects.filter(pk=channel.pk).update(
+                message_count=row['n'], last_message_id=row['last'], last_message_at=dates.get(row['last']))
+        last = max((row['last'] for row in stats.values()), default=None)
+        Salon.objects.filter(pk=self.pk).update(
+            message_count=sum(row['n'] for row in stats.values()), channel_count=self.channels.count(),
+            last_message_id=last, last_message_at=dates.get(last))
+
+    def permissions_for(self, user):
+        """Permissions de l'utilisateur dans ce salon (voir chat.permissions).
+
+        Dans une vue, préférer `chat.permissions.get_permissions(request, salon)`
+        qui mémorise le résultat pour la requête.
+        """
+        return resolve_permissions(self, user)
+
     def is_admin(self, user):
         """Vérifie si l'utilisateur est administrateur du salon"""
-        return user == self.createur or self.roles.filter(user=user, role='admin').exists()
+        return self.permissions_for(user).is_admin
 
     def is_moderator(self, user):
         """Vérifie si l'utilisateur est modérateur du salon"""
-        return self.is_admin(user) or self.roles.filter(user=user, role='moderator').exists()
+        return self.permissions_for(user).is_moderator
 
     def is_banned(self, user):
         """Vérifie si l'utilisateur est banni du salon"""
-        return self.bans.filter(user=user, is_active=True).exists()
+        return self.permissions_for(user).is_banned
 
     def can_manage_users(self, user):
         """Vérifie si l'utilisateur peut gérer les utilisateurs (admin seulement)"""
-        return self.is_admin(user)
+        return self.permissions_for(user).can_manage_users
 
     def can_moderate(self, user):
         """Vérifie si l'utilisateur peut modérer (admin ou modérateur)"""
-        return self.is_moderator(user)
+        return self.permissions_for(user).can_moderate
 
 # Les canaux de discussion
 class Channel(models.Model):
@@ -44,6 +131,12 @@ class Channel(models.Model):
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True, null=True)
     salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='channels')
+    messages_version = models.PositiveBigIntegerField(default=0)
+    changes_version = models.PositiveBigIntegerField(default=0)
+    # Mêmes compteurs que Salon, pour le canal seul
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
 
     # Pour créer le lien vers le canal automatiquement
     def get_absolute_url(self):
@@ -62,25 +155,191 @@ class Message(models.Model):
     channel = models.ForeignKey(Channel, on_delete=models.CASCADE, related_name='messages', null=True, blank=True)
     auteur = models.ForeignKey(User, on_delete=models.CASCADE)
     contenu = models.TextField(blank=True)
-    fichier = models.FileField(upload_to='chat_files/%Y/%m/%d/', blank=True, null=True)
-    date_envoi = models.DateTimeField(auto_now_add=True)
+    # Pièces jointes stockées une seule fois par contenu (chat/storage.py)
+    fichier = models.FileField(upload_to='chat_files/', storage=attachment_storage, blank=True, null=True)
+    fichier_nom = models.CharField(max_length=255, blank=True)
+    # Miniature et dimensions des images jointes, calculées en tâche de fond (chat/thumbnails.py)
+    miniature = models.ImageField(upload_to='chat_thumbs/', storage=attachment_storage, blank=True, null=True)
+    largeur = models.PositiveIntegerField(null=True, blank=True)
+    hauteur = models.PositiveIntegerField(null=True, blank=True)
+    # Date fixée à la création ; une valeur explicite est conservée (écriture
+    # différée, import), contrairement à `auto_now_add`
+    date_envoi = models.DateTimeField(default=timezone.now, editable=False)
 
     # On trie par date pour avoir les vieux messages en premier
     class Meta:
         ordering = ['date_envoi']
+        # Pagination par id dans un salon / canal, messages d'un auteur
+        indexes = [
+            models.Index(fields=['salon', 'id'], name='chat_msg_salon_id_idx'),
+            models.Index(fields=['channel', 'id'], name='chat_msg_channel_id_idx'),
+            models.Index(fields=['auteur', 'date_envoi'], name='chat_msg_auteur_date_idx'),
+        ]
+        # Un message appartient à un salon ou à un canal (chat/conversations.py)
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(salon__isnull=False, channel__isnull=True)
+                | models.Q(salon__isnull=True, channel__isnull=False),
+                name='chat_message_one_conversation',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.auteur} : {self.contenu}"
 
     def get_chat_entity(self):
         """Retourne l'entité de chat (salon ou canal) associée au message."""
-        return self.salon or self.channel
+        # Exactement l'une des deux (contrainte chat_message_one_conversation)
+        return self.channel if self.channel_id else self.salon
+
+    def bump_version(self, changed=False):
+        """Invalide l'ETag de la liste de messages du salon ou du canal.
+
+        `changed` : message existant modifié ou supprimé (`changes_version`).
+        """
+        updates = {'messages_version': F('messages_version') + 1}
+        if changed:
+            updates['changes_version'] = F('changes_version') + 1
+        if self.channel_id:
+            Channel.objects.filter(pk=self.channel_id).update(**updates)
+        else:
+            Salon.objects.filter(pk=self.salon_id).update(**updates)
+
+    def get_salon(self):
+        """Retourne le salon du message, directement ou via son canal."""
+        return self.salon if self.salon_id else self.channel.salon
+
+    def get_salon_id(self):
+        """Id du salon du message, sans charger le salon."""
+        return self.salon_id if self.salon_id else self.channel.salon_id
+
+    def file_data(self):
+        """Champs JSON de la pièce jointe (voir chat.serializers.attachment_data)."""
+        return attachment_data(self.id, self.fichier.name if self.fichier else None, self.fichier_nom,
+                               self.miniature.name if self.miniature else None, self.largeur, self.hauteur)
 
     def get_chat_entity_name(self):
         """Retourne le nom de l'entité de chat."""
         entity = self.get_chat_entity()
         return entity.nom if entity else "Unknown"
 
+# Participation des utilisateurs aux salons (dénormalisée depuis Message, voir chat/signals.py)
+class SalonMembership(models.Model):
+    salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='salon_memberships')
+    first_message_at = models.DateTimeField()
+    last_message_at = models.DateTimeField()
+    message_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('salon', 'user')
+
+    def __str__(self):
+        return f"{self.user} dans {self.salon} ({self.message_count} messages)"
+
+    @classmethod
+    def record_message(cls, salon_id, user_id, date_envoi, count=1):
+        """Compte `count` nouveaux messages de l'utilisateur dans le salon (ou un de ses canaux).
+
+        Retourne True si l'utilisateur vient de rejoindre le salon.
+        """
+        updates = {'message_count': F('message_count') + count, 'last_message_at': date_envoi}
+        if cls.objects.filter(salon_id=salon_id, user_id=user_id).update(**updates):
+            return False
+        try:
+            with transaction.atomic():
+                cls.objects.create(salon_id=salon_id, user_id=user_id, message_count=count,
+                                   first_message_at=date_envoi, last_message_at=date_envoi)
+        except IntegrityError:
+            # Créée entre-temps par une autre requête
+            cls.objects.filter(salon_id=salon_id, user_id=user_id).update(**updates)
+            return False
+        Salon.bump_users_version(salon_id)
+        return True
+
+    @classmethod
+    def record_deletion(cls, salon_id, user_id, count=1):
+        """Décompte `count` messages supprimés ; l'utilisateur reste membre du salon."""
+        cls.objects.filter(salon_id=salon_id, user_id=user_id).update(
+            message_count=Greatest(F('message_count') - count, Value(0), output_field=models.PositiveIntegerField()))
+
+# Fichiers du stockage adressé par contenu, avec leur nombre de références
+class StoredFile(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} références)"
+
+    @classmethod
+    def acquire(cls, name, count=1):
+        """Ajoute `count` références au fichier `name`.
+
+        Sous le verrou de la ligne : une suppression différée en cours
+        (`delete_if_unreferenced`) se termine avant, et n'efface plus le
+        fichier une fois la référence comptée.
+        """
+        with transaction.atomic():
+            if cls.lock(name):
+                cls.objects.filter(name=name).update(ref_count=F('ref_count') + count)
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(name=name, ref_count=count)
+            except IntegrityError:
+                cls.objects.filter(name=name).update(ref_count=F('ref_count') + count)
+
+    @classmethod
+    def lock(cls, name):
+        """Verrouille la ligne de `name` jusqu'à la fin de la transaction ; vrai si elle existe."""
+        return bool(list(cls.objects.select_for_update().filter(name=name).values_list('pk', flat=True)))
+
+    @classmethod
+    def release(cls, name):
+        """Retire une référence ; le fichier est supprimé après la dernière.
+
+        Les fichiers jamais comptés (antérieurs au stockage par contenu) ne
+        sont pas touchés.
+        """
+        cls.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        if cls.objects.filter(name=name, ref_count=0).exists():
+            transaction.on_commit(lambda: cls.delete_if_unreferenced(name))
+
+    @classmethod
+    def delete_if_unreferenced(cls, name):
+        with transaction.atomic():
+            row = cls.objects.select_for_update().filter(name=name).first()
+            # Re-partagé entre-temps, ou déjà supprimé
+            if row is None or row.ref_count:
+                return
+            row.delete()
+            attachment_storage.delete(name)
+
+# Messages archivés par lots compressés (voir chat/archive.py)
+class ArchivedMessageBatch(models.Model):
+    salon = models.ForeignKey(Salon, on_delete=models.CASCADE, related_name='archives', null=True, blank=True)
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, related_name='archives', null=True, blank=True)
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    first_date = models.DateTimeField()
+    last_date = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    # Liste JSON des messages, compressée par zlib
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['salon', 'last_id'], name='chat_archive_salon_idx'),
+            models.Index(fields=['channel', 'last_id'], name='chat_archive_channel_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_chat_entity()} : messages {self.first_id}-{self.last_id} ({self.message_count})"
+
+    def get_chat_entity(self):
+        return self.salon or self.channel
+
 # Rôles des utilisateurs dans les salons
 class SalonRole(models.Model):
     ROLE_CHOICES = [
@@ -0,0 +1,93 @@
+"""Résolution des permissions d'un utilisateur dans un salon.
+
+Le rôle et le bannissement sont chargés en une seule requête, puis mémorisés
+pour la durée de la requête HTTP (`get_permissions`). Si
+`CHAT_PERMISSIONS_CACHE_TTL` est non nul, le résultat est aussi gardé dans le
+cache Django partagé ; il est invalidé à chaque écriture de `SalonRole` ou
+`Ban` (voir `chat.signals`).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Subquery
+
+
+class SalonPermissions:
+    """Droits d'un utilisateur dans un salon."""
+
+    __slots__ = ('role', 'is_creator', 'is_banned')
+
+    def __init__(self, role=None, is_creator=False, is_banned=False):
+        self.role = role
+        self.is_creator = is_creator
+        self.is_banned = is_banned
+
+    @property
+    def is_admin(self):
+        return self.is_creator or self.role == 'admin'
+
+    @property
+    def is_moderator(self):
+        return self.is_admin or self.role == 'moderator'
+
+    @property
+    def can_moderate(self):
+        return self.is_moderator
+
+    @property
+    def can_manage_users(self):
+        return self.is_admin
+
+    def as_dict(self):
+        return {
+            'role': self.role,
+            'is_creator': self.is_creator,
+            'is_admin': self.is_admin,
+            'is_moderator': self.is_moderator,
+            'is_banned': self.is_banned,
+            'can_moderate': self.can_moderate,
+            'can_manage_users': self.can_manage_users,
+        }
+
+
+def cache_key(salon_id, user_id):
+    return f'chat:perms:{salon_id}:{user_id}'
+
+
+def invalidate(salon_id, user_id):
+    """Oublie les permissions en cache partagé d'un utilisateur dans un salon."""
+    if getattr(settings, 'CHAT_PERMISSIONS_CACHE_TTL', 0):
+        cache.delete(cache_key(salon_id, user_id))
+
+
+def resolve_permissions(salon, user):
+    """Charge les permissions de `user` dans `salon` (une requête au plus)."""
+    if user is None or not user.is_authenticated:
+        return SalonPermissions()
+
+    is_creator = user.id == salon.createur_id
+    ttl = getattr(settings, 'CHAT_PERMISSIONS_CACHE_TTL', 0)
+    if ttl:
+        cached = cache.get(cache_key(salon.id, user.id))
+        if cached is not None:
+            role, is_banned = cached
+            return SalonPermissions(role, is_creator, is_banned)
+
+    # Import local : models.py importe ce module
+    from .models import Salon, SalonRole, Ban
+    row = Salon.objects.filter(pk=salon.pk).annotate(
+        user_role=Subquery(SalonRole.objects.filter(salon=OuterRef('pk'), user=user).values('role')[:1]),
+        user_banned=Exists(Ban.objects.filter(salon=OuterRef('pk'), user=user, is_active=True)),
+    ).values_list('user_role', 'user_banned').first()
+    role, is_banned = row if row else (None, False)
+
+    if ttl:
+        cache.set(cache_key(salon.id, user.id), (role, is_banned), ttl)
+    return SalonPermissions(role, is_creator, is_banned)
+
+
+def get_permissions(request, salon):
+    """Permissions de l'utilisateur courant, mémorisées sur la requête."""
+    memo = request.__dict__.setdefault('_salon_permissions', {})
+    if salon.pk not in memo:
+        memo[salon.pk] = resolve_permissions(salon, request.user)
+    return memo[salon.pk]
@@ -0,0 +1,183 @@
+"""Limitation de débit par seaux à jetons (token bucket).
+
+Une limite est un seau par clé (utilisateur, IP, salon ou une combinaison
+comme `user+salon`) : `burst` jetons au plus, rechargés au rythme de `rate`.
+Chaque requête prend un jeton ; seau vide, la vue n'est pas appelée et le
+client reçoit 429 avec `Retry-After`. Les limites sont posées sur les routes
+dans chat/urls.py :
+
+    path('...', ratelimit('20/10s', key='user')(views.messages_post), ...)
+
+Les seaux sont gardés par le backend `CHAT_RATELIMIT_BACKEND` :
+`LocalBucketStore` en mémoire (un seul processus), `CacheBucketStore` dans
+le cache Django (partagé entre workers avec Redis ou Memcached ; lecture puis
+écriture non atomiques, la limite peut être légèrement dépassée sous forte
+concurrence). L'IP est `REMOTE_ADDR` : derrière un proxy, le configurer pour
+qu'il transmette l'adresse du client.
+"""
+import math
+import re
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'20/10s' -> (20, 10) : nombre de requêtes par période en secondes."""
+    match = RATE_RE.match(rate)
+    if not match:
+        raise ValueError(f"Invalid rate '{rate}' (expected e.g. '20/10s', '30/m').")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+
+def _refill(state, capacity, per_second, now):
+    tokens, updated = state if state is not None else (capacity, now)
+    return min(capacity, tokens + (now - updated) * per_second)
+
+
+def _take(tokens, per_second):
+    """(jetons restants, attente en secondes) après une demande."""
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / per_second
+
+
+class LocalBucketStore:
+    """Seaux en mémoire, limités au processus courant."""
+
+    max_keys = 10000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, per_second, now=None):
+        """Prend un jeton ; retourne 0 ou le nombre de secondes à attendre."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, wait = _take(_refill(self._buckets.get(key), capacity, per_second, now), per_second)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now, idle=3600):
+        # Un seau inutilisé depuis longtemps est plein : autant l'oublier
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated > idle]:
+            del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """Seaux dans le cache Django, partagés par tous les workers qui l'utilisent."""
+
+    def take(self, key, capacity, per_second, now=None):
+        now = time.time() if now is None else now
+        tokens, wait = _take(_refill(cache.get(key), capacity, per_second, now), per_second)
+        # Expire quand le seau serait de nouveau plein
+        cache.set(key, (tokens, now), math.ceil((capacity - tokens) / per_second) + 1)
+        return wait
+
+
+_store = None
+_store_path = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Instance du backend configuré (`CHAT_RATELIMIT_BACKEND`)."""
+    global _store, _store_path
+    path = getattr(settings, 'CHAT_RATELIMIT_BACKEND', 'chat.ratelimit.LocalBucketStore')
+    if _store_path != path:
+        with _store_lock:
+            if _store_path != path:
+                _store = import_string(path)()
+                _store_path = path
+    return _store
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def bucket_key(scope, parts, request, view_kwargs, user):
+    values = []
+    for part in parts:
+        if part == 'user':
+            values.append(f'u{user.pk}' if user.is_authenticated else f'ip{client_ip(request)}')
+        elif part == 'ip':
+            values.append(f'ip{client_ip(request)}')
+        elif part == 'salon':
+            values.append(f"s{view_kwargs.get('salon_slug') or view_kwargs.get('slug')}")
+    return 'chat-rl:' + ':'.join([scope] + values)
+
+
+def too_many_requests(wait):
+    seconds = max(1, math.ceil(wait))
+    response = JsonResponse({'error': f'Trop de requêtes, réessayez dans {seconds} s.'}, status=429)
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+def ratelimit(rate, key='user', burst=None, scope=None, methods=None):
+    """Décorateur de vue : `rate` requêtes par période et par `key`.
+
+    `key` : 'user' (l'IP pour un anonyme), 'ip', 'salon' ou une combinaison
+    ('user+salon'). `burst` : taille du seau (par défaut le nombre de
+    requêtes de `rate`). `scope` : nom du seau (par défaut la vue), à
+    partager entre routes pour une limite commune. `methods` : ne compter que
+    ces méthodes HTTP.
+    """
+    count, period = parse_rate(rate)
+    capacity = burst or count
+    per_second = count / period
+    parts = key.split('+')
+    unknown = set(parts) - {'user', 'ip', 'salon'}
+    if unknown:
+        raise ValueError(f"Unknown rate limit key: {', '.join(sorted(unknown))}")
+
+    def decorator(view):
+        name = scope or view.__name__
+
+        def applies(request):
+            return getattr(settings, 'CHAT_RATELIMIT_ENABLED', True) and (
+                not methods or request.method in methods)
+
+        def check(request, view_kwargs, user):
+            wait = get_store().take(bucket_key(name, parts, request, view_kwargs, user), capacity, per_second)
+            return too_many_requests(wait) if wait else None
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if applies(request):
+                    # Utilisateur chargé sans accès synchrone à la session
+                    response = check(request, kwargs, await request.auser())
+                    if response is not None:
+                        return response
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if applies(request):
+                response = check(request, kwargs, request.user)
+                if response is not None:
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,106 @@
+"""Diffusion en temps réel des événements de messages.
+
+Les vues publient chaque création / modification / suppression de message sur
+un sujet (`salon:<id>` ou `channel:<id>`), et les connexions WebSocket
+abonnées à ce sujet reçoivent l'événement. Un changement de rôle ou de
+bannissement publie aussi `permissions.changed` (voir chat/signals.py). Le
+broker est choisi par le réglage `CHAT_REALTIME_BACKEND` ; `InMemoryBroker`
+fonctionne dans un seul processus (développement, tests, un seul worker ASGI).
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+def topic_for(salon_id=None, channel_id=None):
+    """Nom du sujet d'un salon ou d'un canal."""
+    if channel_id is not None:
+        return f'channel:{channel_id}'
+    return f'salon:{salon_id}'
+
+
+def message_topic(message):
+    """Sujet sur lequel sont diffusés les événements d'un message."""
+    return topic_for(message.salon_id, message.channel_id)
+
+
+class Subscription:
+    """Abonnement d'un consommateur asynchrone à un sujet."""
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def deliver(self, event):
+        # Peut être appelé depuis un autre thread (vue synchrone)
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InMemoryBroker:
+    """Broker en mémoire, limité au processus courant."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        """À appeler depuis la boucle asyncio du consommateur."""
+        subscription = Subscription(topic)
+        with self._lock:
+            self._subscribers[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def publish(self, topic, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # Boucle fermée : le consommateur est parti
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self, topic):
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Instance du broker configuré (`CHAT_REALTIME_BACKEND`)."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                path = getattr(settings, 'CHAT_REALTIME_BACKEND', 'chat.realtime.InMemoryBroker')
+                _broker = import_string(path)()
+    return _broker
+
+
+def publish(topic, event):
+    """Publie l'événement une fois la transaction courante validée."""
+    transaction.on_commit(lambda: get_broker().publish(topic, event))
+
+
+def publish_message_event(message, event_type, payload):
+    """Diffuse `message.created`, `message.updated` ou `message.deleted`."""
+    publish(message_topic(message), {'type': event_type, 'message': payload})
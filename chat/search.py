@@ -0,0 +1,102 @@
+"""Recherche plein texte dans les messages.
+
+Sous SQLite, l'index est une table FTS5 (`chat_message_fts`) à contenu
+externe, tenue à jour par des triggers sur `chat_message` : chaque création,
+modification ou suppression de message (y compris `bulk_create` et les
+suppressions en cascade) met l'index à jour dans la même transaction.
+Sur les autres bases on retombe sur un filtre `icontains`.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'chat_message_fts'
+
+SQLITE_FTS_SETUP = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        contenu, content='chat_message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON chat_message BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, contenu) VALUES (new.id, new.contenu);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON chat_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, contenu) VALUES ('delete', old.id, old.contenu);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF contenu ON chat_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, contenu) VALUES ('delete', old.id, old.contenu);
+        INSERT INTO {FTS_TABLE}(rowid, contenu) VALUES (new.id, new.contenu);
+    END""",
+]
+
+SQLITE_FTS_TEARDOWN = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def uses_fts(conn=None):
+    return (conn or connection).vendor == 'sqlite'
+
+
+def install_fts(schema_editor, rebuild=False):
+    """Crée la table FTS5 et ses triggers (idempotent), pour les migrations."""
+    if not uses_fts(schema_editor.connection):
+        return
+    for statement in SQLITE_FTS_SETUP:
+        schema_editor.execute(statement)
+    if rebuild:
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_fts(schema_editor):
+    if not uses_fts(schema_editor.connection):
+        return
+    for statement in SQLITE_FTS_TEARDOWN:
+        schema_editor.execute(statement)
+
+
+def ensure_fts(using='default', **kwargs):
+    """Handler `post_migrate` : recrée les triggers s'ils ont disparu.
+
+    SQLite supprime les triggers quand une migration reconstruit
+    `chat_message` ; les ids étant conservés, l'index reste valide.
+    """
+    conn = connections[using]
+    if not uses_fts(conn) or FTS_TABLE not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cursor:
+        for statement in SQLITE_FTS_SETUP:
+            cursor.execute(statement)
+
+
+def tokenize(query):
+    return TOKEN.findall(query or '')
+
+
+def fts_query(tokens):
+    """Requête FTS5 : tous les mots, le dernier en préfixe (saisie en cours)."""
+    terms = [f'"{t}"' for t in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_messages(qs, query):
+    """Restreint le queryset de messages à ceux qui contiennent tous les mots de `query`."""
+    tokens = tokenize(query)
+    if not tokens:
+        return qs.none()
+    if uses_fts():
+        return qs.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [fts_query(tokens)]
+        ))
+    condition = Q()
+    for token in tokens:
+        condition &= Q(contenu__icontains=token)
+    return qs.filter(condition)
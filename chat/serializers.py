@@ -0,0 +1,168 @@
+"""Sérialisation JSON des messages, commune à toutes les vues.
+
+Les listes lisent les messages par `.values(*MESSAGE_VALUES)` : des
+dictionnaires, sans instancier de modèles ni charger l'auteur entier.
+`message_data` construit le JSON d'une ligne, `instance_data` celui d'un
+message déjà chargé (envoi, modification), au même format que l'archive
+(chat/archive.py). Les dates restent des `datetime` jusqu'à l'encodeur.
+
+L'encodeur est choisi par `CHAT_JSON_ENCODER` : `chat.serializers.dumps`
+(module json de la bibliothèque standard) ou `orjson.dumps` (`pip install
+orjson`, plusieurs fois plus rapide) ; toute fonction objet -> bytes qui
+écrit les `datetime` en ISO 8601, sur une seule ligne, convient.
+
+`stream_messages` (et `astream_messages`, asynchrone) produit le même
+document `{"messages": [...], "has_more": ...}` au fil d'un itérateur, pour
+les grandes fenêtres d'historique.
+"""
+import json
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+# Taille approximative des blocs envoyés par `stream_messages` (octets)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+MESSAGE_VALUES = ('id', 'auteur__username', 'contenu', 'date_envoi', 'fichier', 'fichier_nom',
+                  'miniature', 'largeur', 'hauteur')
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+
+def dumps(data):
+    """Encodeur par défaut (bibliothèque standard)."""
+    return _encoder.encode(data).encode()
+
+
+_dumps = None
+_dumps_path = None
+_dumps_lock = threading.Lock()
+
+
+def get_dumps():
+    """Fonction d'encodage configurée (`CHAT_JSON_ENCODER`)."""
+    global _dumps, _dumps_path
+    path = getattr(settings, 'CHAT_JSON_ENCODER', 'chat.serializers.dumps')
+    if _dumps_path != path:
+        with _dumps_lock:
+            if _dumps_path != path:
+                _dumps = import_string(path)
+                _dumps_path = path
+    return _dumps
+
+
+def json_response(data, status=200):
+    """Comme `JsonResponse`, avec l'encodeur configuré."""
+    return HttpResponse(get_dumps()(data), content_type='application/json', status=status)
+
+
+def attachment_data(message_id, fichier, fichier_nom, miniature=None, largeur=None, hauteur=None):
+    """Champs JSON de la pièce jointe (la miniature apparaît une fois générée)."""
+    if not fichier:
+        return {}
+    data = {
+        'fichier_url': reverse('message_media', args=[message_id, 'fichier']),
+        'fichier_nom': fichier_nom or fichier.split('/')[-1],
+    }
+    if largeur is not None:
+        data['largeur'] = largeur
+        data['hauteur'] = hauteur
+    if miniature:
+        data['miniature_url'] = reverse('message_media', args=[message_id, 'miniature'])
+    return data
+
+
+def message_rows(qs, *extra):
+    """Les messages de `qs` en dictionnaires (`MESSAGE_VALUES` et `extra`)."""
+    return qs.values(*MESSAGE_VALUES, *extra)
+
+
+def message_data(row):
+    """JSON d'une ligne de `message_rows`."""
+    data = {
+        'id': row['id'],
+        'auteur': row['auteur__username'],
+        'contenu': row['contenu'],
+        'date_envoi': row['date_envoi'],
+    }
+    if row['fichier']:
+        data.update(attachment_data(row['id'], row['fichier'], row['fichier_nom'], row['miniature'],
+                                    row['largeur'], row['hauteur']))
+    return data
+
+
+def instance_data(message):
+    """JSON d'un message chargé (même format que `message_data`)."""
+    data = {
+        'id': message.id,
+        'auteur': message.auteur.username,
+        'contenu': message.contenu,
+        'date_envoi': message.date_envoi,
+    }
+    data.update(message.file_data())
+    return data
+
+
+class _MessagesDocument:
+    """Document `{"messages": [...], "has_more": ...}` encodé message par message."""
+
+    def __init__(self, limit, chunk_size):
+        self.dumps = get_dumps()
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.buffer, self.length, self.count, self.has_more = [b'{"messages":['], 0, 0, False
+
+    def add(self, data):
+        """Ajoute un message ; retourne un bloc à envoyer, ou None."""
+        if self.count == self.limit:
+            self.has_more = True
+            return None
+        line = (b',\n' if self.count else b'\n') + self.dumps(data)
+        self.buffer.append(line)
+        self.length += len(line)
+        self.count += 1
+        if self.length < self.chunk_size:
+            return None
+        chunk = b''.join(self.buffer)
+        self.buffer, self.length = [], 0
+        return chunk
+
+    def end(self):
+        self.buffer.append(b'\n],"has_more":' + (b'true' if self.has_more else b'false') + b'}')
+        return b''.join(self.buffer)
+
+
+def stream_messages(messages, limit=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Corps JSON d'une liste de messages, produit au fil de l'itérateur `messages`.
+
+    Un message par ligne, que le client décode dès qu'elle arrive ; les
+    lignes sont envoyées par blocs d'environ `chunk_size` octets. Au-delà
+    de `limit` messages, le reste est ignoré et `has_more` vaut true.
+    """
+    document = _MessagesDocument(limit, chunk_size)
+    for data in messages:
+        chunk = document.add(data)
+        if chunk is not None:
+            yield chunk
+    yield document.end()
+
+
+async def astream_messages(messages, limit=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Comme `stream_messages`, au fil d'un itérateur asynchrone (ASGI)."""
+    document = _MessagesDocument(limit, chunk_size)
+    async for data in messages:
+        chunk = document.add(data)
+        if chunk is not None:
+            yield chunk
+    yield document.end()
@@ -0,0 +1,91 @@
+from django.db.models import Count, QuerySet
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Salon, Channel, Message, SalonMembership, ArchivedMessageBatch, SalonRole, Ban, StoredFile
+from . import permissions
+from .archive import decode
+from .directory import bump_directory_version
+from .realtime import publish, topic_for
+
+
+# Un changement de rôle ou de bannissement invalide le cache des permissions
+# et l'ETag de la liste des utilisateurs du salon, puis prévient les clients
+# connectés au salon et à ses canaux : celui de l'utilisateur concerné
+# recharge ses permissions (api/salon/<slug>/me/)
+@receiver([post_save, post_delete], sender=SalonRole)
+@receiver([post_save, post_delete], sender=Ban)
+def invalidate_permissions(sender, instance, **kwargs):
+    permissions.invalidate(instance.salon_id, instance.user_id)
+    Salon.bump_users_version(instance.salon_id)
+    event = {'type': 'permissions.changed', 'user_id': instance.user_id}
+    publish(topic_for(salon_id=instance.salon_id), event)
+    for channel_id in Channel.objects.filter(salon_id=instance.salon_id).values_list('id', flat=True):
+        publish(topic_for(channel_id=channel_id), event)
+
+
+# Un salon ou un canal créé, renommé ou supprimé invalide l'annuaire en cache
+@receiver([post_save, post_delete], sender=Salon)
+@receiver([post_save, post_delete], sender=Channel)
+def invalidate_directory(sender, instance, **kwargs):
+    bump_directory_version()
+
+
+def _deleted_with(origin, *models):
+    """Vrai si la suppression en cours vient d'une instance ou d'un queryset de `models`."""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in models
+
+
+# Participation au salon et version (ETag) de la conversation suivent chaque
+# message créé, modifié ou supprimé, quel que soit le chemin (API, admin,
+# cascade). Les insertions par bulk_create (écriture différée, import) les
+# tiennent à jour elles-mêmes, par lot ; un salon ou un canal supprimé
+# emporte ses messages sans décompte message par message
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        SalonMembership.record_message(instance.get_salon_id(), instance.auteur_id, instance.date_envoi)
+    instance.bump_version(changed=not created)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Salon, Channel):
+        return
+    SalonMembership.record_deletion(instance.get_salon_id(), instance.auteur_id)
+    instance.bump_version(changed=True)
+
+
+@receiver(pre_delete, sender=Channel)
+def channel_deleting(sender, instance, origin=None, **kwargs):
+    if _deleted_with(origin, Salon):
+        return
+    authors = instance.messages.values_list('auteur_id').annotate(n=Count('id')).order_by()
+    for user_id, count in authors:
+        SalonMembership.record_deletion(instance.salon_id, user_id, count)
+
+
+# Comptage des références aux fichiers du stockage adressé par contenu
+# (la miniature est comptée par chat/thumbnails.py, qui l'enregistre par update())
+@receiver(post_save, sender=Message)
+def acquire_message_files(sender, instance, created, **kwargs):
+    if created and instance.fichier:
+        StoredFile.acquire(instance.fichier.name)
+
+
+@receiver(post_delete, sender=Message)
+def release_message_files(sender, instance, **kwargs):
+    for field_file in (instance.fichier, instance.miniature):
+        if field_file:
+            StoredFile.release(field_file.name)
+
+
+@receiver(post_delete, sender=ArchivedMessageBatch)
+def release_archived_files(sender, instance, **kwargs):
+    for entry in decode(instance):
+        for name in (entry.get('fichier'), entry.get('miniature')):
+            if name:
+                StoredFile.release(name)
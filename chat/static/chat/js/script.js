@@ -22,135 +22,379 @@
     return path;
   }
 
-  function renderMessages(container, messages, permissions = { can_edit_own: true, can_delete_own: true, can_moderate: false }){
-    console.log('renderMessages called with', messages.length, 'messages and permissions:', permissions);
-    container.innerHTML = '';
-    messages.forEach(m => {
-      const el = document.createElement('div');
-      el.className = 'mb-2 message-item';
-      el.setAttribute('data-message-id', m.id);
-      
-      // Create the message content
-      const contentDiv = document.createElement('div');
-      contentDiv.className = 'd-flex justify-content-between align-items-start';
-      
-      const textDiv = document.createElement('div');
-      textDiv.className = 'flex-grow-1';
-      let html = `<strong>${escapeHtml(m.auteur)}</strong>: <span class="message-content">${escapeHtml(m.contenu)}</span>`;
-      if (m.fichier_url) {
-        const fileName = m.fichier_nom || 'Fichier';
-        const fileExt = fileName.split('.').pop().toLowerCase();
-        if (['jpg', 'jpeg', 'png', 'gif'].includes(fileExt)) {
-          html += `<div class="mt-1"><img src="${m.fichier_url}" alt="${fileName}" class="img-fluid rounded" style="max-width: 300px; max-height: 300px;"></div>`;
-        } else {
-          html += `<div class="mt-1"><a href="${m.fichier_url}" target="_blank" class="btn btn-sm btn-outline-primary"><i class="fas fa-download"></i> ${escapeHtml(fileName)}</a></div>`;
-        }
-      }
-      html += ` <div class="text-muted small">${new Date(m.date_envoi).toLocaleString()}</div>`;
-      textDiv.innerHTML = html;
-      
-      const actionsDiv = document.createElement('div');
-      actionsDiv.className = 'message-actions';
-      
-      // Show edit/delete buttons for own messages
-      if (m.auteur === window.CURRENT_USER && permissions.can_edit_own) {
-        const editBtn = document.createElement('button');
-        editBtn.className = 'btn btn-sm btn-warning ms-2 edit-btn';
-        editBtn.setAttribute('data-message-id', m.id);
-        editBtn.title = 'Modifier';
-        editBtn.innerHTML = '✏️';
-        editBtn.style.fontSize = '1rem';
-        editBtn.style.padding = '2px 6px';
-        
-        actionsDiv.appendChild(editBtn);
-        editBtn.addEventListener('click', () => handleEdit(m.id, el, container));
-      }
-      
-      // Show delete button for own messages or if moderator
-      if ((m.auteur === window.CURRENT_USER && permissions.can_delete_own) || permissions.can_moderate) {
-        const deleteBtn = document.createElement('button');
-        deleteBtn.className = 'btn btn-sm btn-danger ms-2 delete-btn';
-        deleteBtn.setAttribute('data-message-id', m.id);
-        deleteBtn.title = 'Supprimer';
-        deleteBtn.innerHTML = '🗑️';
-        deleteBtn.style.fontSize = '1rem';
-        deleteBtn.style.padding = '2px 6px';
-        
-        actionsDiv.appendChild(deleteBtn);
-        deleteBtn.addEventListener('click', () => handleDelete(m.id, el, container));
-      }
-      
-      contentDiv.appendChild(textDiv);
-      contentDiv.appendChild(actionsDiv);
-      el.appendChild(contentDiv);
-      
-      container.appendChild(el);
-    });
-    container.scrollTop = container.scrollHeight;
-    
-    // Debug: count buttons in DOM
-    const editButtons = container.querySelectorAll('.edit-btn');
-    const deleteButtons = container.querySelectorAll('.delete-btn');
-    console.log('After rendering:', editButtons.length, 'edit buttons and', deleteButtons.length, 'delete buttons found in DOM');
+  // Conditional GET: keeps the last ETag and body per key and replays the
+  // body when the server answers 304 Not Modified.
+  const conditionalCache = new Map();
+  async function fetchJsonConditional(key, url){
+    const cached = conditionalCache.get(key);
+    const headers = cached && cached.url === url ? {'If-None-Match': cached.etag} : {};
+    const resp = await fetch(url, {credentials: 'same-origin', headers: headers, cache: 'no-store'});
+    if (resp.status === 304 && cached) return {resp: resp, data: cached.data, notModified: true};
+    if (!resp.ok) return {resp: resp, data: null, notModified: false};
+    const data = await resp.json();
+    const etag = resp.headers.get('ETag');
+    if (etag) conditionalCache.set(key, {url: url, etag: etag, data: data});
+    return {resp: resp, data: data, notModified: false};
   }
 
-  function appendMessage(container, m, permissions = { can_edit_own: true, can_delete_own: true, can_moderate: false }){
+  // Streamed message list (api/.../messages/stream/): one JSON document with
+  // one message per line, so each line is decoded as soon as it arrives and
+  // `onMessages` renders the page progressively.
+  async function streamMessages(url, onMessages){
+    const resp = await fetch(url, {credentials: 'same-origin', cache: 'no-store'});
+    if (!resp.ok || !resp.body) return {resp: resp, hasMore: false};
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let pending = '';
+    let hasMore = false;
+    let header = true;
+    function handle(lines){
+      const messages = [];
+      lines.forEach(line => {
+        if (header) { header = false; return; }  // {"messages":[
+        if (line.startsWith(']')) { hasMore = line.includes('"has_more":true'); return; }
+        if (line) messages.push(JSON.parse(line.endsWith(',') ? line.slice(0, -1) : line));
+      });
+      if (messages.length) onMessages(messages);
+    }
+    while (true) {
+      const {done, value} = await reader.read();
+      if (done) break;
+      pending += decoder.decode(value, {stream: true});
+      const lines = pending.split('\n');
+      pending = lines.pop();
+      handle(lines);
+    }
+    handle([pending + decoder.decode()]);
+    return {resp: resp, hasMore: hasMore};
+  }
+
+  function buildMessageElement(container, m, permissions){
     const el = document.createElement('div');
     el.className = 'mb-2 message-item';
     el.setAttribute('data-message-id', m.id);
-    
+
     // Create the message content
     const contentDiv = document.createElement('div');
     contentDiv.className = 'd-flex justify-content-between align-items-start';
-    
+
     const textDiv = document.createElement('div');
     textDiv.className = 'flex-grow-1';
     let html = `<strong>${escapeHtml(m.auteur)}</strong>: <span class="message-content">${escapeHtml(m.contenu)}</span>`;
     if (m.fichier_url) {
       const fileName = m.fichier_nom || 'Fichier';
       const fileExt = fileName.split('.').pop().toLowerCase();
-      if (['jpg', 'jpeg', 'png', 'gif'].includes(fileExt)) {
-        html += `<div class="mt-1"><img src="${m.fichier_url}" alt="${fileName}" class="img-fluid rounded" style="max-width: 300px; max-height: 300px;"></div>`;
+      if (['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp'].includes(fileExt)) {
+        // Thumbnail once generated (the full image stays one click away);
+        // known dimensions reserve the space before the image loads
+        const size = m.largeur ? ` width="${m.largeur}" height="${m.hauteur}"` : '';
+        html += `<div class="mt-1"><a href="${m.fichier_url}" target="_blank"><img src="${m.miniature_url || m.fichier_url}" alt="${escapeHtml(fileName)}"${size} loading="lazy" decoding="async" class="img-fluid rounded message-image" style="max-width: 300px; max-height: 300px; width: auto; height: auto;"></a></div>`;
       } else {
         html += `<div class="mt-1"><a href="${m.fichier_url}" target="_blank" class="btn btn-sm btn-outline-primary"><i class="fas fa-download"></i> ${escapeHtml(fileName)}</a></div>`;
       }
     }
     html += ` <div class="text-muted small">${new Date(m.date_envoi).toLocaleString()}</div>`;
     textDiv.innerHTML = html;
-    
+
     const actionsDiv = document.createElement('div');
     actionsDiv.className = 'message-actions';
-    
+
     // Show edit/delete buttons for own messages
     if (m.auteur === window.CURRENT_USER && permissions.can_edit_own) {
       const editBtn = document.createElement('button');
-      editBtn.className = 'btn btn-sm btn-outline-secondary edit-btn';
+      editBtn.className = 'btn btn-sm btn-warning ms-2 edit-btn';
       editBtn.setAttribute('data-message-id', m.id);
       editBtn.title = 'Modifier';
-      editBtn.innerHTML = '<i class="fas fa-edit"></i>';
-      
+      editBtn.innerHTML = '✏️';
+      editBtn.style.fontSize = '1rem';
+      editBtn.style.padding = '2px 6px';
+
       actionsDiv.appendChild(editBtn);
       editBtn.addEventListener('click', () => handleEdit(m.id, el, container));
     }
-    
+
     // Show delete button for own messages or if moderator
     if ((m.auteur === window.CURRENT_USER && permissions.can_delete_own) || permissions.can_moderate) {
       const deleteBtn = document.createElement('button');
-      deleteBtn.className = 'btn btn-sm btn-outline-danger delete-btn';
+      deleteBtn.className = 'btn btn-sm btn-danger ms-2 delete-btn';
       deleteBtn.setAttribute('data-message-id', m.id);
       deleteBtn.title = 'Supprimer';
-      deleteBtn.innerHTML = '<i class="fas fa-trash"></i>';
-      
+      deleteBtn.innerHTML = '🗑️';
+      deleteBtn.style.fontSize = '1rem';
+      deleteBtn.style.padding = '2px 6px';
+
       actionsDiv.appendChild(deleteBtn);
       deleteBtn.addEventListener('click', () => handleDelete(m.id, el, container));
     }
-    
+
     contentDiv.appendChild(textDiv);
     contentDiv.appendChild(actionsDiv);
     el.appendChild(contentDiv);
-    
-    container.appendChild(el);
-    container.scrollTop = container.scrollHeight;
+    return el;
+  }
+
+  // Virtualized message list. Every loaded message stays in memory, in id
+  // order, but only those around the visible area have a DOM node (keyed by
+  // message id); two spacers stand for the others, with their measured
+  // height (an estimate until first displayed). Adding, editing or deleting
+  // a message patches its own node only.
+  const ESTIMATED_HEIGHT = 60;
+  const messageLists = new WeakMap();
+
+  class MessageList {
+    constructor(container, permissions){
+      this.container = container;
+      this.permissions = permissions;
+      this.items = [];           // messages in id order
+      this.byId = new Map();     // id -> message
+      this.nodes = new Map();    // id -> element, rendered messages only
+      this.heights = new Map();  // id -> measured height (px)
+      this.offsets = null;       // offsets[i]: top of items[i]; null when stale
+      this.start = 0;
+      this.onScroll = null;
+      container.innerHTML = '';
+      container.style.position = 'relative';  // offsetTop measured from the list
+      this.topSpacer = document.createElement('div');
+      this.body = document.createElement('div');
+      this.body.style.display = 'flow-root';  // keeps the last margin inside
+      this.bottomSpacer = document.createElement('div');
+      container.append(this.topSpacer, this.body, this.bottomSpacer);
+      let scheduled = false;
+      container.addEventListener('scroll', () => {
+        if (scheduled) return;
+        scheduled = true;
+        requestAnimationFrame(() => {
+          scheduled = false;
+          this.render();
+          if (this.onScroll) this.onScroll();
+        });
+      });
+      messageLists.set(container, this);
+    }
+
+    get size(){ return this.items.length; }
+    firstId(){ return this.items.length ? this.items[0].id : null; }
+    lastId(){ return this.items.length ? this.items[this.items.length - 1].id : null; }
+    // First rendered message (null before the first render)
+    windowFirstId(){ return this.start < this.items.length ? this.items[this.start].id : null; }
+    has(id){ return this.byId.has(id); }
+
+    atBottom(){
+      const c = this.container;
+      return c.scrollHeight - c.scrollTop - c.clientHeight < 40;
+    }
+
+    nearTop(){
+      return this.container.scrollTop - this.topSpacer.offsetTop < this.container.clientHeight;
+    }
+
+    position(id){
+      let lo = 0, hi = this.items.length;
+      while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (this.items[mid].id < id) lo = mid + 1; else hi = mid;
+      }
+      return lo;
+    }
+
+    computeOffsets(){
+      const offsets = new Array(this.items.length + 1);
+      offsets[0] = 0;
+      this.items.forEach((m, i) => {
+        offsets[i + 1] = offsets[i] + (this.heights.get(m.id) || ESTIMATED_HEIGHT);
+      });
+      this.offsets = offsets;
+    }
+
+    // Index of the message at `y` px from the top of the list
+    indexAt(y){
+      let lo = 0, hi = this.items.length - 1;
+      while (lo < hi) {
+        const mid = (lo + hi + 1) >> 1;
+        if (this.offsets[mid] <= y) lo = mid; else hi = mid - 1;
+      }
+      return Math.max(0, lo);
+    }
+
+    // First rendered message and its distance to the top of the viewport,
+    // to keep it in place when messages are inserted or removed above it
+    anchor(){
+      if (!this.offsets || this.start >= this.items.length) return null;
+      const top = this.container.scrollTop - this.topSpacer.offsetTop;
+      return {id: this.items[this.start].id, delta: this.offsets[this.start] - top};
+    }
+
+    settle(stick, anchor){
+      this.render();
+      if (stick) {
+        this.container.scrollTop = this.container.scrollHeight;
+      } else if (anchor && this.byId.has(anchor.id)) {
+        this.container.scrollTop = this.topSpacer.offsetTop + this.offsets[this.position(anchor.id)] - anchor.delta;
+      } else {
+        return;
+      }
+      this.render();
+    }
+
+    scrollToBottom(){
+      this.settle(true, null);
+    }
+
+    // Adds new messages at their place (any order, duplicates ignored) and
+    // updates the known ones. Returns the number of messages added.
+    add(messages){
+      const stick = this.atBottom();
+      const anchor = this.anchor();
+      const fresh = [];
+      let patched = false;
+      messages.forEach(m => {
+        if (this.byId.has(m.id)) {
+          patched = this.patch(m) || patched;
+        } else {
+          this.byId.set(m.id, m);
+          fresh.push(m);
+        }
+      });
+      if (!fresh.length) {
+        if (patched) this.render();
+        return 0;
+      }
+      fresh.sort((a, b) => a.id - b.id);
+      if (!this.items.length || fresh[0].id > this.lastId()) {
+        this.items.push(...fresh);
+      } else {
+        const merged = [];
+        let i = 0, j = 0;
+        while (i < this.items.length || j < fresh.length) {
+          if (j >= fresh.length || (i < this.items.length && this.items[i].id < fresh[j].id)) merged.push(this.items[i++]);
+          else merged.push(fresh[j++]);
+        }
+        this.items = merged;
+      }
+      this.offsets = null;
+      this.settle(stick, anchor);
+      return fresh.length;
+    }
+
+    // Updates a known message and its node without rendering. Returns true
+    // when the node is on screen.
+    patch(m){
+      const known = this.byId.get(m.id);
+      if (!known) return false;
+      Object.assign(known, m);
+      const el = this.nodes.get(m.id);
+      if (!el) return false;
+      const span = el.querySelector('.message-content');
+      // Don't clobber an edit in progress
+      if (span && !span.querySelector('input')) span.textContent = known.contenu;
+      const img = el.querySelector('.message-image');
+      if (img && known.miniature_url) img.src = known.miniature_url;
+      return true;
+    }
+
+    update(m){
+      if (this.patch(m)) this.render();
+    }
+
+    remove(id){
+      this.removeMany([id]);
+    }
+
+    // Removes the given messages (unknown ids ignored). Returns the number removed.
+    removeMany(ids){
+      const gone = ids.filter(id => this.byId.has(id));
+      if (!gone.length) return 0;
+      const stick = this.atBottom();
+      const anchor = this.anchor();
+      const removed = new Set(gone);
+      gone.forEach(id => {
+        this.byId.delete(id);
+        this.heights.delete(id);
+        const el = this.nodes.get(id);
+        if (el) el.remove();
+        this.nodes.delete(id);
+      });
+      this.items = this.items.filter(m => !removed.has(m.id));
+      this.offsets = null;
+      this.settle(stick, anchor);
+      return gone.length;
+    }
+
+    // Forgets the messages before `id` (they will be loaded again from the
+    // server when the reader scrolls up). Returns the number removed.
+    dropBefore(id){
+      return this.removeMany(this.items.slice(0, this.position(id)).map(m => m.id));
+    }
+
+    // Replaces the known messages with ids in [from, to] by `messages`, the
+    // server's current version of that range: missing ones were deleted
+    sync(messages, from, to){
+      const present = new Set(messages.map(m => m.id));
+      const gone = this.items.slice(this.position(from), this.position(to + 1))
+        .map(m => m.id).filter(id => !present.has(id));
+      this.removeMany(gone);
+      this.add(messages);
+    }
+
+    // Rendered nodes are rebuilt with the new edit/delete buttons
+    setPermissions(permissions){
+      this.permissions = permissions;
+      this.nodes.forEach(el => el.remove());
+      this.nodes.clear();
+      this.render();
+    }
+
+    reset(messages){
+      this.items = [];
+      this.byId.clear();
+      this.nodes.forEach(el => el.remove());
+      this.nodes.clear();
+      this.heights.clear();
+      this.offsets = null;
+      this.add(messages);
+      this.scrollToBottom();
+    }
+
+    // Renders the messages from one screen above to one screen below the
+    // viewport, reusing the nodes already there
+    render(){
+      if (!this.offsets) this.computeOffsets();
+      const c = this.container;
+      const count = this.items.length;
+      const top = c.scrollTop - this.topSpacer.offsetTop;
+      const start = count ? this.indexAt(top - c.clientHeight) : 0;
+      const end = count ? Math.min(count, this.indexAt(top + 2 * c.clientHeight) + 1) : 0;
+      const visible = this.items.slice(start, end);
+      const wanted = new Set(visible.map(m => m.id));
+      this.nodes.forEach((el, id) => {
+        if (!wanted.has(id)) { el.remove(); this.nodes.delete(id); }
+      });
+      let cursor = this.body.firstChild;
+      visible.forEach(m => {
+        let el = this.nodes.get(m.id);
+        if (!el) {
+          el = buildMessageElement(c, m, this.permissions);
+          this.nodes.set(m.id, el);
+        }
+        if (el === cursor) cursor = cursor.nextSibling;
+        else this.body.insertBefore(el, cursor);
+      });
+      this.start = start;
+
+      // Measured heights replace the estimates
+      const elements = visible.map(m => this.nodes.get(m.id));
+      elements.forEach((el, k) => {
+        const next = k + 1 < elements.length ? elements[k + 1].offsetTop : this.bottomSpacer.offsetTop;
+        const height = next - el.offsetTop;
+        if (height > 0 && this.heights.get(visible[k].id) !== height) {
+          this.heights.set(visible[k].id, height);
+          this.offsets = null;
+        }
+      });
+      if (!this.offsets) this.computeOffsets();
+      this.topSpacer.style.height = `${this.offsets[start]}px`;
+      this.bottomSpacer.style.height = `${this.offsets[count] - this.offsets[end]}px`;
+    }
   }
 
   function escapeHtml(s){
@@ -170,44 +414,27 @@
     setTimeout(()=>{ a.classList.add('fade'); a.classList.remove('show'); try{a.remove()}catch(e){} }, 6000);
   }
 
-  async function getUserPermissions(salonSlug) {
-    try {
-      const resp = await fetch(buildUrl(`api/salon/${salonSlug}/users/`), {credentials: 'same-origin'});
-      if (!resp.ok) return { can_edit_own: true, can_delete_own: true, can_moderate: false };
-
-      const data = await resp.json();
-      const currentUser = data.users.find(u => u.username === window.CURRENT_USER);
-      console.log('User permissions data:', data, 'Current user:', window.CURRENT_USER, 'Found user:', currentUser);
-
-      if (!currentUser) return { can_edit_own: true, can_delete_own: true, can_moderate: false };
-
-      const permissions = {
-        can_edit_own: true,
-        can_delete_own: true,
-        can_moderate: currentUser.is_moderator || currentUser.is_admin,
-        is_admin: currentUser.is_admin,
-        is_moderator: currentUser.is_moderator,
-        is_banned: currentUser.is_banned
-      };
-      console.log('Calculated permissions:', permissions);
-      return permissions;
-    } catch (e) {
-      console.error('Error getting user permissions:', e);
-      return { can_edit_own: true, can_delete_own: true, can_moderate: false };
-    }
-  }
-
-  function attachListeners(container) {
-    container.querySelectorAll('.edit-btn').forEach(btn => {
-      const messageId = btn.getAttribute('data-message-id');
-      const messageItem = btn.closest('.message-item');
-      btn.addEventListener('click', () => handleEdit(messageId, messageItem, container));
-    });
-    container.querySelectorAll('.delete-btn').forEach(btn => {
-      const messageId = btn.getAttribute('data-message-id');
-      const messageItem = btn.closest('.message-item');
-      btn.addEventListener('click', () => handleDelete(messageId, messageItem, container));
-    });
+  // Current user's permissions per salon (api/salon/<slug>/me/), kept until
+  // a permissions.changed event for this user or PERMISSIONS_MAX_AGE
+  const PERMISSIONS_MAX_AGE = 5 * 60 * 1000;
+  const DEFAULT_PERMISSIONS = { can_edit_own: true, can_delete_own: true, can_moderate: false };
+  const permissionsCache = new Map();
+  function getUserPermissions(salonSlug, refresh = false) {
+    const cached = permissionsCache.get(salonSlug);
+    if (cached && !refresh && Date.now() - cached.at < PERMISSIONS_MAX_AGE) return cached.promise;
+    const promise = fetchJsonConditional(`permissions:${salonSlug}`, buildUrl(`api/salon/${salonSlug}/me/`))
+      .then(({resp, data, notModified}) => {
+        if (notModified && cached) return cached.promise;
+        if (!data) throw new Error(`HTTP ${resp.status}`);
+        return Object.assign({ can_edit_own: true, can_delete_own: true }, data);
+      })
+      .catch(e => {
+        console.error('Error getting user permissions:', e);
+        permissionsCache.delete(salonSlug);
+        return cached ? cached.promise : DEFAULT_PERMISSIONS;
+      });
+    permissionsCache.set(salonSlug, {at: Date.now(), promise: promise});
+    return promise;
   }
 
   async function handleEdit(messageId, messageItem, container) {
@@ -258,7 +485,8 @@
             return;
           }
           
-          contentSpan.innerHTML = escapeHtml(newContent);
+          contentSpan.textContent = newContent;
+          messageLists.get(container).update({id: messageId, contenu: newContent});
           showAlert(container, 'Message modifié avec succès', 'success');
         } catch (e) {
           console.error(e);
@@ -300,8 +528,7 @@
           return;
         }
         
-        // Remove the message from DOM
-        messageItem.remove();
+        messageLists.get(container).remove(messageId);
         showAlert(container, 'Message supprimé avec succès', 'success');
       } catch (e) {
         console.error(e);
@@ -428,15 +655,76 @@
       ? `api/salon/${chatSlug}/${channelSlug}/messages/send/`
       : `api/salon/${chatSlug}/messages/send/`;
 
+    const list = new MessageList(messagesEl, userPermissions);
+
+    // Permissions: fetched once, then again when the server announces a
+    // change for this user (WebSocket) and every PERMISSIONS_MAX_AGE
+    async function refreshPermissions(force = false){
+      const permissions = await getUserPermissions(chatSlug, force);
+      if (permissions === userPermissions) return;
+      userPermissions = permissions;
+      list.setPermissions(permissions);
+    }
+    setInterval(() => refreshPermissions(true), PERMISSIONS_MAX_AGE);
+
+    // Id of the most recent message displayed, used as polling cursor
+    let lastMessageId = null;
+
+    // Polling only asks for new ids: edits and deletions are signalled by
+    // changes_version, after which the messages from the rendered window
+    // onward are fetched again (those above it are dropped and reloaded by
+    // loadOlder when the reader scrolls up)
+    let changesVersion = null;
+    function noteChanges(version){
+      if (version === undefined || version === changesVersion) return;
+      const known = changesVersion !== null;
+      changesVersion = version;
+      if (known) resync();
+    }
+    let resyncing = false;
+    let resyncAgain = false;
+    async function resync(){
+      if (resyncing) { resyncAgain = true; return; }
+      resyncing = true;
+      try{
+        do {
+          resyncAgain = false;
+          const from = list.windowFirstId();
+          if (from === null) break;
+          if (list.dropBefore(from)) hasOlder = true;
+          let before = list.lastId() + 1;
+          while (true) {
+            const resp = await fetch(buildUrl(`${messagesUrl}?before_id=${before}&limit=200`), {credentials: 'same-origin'});
+            if (!resp.ok) {
+              console.warn('Failed to reload messages', resp.status);
+              return;
+            }
+            const data = await resp.json();
+            const messages = data.messages || [];
+            list.sync(messages, data.has_more && messages.length ? messages[0].id : 0, before - 1);
+            if (!data.has_more || !messages.length || messages[0].id <= from) break;
+            before = messages[0].id;
+          }
+        } while (resyncAgain);
+      }catch(e){
+        console.error(e);
+      }finally{
+        resyncing = false;
+      }
+    }
+
     async function load(){
-      console.log('load() called');
       try{
-        const resp = await fetch(buildUrl(messagesUrl), {credentials: 'same-origin'});
+        const initial = lastMessageId === null;
+        const url = initial
+          ? buildUrl(messagesUrl)
+          : buildUrl(`${messagesUrl}?after_id=${lastMessageId}`);
+        const {resp, data, notModified} = await fetchJsonConditional('messages', url);
+        if (notModified) return;
         if(resp.status === 404){
           // Salon/Channel has been deleted
           showAlert(messagesEl, 'Ce salon/canal a été supprimé.', 'warning');
-          const pollInterval = messagesEl.dataset.pollInterval;
-          if(pollInterval) clearInterval(parseInt(pollInterval));
+          stopPolling();
           form.style.display = 'none'; // Hide the form
           return;
         }
@@ -444,16 +732,83 @@
           console.warn('Failed to load messages', resp.status);
           return;
         }
+        if (initial) await refreshPermissions();
+        noteChanges(data.changes_version);
+        const messages = data.messages || [];
+        if (initial) {
+          list.reset(messages);
+          hasOlder = data.has_more;
+          loadOlder();
+        } else {
+          list.add(messages);
+        }
+        if (messages.length) {
+          lastMessageId = messages[messages.length - 1].id;
+        } else if (initial) {
+          lastMessageId = 0;
+        }
+        // More new messages than one page: keep reading right away
+        if (!initial && data.has_more) {
+          setTimeout(load, 0);
+        }
+      }catch(e){
+        console.error(e);
+      }
+    }
+
+    // Older history, a page at a time when the reader nears the top (the
+    // list API continues into the archive)
+    let hasOlder = false;
+    let loadingOlder = false;
+    async function loadOlder(){
+      if (!hasOlder || loadingOlder || !list.size || !list.nearTop()) return;
+      loadingOlder = true;
+      try{
+        const resp = await fetch(buildUrl(`${messagesUrl}?before_id=${list.firstId()}`), {credentials: 'same-origin'});
+        if (!resp.ok) {
+          console.warn('Failed to load older messages', resp.status);
+          return;
+        }
         const data = await resp.json();
-        console.log('API response data:', data);
-        // Get user permissions for this salon
-        userPermissions = await getUserPermissions(chatSlug);
-        console.log('About to render messages with permissions:', userPermissions, 'and messages:', data.messages?.length || 0);
-        renderMessages(messagesEl, data.messages || [], userPermissions);
+        hasOlder = data.has_more;
+        list.add(data.messages || []);
+      }catch(e){
+        console.error(e);
+        return;
+      }finally{
+        loadingOlder = false;
+      }
+      // Still near the top (short pages): next page
+      setTimeout(loadOlder, 0);
+    }
+    list.onScroll = loadOlder;
+
+    // Whole history before the first loaded message, added to the list while
+    // it streams in
+    const streamUrl = isChannel
+      ? `api/salon/${chatSlug}/${channelSlug}/messages/stream/`
+      : `api/salon/${chatSlug}/messages/stream/`;
+    async function loadHistory(button){
+      if (!list.size) return;
+      button.disabled = true;
+      try{
+        const {resp, hasMore} = await streamMessages(buildUrl(`${streamUrl}?before_id=${list.firstId()}`), messages => list.add(messages));
+        if (resp.ok) {
+          hasOlder = hasMore;
+        } else if (resp.status === 429) {
+          const retry = resp.headers.get('Retry-After') || '?';
+          showAlert(messagesEl, `Trop de requêtes, réessayez dans ${retry} s.`, 'warning');
+        } else {
+          console.warn('Failed to stream history', resp.status);
+        }
       }catch(e){
         console.error(e);
+      }finally{
+        button.disabled = false;
       }
     }
+    const historyBtn = document.getElementById('historyBtn');
+    if (historyBtn) historyBtn.addEventListener('click', () => loadHistory(historyBtn));
 
     form.addEventListener('submit', async function(e){
       e.preventDefault();
@@ -503,7 +858,15 @@
           return;
         }
 
+        if(resp.status === 429){
+          const retry = resp.headers.get('Retry-After') || '?';
+          showAlert(messagesEl, `Vous envoyez trop de messages, réessayez dans ${retry} s.`, 'warning');
+          return;
+        }
+
         if(!resp.ok){
+          // Banned meanwhile, for instance
+          if (resp.status === 403) refreshPermissions(true);
           let text = '';
           try{ text = await resp.text(); }catch(e){}
           showAlert(messagesEl, text || `Erreur lors de l'envoi (${resp.status})`);
@@ -512,7 +875,8 @@
 
         // success — append returned message immediately
         const data = await resp.json();
-        appendMessage(messagesEl, data, userPermissions);
+        list.add([data]);
+        list.scrollToBottom();
         input.value = '';
         if (fileInput) fileInput.value = '';
         if (filePreview) filePreview.style.display = 'none';
@@ -531,15 +895,101 @@
       }
     });
 
-    // initial load + polling
-    load();
-    const pollInterval = setInterval(load, 3000);
-    
-    // Attach listeners to existing buttons after initial load
-    attachListeners(messagesEl);
+    // Real-time events pushed by the server (see chat/websocket.py)
+    function applyEvent(event){
+      const m = event.message || {};
+      if (event.type === 'message.created') {
+        list.add([m]);
+        if (lastMessageId !== null && m.id > lastMessageId) lastMessageId = m.id;
+      } else if (event.type === 'message.updated') {
+        list.update(m);
+      } else if (event.type === 'message.deleted') {
+        list.remove(m.id);
+      } else if (event.type === 'permissions.changed') {
+        if (event.user_id === userPermissions.user_id) refreshPermissions(true);
+      }
+    }
+
+    // Without a socket: long-poll (the server answers as soon as a message
+    // is posted), or periodic polling when the server can't hold requests
+    const waitUrl = `${messagesUrl}wait/`;
+    let pollInterval = null;
+    let longPolling = false;
+    let longPollSupported = true;
+    async function longPoll(){
+      longPolling = true;
+      while (longPolling) {
+        if (lastMessageId === null) {
+          await load();
+          if (lastMessageId === null) break;
+          continue;
+        }
+        let data;
+        try {
+          const changes = changesVersion !== null ? `&changes=${changesVersion}` : '';
+          const resp = await fetch(buildUrl(`${waitUrl}?after_id=${lastMessageId}${changes}`));
+          if (!resp.ok) {
+            // 404: let load() report the deleted salon/channel
+            if (resp.status === 404) { longPolling = false; load(); return; }
+            break;
+          }
+          data = await resp.json();
+        } catch (e) {
+          console.error(e);
+          break;
+        }
+        const messages = data.messages || [];
+        if (messages.length) {
+          list.add(messages);
+          lastMessageId = Math.max(lastMessageId, messages[messages.length - 1].id);
+        }
+        noteChanges(data.changes_version);
+        if (!data.long_poll) {
+          longPollSupported = false;
+          break;
+        }
+      }
+      if (longPolling) {
+        longPolling = false;
+        if (pollInterval === null) pollInterval = setInterval(load, 3000);
+      }
+    }
+    function startPolling(){
+      if (longPolling || pollInterval !== null) return;
+      if (longPollSupported) longPoll();
+      else pollInterval = setInterval(load, 3000);
+    }
+    function stopPolling(){
+      longPolling = false;
+      if (pollInterval !== null) clearInterval(pollInterval);
+      pollInterval = null;
+    }
+
+    // WebSocket when the server supports it (ASGI), polling otherwise
+    const socketPath = isChannel
+      ? `ws/salon/${chatSlug}/${channelSlug}/`
+      : `ws/salon/${chatSlug}/`;
+    function connectSocket(){
+      if (!('WebSocket' in window)) return;
+      const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+      const socket = new WebSocket(`${scheme}://${window.location.host}${buildUrl(socketPath)}`);
+      socket.addEventListener('open', () => {
+        stopPolling();
+        load(); // catch up on what was posted before the socket opened
+      });
+      socket.addEventListener('message', (e) => {
+        try { applyEvent(JSON.parse(e.data)); } catch (err) { console.error(err); }
+      });
+      socket.addEventListener('close', (e) => {
+        startPolling();
+        if (e.code !== 4404) setTimeout(connectSocket, 30000);
+      });
+    }
+
+    // initial load (long-poll starts with it) until the socket is open
+    startPolling();
+    connectSocket();
     
-    // Store the interval so we can clear it if needed
-    messagesEl.dataset.pollInterval = pollInterval;
   }
 
   // Moderation functions
@@ -0,0 +1,92 @@
+"""Stockage des pièces jointes adressé par contenu.
+
+Chaque fichier est rangé sous l'empreinte SHA-256 de son contenu
+(`chat_files/ab/abcd….pdf`) : une image repartagée dans plusieurs salons
+n'est stockée qu'une fois. L'empreinte est calculée pendant la réception de
+l'upload (`HashingFileUploadHandler`), sinon en relisant le fichier par
+blocs. Les références sont comptées dans `StoredFile` (voir chat/signals.py)
+et le fichier est supprimé avec le dernier message qui l'utilise. Enregistrer
+un fichier et compter sa référence se font dans une même transaction.
+"""
+import hashlib
+import os
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+def file_digest(content):
+    """Empreinte SHA-256 d'un fichier, calculée à la réception si possible."""
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    h = hashlib.sha256()
+    for chunk in content.chunks():
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def hashed_name(digest, name):
+    """`<dossier d'upload_to>/<2 premiers caractères>/<empreinte><extension>`."""
+    directory = os.path.dirname(name)
+    ext = os.path.splitext(name)[1].lower()
+    return os.path.join(directory, digest[:2], f'{digest}{ext}')
+
+
+def is_hashed_name(name):
+    """Vrai pour un nom produit par `hashed_name` (les anciens fichiers sont datés)."""
+    parts = name.split('/')
+    stem = os.path.splitext(parts[-1])[0]
+    return len(parts) >= 2 and len(stem) == 64 and parts[-2] == stem[:2]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Système de fichiers où le nom d'un fichier est l'empreinte de son contenu."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        target = hashed_name(file_digest(content), name)
+        # Dans la transaction de l'appelant, qui compte ensuite sa référence
+        # (`StoredFile.acquire`) : le fichier trouvé ne peut plus être
+        # supprimé entre-temps par la libération de sa dernière référence
+        from .models import StoredFile
+        StoredFile.lock(target)
+        if self.exists(target):
+            # Contenu déjà stocké : rien à écrire
+            return target
+        try:
+            return super().save(target, content, max_length)
+        except FileExistsError:
+            # Le même contenu vient d'être écrit par une autre requête
+            return target
+
+    def get_available_name(self, name, max_length=None):
+        if is_hashed_name(name):
+            if self.exists(name):
+                raise FileExistsError(name)
+            return name
+        return super().get_available_name(name, max_length)
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """Écrit l'upload sur disque par blocs en calculant son SHA-256 au passage."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+attachment_storage = ContentAddressedStorage()
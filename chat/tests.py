@@ -1,7 +1,33 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory, override_settings
+from django.core.cache import cache
+from django.db import models, connection, transaction, IntegrityError
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command, CommandError
 from django.contrib.auth.models import User
-from .models import Salon, Message
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .models import Salon, Channel, Message, SalonMembership, SalonRole, Ban, StoredFile, ArchivedMessageBatch
+from .permissions import get_permissions, resolve_permissions
+from .realtime import get_broker, topic_for
+from .websocket import websocket_application
+from .ingestion import Ingester
+from .conversations import resolve
+from .ratelimit import LocalBucketStore, get_store, parse_rate
+from .serializers import astream_messages, get_dumps, instance_data, message_data, message_rows, stream_messages
+from .transfer import TransferError, export_salon, import_salon
+from .archive import decode
 from django.urls import reverse
+from django.template.loader import render_to_string
+from django.utils import timezone
+from unittest import mock
+from asgiref.sync import sync_to_async
+from PIL import Image
+from datetime import timedelta
+import asyncio
+import tempfile
+import os
+import io
 import json
 
 
@@ -35,3 +61,951 @@ class ModelsTestCase(TestCase):
 		self.assertEqual(resp2.status_code, 200)
 		listed = resp2.json().get('messages', [])
 		self.assertTrue(any(m['contenu'] == 'Salut API' for m in listed))
+
+	def test_messages_api_keyset_pagination(self):
+		u = User.objects.create_user(username='carol', password='pass')
+		s = Salon.objects.create(nom='Page', slug='page')
+		ids = [Message.objects.create(salon=s, auteur=u, contenu=f'm{i}').id for i in range(5)]
+		url = reverse('api_messages_list', args=[s.slug])
+
+		# latest page, in chronological order
+		data = self.client.get(url, {'limit': 2}).json()
+		self.assertEqual([m['id'] for m in data['messages']], ids[3:])
+		self.assertTrue(data['has_more'])
+
+		# history before the oldest displayed message
+		data = self.client.get(url, {'before_id': ids[3], 'limit': 2}).json()
+		self.assertEqual([m['id'] for m in data['messages']], ids[1:3])
+
+		# polling delta
+		data = self.client.get(url, {'after_id': ids[3]}).json()
+		self.assertEqual([m['id'] for m in data['messages']], ids[4:])
+		self.assertFalse(data['has_more'])
+		self.assertEqual(data['changes_version'], 0)
+
+		# modifications et suppressions : seul changes_version l'indique au poll
+		Message.objects.filter(pk=ids[0]).get().delete()
+		m = Message.objects.get(pk=ids[1])
+		m.contenu = 'modifié'
+		m.save()
+		Message.objects.create(salon=s, auteur=u, contenu='nouveau')
+		self.assertEqual(self.client.get(url, {'after_id': ids[3]}).json()['changes_version'], 2)
+
+		self.assertEqual(self.client.get(url, {'after_id': 'x'}).status_code, 400)
+
+
+class RealtimeTestCase(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user(username='dave', password='pass')
+		cls.salon = Salon.objects.create(nom='Live', slug='live', createur=cls.user)
+
+	def test_message_post_publishes_event(self):
+		self.client.login(username='dave', password='pass')
+		url = reverse('api_messages_post', args=[self.salon.slug])
+		with mock.patch.object(get_broker(), 'publish') as publish:
+			with self.captureOnCommitCallbacks(execute=True):
+				self.client.post(url, data=json.dumps({'contenu': 'Direct'}), content_type='application/json')
+		topic, event = publish.call_args.args
+		self.assertEqual(topic, topic_for(salon_id=self.salon.id))
+		self.assertEqual(event['type'], 'message.created')
+		self.assertEqual(event['message']['contenu'], 'Direct')
+
+	async def test_websocket_receives_events(self):
+		inbox, outbox = asyncio.Queue(), asyncio.Queue()
+		await inbox.put({'type': 'websocket.connect'})
+		scope = {'type': 'websocket', 'path': '/ws/salon/live/'}
+		task = asyncio.ensure_future(websocket_application(scope, inbox.get, outbox.put))
+		self.assertEqual((await outbox.get())['type'], 'websocket.accept')
+
+		get_broker().publish(topic_for(salon_id=self.salon.id), {'type': 'message.deleted', 'message': {'id': 1}})
+		sent = await asyncio.wait_for(outbox.get(), timeout=1)
+		self.assertEqual(json.loads(sent['text'])['type'], 'message.deleted')
+
+		await inbox.put({'type': 'websocket.disconnect'})
+		await asyncio.wait_for(task, timeout=1)
+		self.assertEqual(get_broker().subscriber_count(topic_for(salon_id=self.salon.id)), 0)
+
+	async def test_long_poll_returns_when_message_published(self):
+		url = reverse('api_messages_wait', args=['live'])
+		first = await Message.objects.acreate(salon=self.salon, auteur=self.user, contenu='avant')
+		data = (await self.async_client.get(url, {'after_id': 0})).json()
+		self.assertEqual([m['id'] for m in data['messages']], [first.id])
+
+		waiting = asyncio.ensure_future(self.async_client.get(url, {'after_id': first.id, 'timeout': 5}))
+		while not get_broker().subscriber_count(topic_for(salon_id=self.salon.id)):
+			await asyncio.sleep(0.01)
+		second = await Message.objects.acreate(salon=self.salon, auteur=self.user, contenu='après')
+		get_broker().publish(topic_for(salon_id=self.salon.id), {'type': 'message.created', 'message': {'id': second.id}})
+		data = (await asyncio.wait_for(waiting, timeout=2)).json()
+		self.assertEqual([m['id'] for m in data['messages']], [second.id])
+		self.assertTrue(data['long_poll'])
+
+		data = (await self.async_client.get(url, {'after_id': second.id, 'timeout': 0.05})).json()
+		self.assertEqual(data['messages'], [])
+
+	async def test_long_poll_with_changes_returns_on_edit(self):
+		url = reverse('api_messages_wait', args=['live'])
+		first = await Message.objects.acreate(salon=self.salon, auteur=self.user, contenu='avant')
+		data = (await self.async_client.get(url, {'after_id': first.id, 'changes': 0, 'timeout': 0.05})).json()
+		self.assertEqual((data['messages'], data['changes_version']), ([], 0))
+
+		waiting = asyncio.ensure_future(self.async_client.get(url, {'after_id': first.id, 'changes': 0, 'timeout': 5}))
+		while not get_broker().subscriber_count(topic_for(salon_id=self.salon.id)):
+			await asyncio.sleep(0.01)
+		first.contenu = 'corrigé'
+		await first.asave()
+		get_broker().publish(topic_for(salon_id=self.salon.id), {'type': 'message.updated', 'message': {'id': first.id}})
+		data = (await asyncio.wait_for(waiting, timeout=2)).json()
+		self.assertEqual((data['messages'], data['changes_version']), ([], 1))
+		# Version déjà en retard : réponse immédiate
+		data = (await self.async_client.get(url, {'after_id': first.id, 'changes': 0, 'timeout': 5})).json()
+		self.assertEqual(data['changes_version'], 1)
+
+	async def test_websocket_unknown_salon_is_closed(self):
+		inbox, outbox = asyncio.Queue(), asyncio.Queue()
+		await inbox.put({'type': 'websocket.connect'})
+		await websocket_application({'type': 'websocket', 'path': '/ws/salon/nope/'}, inbox.get, outbox.put)
+		self.assertEqual((await outbox.get())['type'], 'websocket.close')
+
+
+class SalonUsersTestCase(TestCase):
+	def test_salon_users_constant_query_count(self):
+		owner = User.objects.create_user(username='owner', password='pass')
+		s = Salon.objects.create(nom='Foule', slug='foule', createur=owner)
+		c = Channel.objects.create(nom='General', slug='general', salon=s)
+		self.client.force_login(owner)
+		url = reverse('api_salon_users', args=[s.slug])
+
+		def add_users(start, count):
+			for i in range(start, start + count):
+				u = User.objects.create_user(username=f'user{i}')
+				Message.objects.create(salon=s, auteur=u, contenu='a')
+				Message.objects.create(channel=c, auteur=u, contenu='b')
+			SalonRole.objects.create(salon=s, user=u, role='moderator')
+			Ban.objects.create(salon=s, user=User.objects.get(username=f'user{start}'), banned_by=owner)
+
+		add_users(0, 3)
+		# session + user, version (ETag), salon, roles, bans, users
+		with self.assertNumQueries(7):
+			data = self.client.get(url).json()
+		self.assertEqual(len(data['users']), 4)
+
+		add_users(3, 20)
+		with self.assertNumQueries(7):
+			data = self.client.get(url).json()
+		users = {u['username']: u for u in data['users']}
+		self.assertEqual(len(users), 24)
+		self.assertTrue(users['owner']['is_admin'])
+		self.assertTrue(users['user22']['is_moderator'])
+		self.assertFalse(users['user22']['is_admin'])
+		self.assertTrue(users['user3']['is_banned'])
+		self.assertFalse(users['user4']['is_banned'])
+
+	def test_membership_maintained_by_message_api(self):
+		owner = User.objects.create_user(username='gina', password='pass')
+		s = Salon.objects.create(nom='Membres', slug='membres', createur=owner)
+		c = Channel.objects.create(nom='Annexe', slug='annexe', salon=s)
+		self.client.login(username='gina', password='pass')
+		for url in (reverse('api_messages_post', args=[s.slug]),
+					reverse('api_channel_messages_post', args=[s.slug, c.slug])):
+			resp = self.client.post(url, data=json.dumps({'contenu': 'x'}), content_type='application/json')
+		membership = SalonMembership.objects.get(salon=s, user=owner)
+		self.assertEqual(membership.message_count, 2)
+		self.assertLessEqual(membership.first_message_at, membership.last_message_at)
+
+		self.client.post(reverse('api_messages_delete', args=[resp.json()['id']]))
+		membership.refresh_from_db()
+		self.assertEqual(membership.message_count, 1)
+
+	def test_membership_and_version_follow_orm_writes(self):
+		owner = User.objects.create_user(username='hana')
+		author = User.objects.create_user(username='ines')
+		s = Salon.objects.create(nom='Admin', slug='admin-salon', createur=owner)
+		c = Channel.objects.create(nom='Bis', slug='bis', salon=s)
+		# Comme depuis l'admin : ni la vue ni l'écriture différée
+		m = Message.objects.create(channel=c, auteur=author, contenu='x')
+		Message.objects.create(channel=c, auteur=author, contenu='y')
+		self.assertEqual(SalonMembership.objects.get(salon=s, user=author).message_count, 2)
+		c.refresh_from_db()
+		self.assertEqual(c.messages_version, 2)
+
+		m.contenu = 'modifié'
+		m.save()
+		Message.objects.filter(pk=m.pk).delete()
+		c.refresh_from_db()
+		self.assertEqual(c.messages_version, 4)
+		self.assertEqual(SalonMembership.objects.get(salon=s, user=author).message_count, 1)
+
+		c.delete()
+		self.assertEqual(SalonMembership.objects.get(salon=s, user=author).message_count, 0)
+		self.client.force_login(owner)
+		usernames = [u['username'] for u in self.client.get(reverse('api_salon_users', args=[s.slug])).json()['users']]
+		self.assertEqual(usernames, ['hana', 'ines'])
+
+
+class PermissionsTestCase(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.owner = User.objects.create_user(username='erin')
+		cls.member = User.objects.create_user(username='frank')
+		cls.salon = Salon.objects.create(nom='Perms', slug='perms', createur=cls.owner)
+
+	def test_permissions_memoized_per_request(self):
+		SalonRole.objects.create(salon=self.salon, user=self.member, role='moderator')
+		request = RequestFactory().get('/')
+		request.user = self.member
+		with self.assertNumQueries(1):
+			perms = get_permissions(request, self.salon)
+			self.assertTrue(get_permissions(request, self.salon).can_moderate)
+		self.assertFalse(perms.is_admin)
+		self.assertFalse(perms.is_banned)
+		self.assertTrue(resolve_permissions(self.salon, self.owner).can_manage_users)
+
+	@override_settings(CHAT_PERMISSIONS_CACHE_TTL=60)
+	def test_shared_cache_invalidated_on_writes(self):
+		cache.clear()
+		self.assertFalse(self.salon.is_banned(self.member))
+		with self.assertNumQueries(0):
+			self.assertFalse(self.salon.is_banned(self.member))
+		ban = Ban.objects.create(salon=self.salon, user=self.member, banned_by=self.owner)
+		self.assertTrue(self.salon.is_banned(self.member))
+		ban.is_active = False
+		ban.save()
+		self.assertFalse(self.salon.is_banned(self.member))
+
+	def test_my_permissions_endpoint_and_change_event(self):
+		channel = Channel.objects.create(salon=self.salon, nom='Coin', slug='coin')
+		url = reverse('api_salon_my_permissions', args=['perms'])
+		self.assertEqual(self.client.get(url).status_code, 302)
+		self.client.force_login(self.member)
+		resp = self.client.get(url)
+		self.assertEqual(resp.json()['user_id'], self.member.id)
+		self.assertFalse(resp.json()['can_moderate'])
+		self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag']).status_code, 304)
+
+		with mock.patch.object(get_broker(), 'publish') as publish:
+			with self.captureOnCommitCallbacks(execute=True):
+				SalonRole.objects.create(salon=self.salon, user=self.member, role='moderator')
+		self.assertEqual({call.args[0] for call in publish.call_args_list},
+			{topic_for(salon_id=self.salon.id), topic_for(channel_id=channel.id)})
+		self.assertEqual(publish.call_args.args[1], {'type': 'permissions.changed', 'user_id': self.member.id})
+		resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(resp.status_code, 200)
+		self.assertTrue(resp.json()['can_moderate'])
+
+
+class QueryPlanTestCase(TestCase):
+	def test_hot_queries_use_indexes(self):
+		# Lève CommandError si un plan contient un parcours complet ou un tri
+		call_command('explain_queries', stdout=io.StringIO())
+
+
+class BenchmarkCommandsTestCase(TestCase):
+	def test_generate_and_bench(self):
+		call_command('generate_chat_data', salons=1, channels=1, messages=20, users=5, stdout=io.StringIO())
+		self.assertEqual(Message.objects.count(), 40)
+		self.assertEqual(SalonMembership.objects.aggregate(n=models.Sum('message_count'))['n'], 40)
+
+		with tempfile.NamedTemporaryFile(suffix='.json') as out:
+			call_command('bench_chat_api', iterations=2, warmup=0, output=out.name, stdout=io.StringIO(), stderr=io.StringIO())
+			report = json.load(open(out.name))
+		self.assertIn('api_salon_users', report['endpoints'])
+		self.assertEqual(report['skipped'], [])
+		for name, result in report['endpoints'].items():
+			self.assertTrue(all(200 <= code < 300 for code in result['status']), name)
+
+
+class SearchTestCase(TestCase):
+	def test_search_follows_create_edit_delete(self):
+		u = User.objects.create_user(username='hugo')
+		v = User.objects.create_user(username='iris')
+		s = Salon.objects.create(nom='Cherche', slug='cherche', createur=u)
+		c = Channel.objects.create(nom='Fil', slug='fil', salon=s)
+		other = Salon.objects.create(nom='Ailleurs', slug='ailleurs', createur=u)
+		m1 = Message.objects.create(salon=s, auteur=u, contenu='Le déjeuner est prêt')
+		m2 = Message.objects.create(channel=c, auteur=v, contenu='Déjeuner au resto ?')
+		Message.objects.create(salon=other, auteur=u, contenu='déjeuner ailleurs')
+		url = reverse('api_messages_search', args=[s.slug])
+
+		def ids(**params):
+			resp = self.client.get(url, params)
+			self.assertEqual(resp.status_code, 200)
+			return [m['id'] for m in resp.json()['messages']]
+
+		self.assertEqual(ids(q='dejeuner'), [m1.id, m2.id])
+		self.assertEqual(ids(q='déj'), [m1.id, m2.id])
+		self.assertEqual(ids(q='dejeuner', channel='fil'), [m2.id])
+		self.assertEqual(ids(q='dejeuner', auteur='hugo'), [m1.id])
+		self.assertEqual(ids(q='dejeuner', until='2000-01-01'), [])
+		channel_url = reverse('api_channel_messages_search', args=[s.slug, c.slug])
+		self.assertEqual([m['id'] for m in self.client.get(channel_url, {'q': 'dejeuner'}).json()['messages']], [m2.id])
+		self.assertEqual(self.client.get(reverse('api_channel_messages_search', args=['ailleurs', c.slug]), {'q': 'dejeuner'}).status_code, 404)
+
+		m1.contenu = 'Le dîner est prêt'
+		m1.save()
+		self.assertEqual(ids(q='dejeuner'), [m2.id])
+		self.assertEqual(ids(q='diner'), [m1.id])
+		m2.delete()
+		self.assertEqual(ids(q='dejeuner'), [])
+		self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class ConditionalResponsesTestCase(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user(username='jade', password='pass')
+		cls.target = User.objects.create_user(username='karl')
+		cls.salon = Salon.objects.create(nom='Etag', slug='etag', createur=cls.user)
+		cls.channel = Channel.objects.create(nom='Sub', slug='sub', salon=cls.salon)
+
+	def assertRevalidates(self, url, change, queries=1, **params):
+		etag = self.client.get(url, params)['ETag']
+		# 304 décidé sur le seul compteur de version, sans lire les messages
+		with self.assertNumQueries(queries):
+			resp = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 304)
+		change()
+		resp = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 200)
+		self.assertNotEqual(resp['ETag'], etag)
+
+	def test_message_lists_not_modified_until_new_message(self):
+		self.client.login(username='jade', password='pass')
+		for list_url, post_url in (
+			(reverse('api_messages_list', args=['etag']), reverse('api_messages_post', args=['etag'])),
+			(reverse('api_channel_messages_list', args=['etag', 'sub']), reverse('api_channel_messages_post', args=['etag', 'sub'])),
+		):
+			post = lambda: self.client.post(post_url, data=json.dumps({'contenu': 'x'}), content_type='application/json')
+			self.assertRevalidates(list_url, post, after_id=0)
+
+	def test_salon_users_not_modified_until_ban(self):
+		self.client.login(username='jade', password='pass')
+		ban = lambda: Ban.objects.create(salon=self.salon, user=self.target, banned_by=self.user)
+		# session + utilisateur (login_required), version
+		self.assertRevalidates(reverse('api_salon_users', args=['etag']), ban, queries=3)
+
+
+@override_settings(CHAT_THUMBNAILS_SYNC=True, CHAT_THUMBNAIL_SIZE=64)
+class ThumbnailTestCase(TestCase):
+	def setUp(self):
+		self.media = tempfile.TemporaryDirectory()
+		self.addCleanup(self.media.cleanup)
+		self.enterContext(override_settings(MEDIA_ROOT=self.media.name))
+		self.user = User.objects.create_user(username='erin', password='pass')
+		self.salon = Salon.objects.create(nom='Photos', slug='photos')
+		self.client.login(username='erin', password='pass')
+
+	def upload(self, name, content):
+		with self.captureOnCommitCallbacks(execute=True):
+			resp = self.client.post(reverse('api_messages_post', args=['photos']),
+				{'fichier': SimpleUploadedFile(name, content)})
+		self.assertEqual(resp.status_code, 200)
+		return Message.objects.get(id=resp.json()['id'])
+
+	def test_image_upload_gets_thumbnail_and_dimensions(self):
+		buf = io.BytesIO()
+		Image.new('RGB', (300, 150), 'red').save(buf, 'JPEG')
+		msg = self.upload('photo.jpg', buf.getvalue())
+		self.assertEqual((msg.largeur, msg.hauteur), (300, 150))
+		with msg.miniature.open('rb') as fh, Image.open(fh) as thumb:
+			self.assertEqual(thumb.size, (64, 32))
+
+		data = self.client.get(reverse('api_messages_list', args=['photos'])).json()['messages'][0]
+		self.assertEqual(data['miniature_url'], reverse('message_media', args=[msg.id, 'miniature']))
+		self.assertEqual((data['largeur'], data['hauteur']), (300, 150))
+
+	def test_small_image_and_other_files_keep_original(self):
+		buf = io.BytesIO()
+		Image.new('RGBA', (20, 10)).save(buf, 'PNG')
+		msg = self.upload('icone.png', buf.getvalue())
+		self.assertEqual((msg.largeur, msg.hauteur), (20, 10))
+		self.assertFalse(msg.miniature)
+
+		msg = self.upload('notes.txt', b'texte')
+		self.assertIsNone(msg.largeur)
+		with self.assertLogs('chat.thumbnails', 'WARNING'):
+			msg = self.upload('casse.jpg', b'pas une image')
+		self.assertIsNone(msg.largeur)
+		self.assertNotIn('miniature_url', msg.file_data())
+
+
+class ContentAddressedStorageTestCase(TestCase):
+	def setUp(self):
+		self.media = tempfile.TemporaryDirectory()
+		self.addCleanup(self.media.cleanup)
+		self.enterContext(override_settings(MEDIA_ROOT=self.media.name))
+		self.user = User.objects.create_user(username='fred', password='pass')
+		self.client.login(username='fred', password='pass')
+		Salon.objects.create(nom='Un', slug='un')
+		Salon.objects.create(nom='Deux', slug='deux')
+
+	def upload(self, slug, name, content):
+		with self.captureOnCommitCallbacks(execute=True):
+			resp = self.client.post(reverse('api_messages_post', args=[slug]),
+				{'fichier': SimpleUploadedFile(name, content)})
+		return Message.objects.get(id=resp.json()['id'])
+
+	def test_same_content_is_stored_once_and_deleted_with_last_message(self):
+		first = self.upload('un', 'rapport.pdf', b'%PDF contenu')
+		second = self.upload('deux', 'copie.pdf', b'%PDF contenu')
+		self.assertEqual(first.fichier.name, second.fichier.name)
+		self.assertEqual(second.file_data()['fichier_nom'], 'copie.pdf')
+		self.assertEqual(StoredFile.objects.get(name=first.fichier.name).ref_count, 2)
+
+		storage = first.fichier.storage
+		with self.captureOnCommitCallbacks(execute=True):
+			first.delete()
+		self.assertTrue(storage.exists(second.fichier.name))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(reverse('api_messages_delete', args=[second.id]))
+		self.assertFalse(storage.exists(second.fichier.name))
+		self.assertFalse(StoredFile.objects.exists())
+
+	def test_upload_while_deletion_pending_keeps_file(self):
+		first = self.upload('un', 'rapport.pdf', b'%PDF contenu')
+		name = first.fichier.name
+		with self.captureOnCommitCallbacks() as pending:
+			first.delete()
+		self.assertEqual(StoredFile.objects.get(name=name).ref_count, 0)
+		# Même contenu envoyé avant que la suppression différée ne s'exécute
+		self.upload('deux', 'copie.pdf', b'%PDF contenu')
+		for callback in pending:
+			callback()
+		self.assertTrue(first.fichier.storage.exists(name))
+		self.assertEqual(StoredFile.objects.get(name=name).ref_count, 1)
+
+	def test_dedup_media_moves_legacy_files(self):
+		salon = Salon.objects.get(slug='un')
+		for day in ('01', '02'):
+			name = default_storage.save(f'chat_files/2025/01/{day}/photo.png', ContentFile(b'meme image'))
+			Message.objects.filter(pk=Message.objects.create(salon=salon, auteur=self.user).pk).update(fichier=name)
+
+		call_command('dedup_media', stdout=io.StringIO())
+		names = set(Message.objects.values_list('fichier', flat=True))
+		self.assertEqual(len(names), 1)
+		name = names.pop()
+		self.assertEqual(StoredFile.objects.get(name=name).ref_count, 2)
+		self.assertFalse(default_storage.exists('chat_files/2025/01/01/photo.png'))
+		self.assertEqual(Message.objects.first().file_data()['fichier_nom'], 'photo.png')
+
+	def test_dedup_media_counts_archived_references(self):
+		salon = Salon.objects.get(slug='un')
+		legacy = default_storage.save('chat_files/2025/01/01/ancien.txt', ContentFile(b'ancien'))
+		Message.objects.filter(pk=Message.objects.create(salon=salon, auteur=self.user).pk).update(fichier=legacy)
+		first = self.upload('un', 'rapport.pdf', b'%PDF contenu')
+		second = self.upload('un', 'copie.pdf', b'%PDF contenu')
+		# Archive l'ancien fichier et l'une des deux copies
+		Salon.objects.filter(pk=salon.pk).update(retention_messages=1)
+		with self.captureOnCommitCallbacks(execute=True):
+			call_command('archive_messages', stdout=io.StringIO())
+		self.assertEqual(StoredFile.objects.get(name=first.fichier.name).ref_count, 2)
+
+		call_command('dedup_media', stdout=io.StringIO())
+		self.assertEqual(StoredFile.objects.get(name=first.fichier.name).ref_count, 2)
+		with self.captureOnCommitCallbacks(execute=True):
+			second.delete()
+		self.assertTrue(default_storage.exists(first.fichier.name))
+		self.assertFalse(default_storage.exists(legacy))
+		entry = decode(ArchivedMessageBatch.objects.get())[0]
+		self.assertEqual(entry['fichier_nom'], 'ancien.txt')
+		self.assertTrue(default_storage.exists(entry['fichier']))
+		self.assertEqual(StoredFile.objects.get(name=entry['fichier']).ref_count, 1)
+
+
+class MediaServingTestCase(TestCase):
+	def setUp(self):
+		self.media = tempfile.TemporaryDirectory()
+		self.addCleanup(self.media.cleanup)
+		self.enterContext(override_settings(MEDIA_ROOT=self.media.name))
+		self.user = User.objects.create_user(username='gina', password='pass')
+		self.salon = Salon.objects.create(nom='Films', slug='films')
+		self.message = Message.objects.create(salon=self.salon, auteur=self.user, fichier_nom='clip.mp4',
+			fichier=SimpleUploadedFile('clip.mp4', bytes(range(100))))
+		self.url = self.message.file_data()['fichier_url']
+		self.client.login(username='gina', password='pass')
+
+	def body(self, resp):
+		return b''.join(resp.streaming_content)
+
+	def test_full_and_range_responses(self):
+		resp = self.client.get(self.url)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(self.body(resp), bytes(range(100)))
+		self.assertEqual(resp['Accept-Ranges'], 'bytes')
+		self.assertIn('clip.mp4', resp['Content-Disposition'])
+
+		resp = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+		self.assertEqual(resp.status_code, 206)
+		self.assertEqual(resp['Content-Range'], 'bytes 10-19/100')
+		self.assertEqual(resp['Content-Length'], '10')
+		self.assertEqual(self.body(resp), bytes(range(10, 20)))
+
+		resp = self.client.get(self.url, HTTP_RANGE='bytes=90-')
+		self.assertEqual((resp.status_code, resp['Content-Length']), (206, '10'))
+		self.assertEqual(self.body(resp), bytes(range(90, 100)))
+		resp = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+		self.assertEqual(self.body(resp), bytes(range(95, 100)))
+
+		resp = self.client.get(self.url, HTTP_RANGE='bytes=200-')
+		self.assertEqual((resp.status_code, resp['Content-Range']), (416, 'bytes */100'))
+		# If-Range périmé : fichier entier
+		resp = self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"autre"')
+		self.assertEqual(resp.status_code, 200)
+
+	def test_etag_revalidation(self):
+		etag = self.client.get(self.url)['ETag']
+		resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 304)
+
+	def test_banned_user_is_refused(self):
+		Ban.objects.create(salon=self.salon, user=self.user, banned_by=self.user)
+		self.assertEqual(self.client.get(self.url).status_code, 403)
+		self.assertEqual(self.client.get(reverse('message_media', args=[self.message.id, 'miniature'])).status_code, 404)
+
+	@override_settings(CHAT_MEDIA_ACCEL_REDIRECT='/protected-media/')
+	def test_offload_to_web_server(self):
+		resp = self.client.get(self.url)
+		self.assertEqual(resp['X-Accel-Redirect'], '/protected-media/' + self.message.fichier.name)
+		self.assertEqual(resp.content, b'')
+
+
+class TransferTestCase(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.owner = User.objects.create_user(username='hugo', password='pass')
+		cls.other = User.objects.create_user(username='iris', password='pass')
+		cls.salon = Salon.objects.create(nom='Archives', slug='archives', createur=cls.owner)
+		cls.channel = Channel.objects.create(nom='Vieux', slug='archives-vieux', salon=cls.salon)
+		SalonRole.objects.create(salon=cls.salon, user=cls.other, role='moderator')
+		Ban.objects.create(salon=cls.salon, user=User.objects.create_user(username='troll'), banned_by=cls.owner)
+		for i in range(7):
+			Message.objects.create(salon=cls.salon, auteur=cls.owner if i % 2 else cls.other, contenu=f'salon {i}')
+		Message.objects.create(channel=cls.channel, auteur=cls.other, contenu='canal')
+
+	def test_export_import_round_trip(self):
+		out = io.StringIO()
+		original = list(self.salon.messages.order_by('id').values_list('auteur__username', 'contenu', 'date_envoi'))
+		with tempfile.NamedTemporaryFile('r', suffix='.ndjson') as fh:
+			call_command('export_salon', 'archives', output=fh.name, stderr=io.StringIO())
+			User.objects.filter(username='iris').delete()
+			call_command('import_salon', fh.name, slug='archives-2', nom='Archives 2', batch_size=3, stdout=out)
+		self.assertIn('8 messages', out.getvalue())
+
+		copy = Salon.objects.get(slug='archives-2')
+		self.assertEqual(copy.createur, self.owner)
+		imported = list(copy.messages.order_by('id').values_list('auteur__username', 'contenu', 'date_envoi'))
+		self.assertEqual(imported, original)
+		channel = copy.channels.get()
+		self.assertEqual(channel.slug, 'archives-vieux-1')
+		self.assertEqual(list(channel.messages.values_list('contenu', flat=True)), ['canal'])
+		self.assertTrue(copy.is_moderator(User.objects.get(username='iris')))
+		self.assertTrue(copy.is_banned(User.objects.get(username='troll')))
+		self.assertEqual(SalonMembership.objects.get(salon=copy, user__username='iris').message_count, 5)
+
+		with self.assertRaises(CommandError), mock.patch('sys.stdin', io.StringIO('{"type": "salon"}\n')):
+			call_command('import_salon', '-')
+
+	def test_failed_import_is_removed(self):
+		lines = list(export_salon(self.salon))
+		ban_date = Ban.objects.get(salon=self.salon).date_ban
+		broken = lines[:-2] + ['{"type": "message", "channel": null}\n'] + lines[-2:]
+		with self.assertRaises(TransferError):
+			import_salon(broken, slug='copie', nom='Copie', batch_size=2)
+		self.assertFalse(Salon.objects.filter(slug='copie').exists())
+		self.assertEqual(Message.objects.count(), 8)
+
+		copy, stats = import_salon(lines, slug='copie', nom='Copie', batch_size=2)
+		self.assertEqual(stats['messages'], 8)
+		self.assertEqual(Ban.objects.get(salon=copy).date_ban, ban_date)
+
+	def test_export_api_is_streamed_and_admin_only(self):
+		url = reverse('api_salon_export', args=['archives'])
+		self.client.login(username='iris', password='pass')
+		self.assertEqual(self.client.get(url).status_code, 403)
+		self.client.login(username='hugo', password='pass')
+		resp = self.client.get(url)
+		self.assertTrue(resp.streaming)
+		lines = [json.loads(line) for line in b''.join(resp.streaming_content).splitlines()]
+		self.assertEqual([r['type'] for r in lines[:4]], ['salon', 'channel', 'role', 'ban'])
+		self.assertEqual(sum(r['type'] == 'message' for r in lines), 8)
+
+	async def test_export_api_is_async_under_asgi(self):
+		await self.async_client.aforce_login(self.owner)
+		resp = await self.async_client.get(reverse('api_salon_export', args=['archives']))
+		self.assertTrue(resp.is_async)
+		lines = [json.loads(line) for line in b''.join([chunk async for chunk in resp.streaming_content]).splitlines()]
+		self.assertEqual(sum(r['type'] == 'message' for r in lines), 8)
+
+
+class ArchiveTestCase(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user(username='jade', password='pass')
+		cls.salon = Salon.objects.create(nom='Histoire', slug='histoire', retention_messages=3)
+		cls.ids = [Message.objects.create(salon=cls.salon, auteur=cls.user, contenu=f'm{i}').id for i in range(10)]
+
+	def test_archive_keeps_recent_messages_hot(self):
+		out = io.StringIO()
+		call_command('archive_messages', batch_size=4, stdout=out)
+		self.assertIn('7 messages archived', out.getvalue())
+		self.assertEqual(list(self.salon.messages.values_list('id', flat=True)), self.ids[7:])
+		self.assertEqual(ArchivedMessageBatch.objects.filter(salon=self.salon).count(), 2)
+
+		Salon.objects.filter(pk=self.salon.pk).update(retention_messages=None, retention_jours=1)
+		Message.objects.filter(id=self.ids[7]).update(date_envoi=timezone.now() - timedelta(days=2))
+		call_command('archive_messages', stdout=out)
+		self.assertEqual(list(self.salon.messages.values_list('id', flat=True)), self.ids[8:])
+
+	def test_archive_updates_membership_and_version_once_per_batch(self):
+		with CaptureQueriesContext(connection) as queries:
+			call_command('archive_messages', stdout=io.StringIO())
+		self.assertLess(len(queries), 30)
+		self.salon.refresh_from_db()
+		# Les messages archivés restent visibles : pas de resynchronisation des clients
+		self.assertEqual((self.salon.messages_version, self.salon.changes_version), (11, 0))
+		self.assertEqual(SalonMembership.objects.get(salon=self.salon, user=self.user).message_count, 3)
+
+	def test_counters_agree_with_reconcile_after_archive(self):
+		self.salon.reconcile_counters()
+		Salon.objects.filter(pk=self.salon.pk).update(retention_messages=None, retention_jours=1)
+		Message.objects.update(date_envoi=timezone.now() - timedelta(days=2))
+		call_command('archive_messages', stdout=io.StringIO())
+		self.salon.refresh_from_db()
+		self.assertEqual((self.salon.message_count, self.salon.last_message_id), (0, None))
+
+		out = io.StringIO()
+		call_command('reconcile_counters', stdout=out)
+		self.assertIn('0 salons had drifted counters', out.getvalue())
+
+	def test_history_pages_into_archive(self):
+		call_command('archive_messages', stdout=io.StringIO())
+		url = reverse('api_messages_list', args=['histoire'])
+		data = self.client.get(url, {'limit': 5}).json()
+		self.assertEqual([m['id'] for m in data['messages']], self.ids[5:])
+		self.assertTrue(data['has_more'])
+		self.assertTrue(data['messages'][0]['archive'])
+		self.assertEqual(data['messages'][0]['contenu'], 'm5')
+
+		data = self.client.get(url, {'limit': 5, 'before_id': self.ids[5]}).json()
+		self.assertEqual([m['id'] for m in data['messages']], self.ids[:5])
+		self.assertFalse(data['has_more'])
+		# Nouveaux messages : jamais pris dans l'archive
+		data = self.client.get(url, {'after_id': self.ids[-1]}).json()
+		self.assertEqual(data['messages'], [])
+
+	async def test_stream_window_spans_archive(self):
+		await sync_to_async(call_command)('archive_messages', batch_size=4, stdout=io.StringIO())
+		url = reverse('api_messages_stream', args=['histoire'])
+
+		async def fetch(params):
+			resp = await self.async_client.get(url, params)
+			self.assertTrue(resp.streaming)
+			chunks = [chunk async for chunk in resp.streaming_content]
+			return chunks, json.loads(b''.join(chunks))
+
+		chunks, data = await fetch({})
+		self.assertEqual([m['id'] for m in data['messages']], self.ids)
+		self.assertEqual([m.get('archive', False) for m in data['messages']], [True] * 7 + [False] * 3)
+		self.assertFalse(data['has_more'])
+		# Une ligne par message, décodable dès réception
+		lines = b''.join(chunks).split(b'\n')
+		self.assertEqual(json.loads(lines[1].rstrip(b','))['id'], self.ids[0])
+
+		_, data = await fetch({'after_id': self.ids[1], 'before_id': self.ids[9], 'limit': 6})
+		self.assertEqual([m['id'] for m in data['messages']], self.ids[2:8])
+		self.assertTrue(data['has_more'])
+		_, data = await fetch({'after_id': self.ids[5], 'limit': 3})
+		self.assertEqual([m['id'] for m in data['messages']], self.ids[6:9])
+
+		self.assertEqual((await self.async_client.get(url, {'limit': 0})).status_code, 400)
+
+	def test_stream_window_is_sync_under_wsgi(self):
+		call_command('archive_messages', batch_size=4, stdout=io.StringIO())
+		resp = self.client.get(reverse('api_messages_stream', args=['histoire']), {'after_id': self.ids[5], 'limit': 3})
+		# Itérateur synchrone : envoyé au fil de l'eau par le serveur WSGI
+		self.assertFalse(resp.is_async)
+		data = json.loads(b''.join(resp.streaming_content))
+		self.assertEqual([m['id'] for m in data['messages']], self.ids[6:9])
+		self.assertEqual([m.get('archive', False) for m in data['messages']], [True, False, False])
+		self.assertTrue(data['has_more'])
+
+
+class WriteBehindTestCase(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='kim', password='pass')
+		self.salon = Salon.objects.create(nom='Rafale', slug='rafale')
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.journal = tmp.name
+		self.ingester = Ingester(self.journal)
+		self.enterContext(mock.patch('chat.views.get_ingester', return_value=self.ingester))
+		self.client.login(username='kim', password='pass')
+
+	@override_settings(CHAT_WRITE_BEHIND=True)
+	def test_post_is_journaled_then_flushed(self):
+		url = reverse('api_messages_post', args=['rafale'])
+		resp = self.client.post(url, data=json.dumps({'contenu': 'vite'}), content_type='application/json')
+		self.assertEqual(resp.status_code, 202)
+		data = resp.json()
+		self.assertFalse(Message.objects.filter(id=data['id']).exists())
+		journals = os.listdir(self.journal)
+		self.assertEqual(len(journals), 1)
+		with open(os.path.join(self.journal, journals[0])) as fh:
+			self.assertEqual(json.loads(fh.readline())['contenu'], 'vite')
+
+		second = self.client.post(url, data=json.dumps({'contenu': 'encore'}), content_type='application/json').json()
+		self.assertEqual(second['id'], data['id'] + 1)
+		self.assertEqual(self.ingester.flush(), 2)
+		msg = Message.objects.get(id=data['id'])
+		self.assertEqual(msg.date_envoi.isoformat(), data['date_envoi'])
+		self.assertEqual(SalonMembership.objects.get(salon=self.salon, user=self.user).message_count, 2)
+		self.assertEqual(os.listdir(self.journal), [])
+		# Un create() ordinaire ne reprend pas les ids réservés
+		self.assertGreater(Message.objects.create(salon=self.salon, auteur=self.user, contenu='x').id, second['id'])
+
+	@override_settings(CHAT_WRITE_BEHIND=True)
+	def test_attachment_takes_next_queued_id(self):
+		media = tempfile.TemporaryDirectory()
+		self.addCleanup(media.cleanup)
+		self.enterContext(override_settings(MEDIA_ROOT=media.name))
+		url = reverse('api_messages_post', args=['rafale'])
+		queued = self.client.post(url, data=json.dumps({'contenu': 'texte'}), content_type='application/json').json()
+		with self.captureOnCommitCallbacks(execute=True):
+			attached = self.client.post(url, {'fichier': SimpleUploadedFile('a.txt', b'pj')}).json()
+		# Inséré après le message en file, avant les suivants
+		self.assertEqual(attached['id'], queued['id'] + 1)
+		self.assertTrue(Message.objects.filter(id=queued['id']).exists())
+		after = self.client.post(url, data=json.dumps({'contenu': 'suite'}), content_type='application/json').json()
+		self.assertEqual(after['id'], attached['id'] + 1)
+
+	@override_settings(CHAT_WRITE_BEHIND=True)
+	def test_edit_of_pending_message_flushes_first(self):
+		data = self.client.post(reverse('api_messages_post', args=['rafale']), data=json.dumps({'contenu': 'typo'}),
+								content_type='application/json').json()
+		resp = self.client.post(reverse('api_messages_edit', args=[data['id']]), data=json.dumps({'contenu': 'corrigé'}),
+								content_type='application/json')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(Message.objects.get(id=data['id']).contenu, 'corrigé')
+
+	def test_replay_abandoned_journal(self):
+		entry = {'id': 9000, 'salon': self.salon.id, 'channel': None, 'auteur_id': self.user.id, 'auteur': 'kim',
+				 'contenu': 'rescapé', 'date_envoi': timezone.now().isoformat()}
+		path = os.path.join(self.journal, '1-1.jsonl')
+		with open(path, 'w') as fh:
+			fh.write(json.dumps(entry) + '\n{"id": 90')
+		out = io.StringIO()
+		call_command('replay_ingest_journal', journal=self.journal, stdout=out)
+		self.assertIn('1 messages replayed', out.getvalue())
+		self.assertEqual(Message.objects.get(id=9000).contenu, 'rescapé')
+		self.assertFalse(os.path.exists(path))
+		# Rejouer deux fois n'insère rien de plus
+		with open(path, 'w') as fh:
+			fh.write(json.dumps(entry) + '\n')
+		call_command('replay_ingest_journal', journal=self.journal, stdout=out)
+		self.assertEqual(Message.objects.filter(contenu='rescapé').count(), 1)
+
+
+class RateLimitTestCase(TestCase):
+	def setUp(self):
+		get_store().clear()
+		self.addCleanup(get_store().clear)
+		self.user = User.objects.create_user(username='lou', password='pass')
+		self.salon = Salon.objects.create(nom='Flood', slug='flood')
+		self.client.login(username='lou', password='pass')
+		# Horloge figée : aucun jeton ne revient pendant le test, quelle que soit sa durée
+		self.enterContext(mock.patch('chat.ratelimit.time', **{'time.return_value': 1000.0, 'monotonic.return_value': 1000.0}))
+
+	def test_token_bucket_refills(self):
+		store = LocalBucketStore()
+		self.assertEqual([store.take('k', 2, 1.0, now=0) for _ in range(2)], [0, 0])
+		self.assertAlmostEqual(store.take('k', 2, 1.0, now=0), 1.0)
+		self.assertEqual(store.take('k', 2, 1.0, now=1.5), 0)
+		self.assertEqual(parse_rate('20/10s'), (20, 10))
+
+	def test_post_limited_per_user_with_retry_after(self):
+		url = reverse('api_messages_post', args=['flood'])
+		statuses = [self.client.post(url, data=json.dumps({'contenu': f'm{i}'}), content_type='application/json').status_code
+					for i in range(21)]
+		self.assertEqual(statuses[:20], [200] * 20)
+		self.assertEqual(statuses[20], 429)
+		resp = self.client.post(url, data=json.dumps({'contenu': 'encore'}), content_type='application/json')
+		self.assertEqual(resp.status_code, 429)
+		self.assertGreaterEqual(int(resp['Retry-After']), 1)
+		self.assertEqual(Message.objects.filter(salon=self.salon).count(), 20)
+
+		# Le seau est par utilisateur
+		User.objects.create_user(username='max', password='pass')
+		self.client.login(username='max', password='pass')
+		resp = self.client.post(url, data=json.dumps({'contenu': 'moi'}), content_type='application/json')
+		self.assertEqual(resp.status_code, 200)
+
+	@override_settings(CHAT_RATELIMIT_BACKEND='chat.ratelimit.CacheBucketStore')
+	def test_cache_backend(self):
+		cache.clear()
+		url = reverse('login')
+		for _ in range(10):
+			self.client.post(url, {'username': 'lou', 'password': 'faux'})
+		self.assertEqual(self.client.post(url, {'username': 'lou', 'password': 'faux'}).status_code, 429)
+		# Seules les tentatives (POST) sont comptées
+		self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class SalonDirectoryTestCase(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user(username='noa', password='pass')
+		cls.salons = [Salon.objects.create(nom=f'Salon {i:02}', slug=f'salon-{i:02}', createur=cls.user) for i in range(30)]
+		channel = Channel.objects.create(salon=cls.salons[0], nom='Général', slug='general')
+		for target in ({'salon': cls.salons[0]}, {'channel': channel}):
+			Message.objects.create(auteur=cls.user, contenu='hop', **target)
+		cls.salons[0].reconcile_counters()
+
+	def setUp(self):
+		cache.clear()
+		self.client.login(username='noa', password='pass')
+
+	def test_directory_is_paginated_and_searchable(self):
+		page = self.client.get(reverse('index')).context['page']
+		self.assertEqual(len(page.object_list), 24)
+		self.assertEqual(page.paginator.num_pages, 2)
+		first = page.object_list[0]
+		self.assertEqual((first.channel_count, first.message_count), (1, 2))
+		self.assertIsNotNone(first.last_message_at)
+
+		resp = self.client.get(reverse('index'), {'page': 2})
+		self.assertContains(resp, 'Salon 29')
+		self.assertNotContains(resp, 'Salon 00')
+		resp = self.client.get(reverse('index'), {'q': 'salon 1'})
+		self.assertContains(resp, 'Salon 15')
+		self.assertNotContains(resp, 'Salon 20')
+
+	def test_directory_fragment_cached_until_salon_created(self):
+		self.client.get(reverse('index'))
+		# Fragment en cache : ni comptage ni page de salons
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(reverse('index'))
+		self.assertFalse(any('chat_salon' in q['sql'] for q in queries.captured_queries))
+
+		Salon.objects.create(nom='Aaa nouveau', slug='aaa', createur=self.user)
+		self.assertContains(self.client.get(reverse('index')), 'Aaa nouveau')
+
+
+class CountersTestCase(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='oli', password='pass')
+		self.salon = Salon.objects.create(nom='Compte', slug='compte', createur=self.user)
+		self.client.login(username='oli', password='pass')
+
+	def post(self, url):
+		return self.client.post(url, data=json.dumps({'contenu': 'x'}), content_type='application/json').json()
+
+	def test_counters_follow_posts_and_deletions(self):
+		self.client.post(reverse('channel_create', args=['compte']), {'nom': 'Annexe'})
+		channel = Channel.objects.get(salon=self.salon)
+		first = self.post(reverse('api_messages_post', args=['compte']))
+		last = self.post(reverse('api_channel_messages_post', args=['compte', channel.slug]))
+		self.salon.refresh_from_db()
+		channel.refresh_from_db()
+		self.assertEqual((self.salon.channel_count, self.salon.message_count, self.salon.last_message_id), (1, 2, last['id']))
+		self.assertEqual((channel.message_count, channel.last_message_id), (1, last['id']))
+
+		# Supprimer le dernier message recalcule le précédent
+		self.client.post(reverse('api_messages_delete', args=[last['id']]))
+		self.salon.refresh_from_db()
+		channel.refresh_from_db()
+		self.assertEqual((self.salon.message_count, self.salon.last_message_id), (1, first['id']))
+		self.assertEqual((channel.message_count, channel.last_message_id), (0, None))
+
+		self.client.post(reverse('channel_delete', args=['compte', channel.slug]))
+		self.salon.refresh_from_db()
+		self.assertEqual((self.salon.channel_count, self.salon.message_count), (0, 1))
+		with self.assertNumQueries(0):
+			self.assertIn('Messages :</strong> 1', render_to_string('chat/delete_salon.html', {'salon': self.salon}))
+
+	def test_reconcile_fixes_drift(self):
+		Message.objects.create(salon=self.salon, auteur=self.user, contenu='hors API')
+		out = io.StringIO()
+		call_command('reconcile_counters', stdout=out)
+		self.assertIn('1 salons had drifted counters', out.getvalue())
+		self.salon.refresh_from_db()
+		self.assertEqual(self.salon.message_count, 1)
+		call_command('reconcile_counters', stdout=out)
+		self.assertIn('0 salons had drifted counters', out.getvalue())
+
+
+def _encode_reversed(data):
+	return json.dumps(data, default=str)[::-1].encode()
+
+
+class SerializationTestCase(TestCase):
+	def setUp(self):
+		self.user = User.objects.create_user(username='zoé', password='pass')
+		self.salon = Salon.objects.create(nom='Format', slug='format', createur=self.user)
+		self.client.login(username='zoé', password='pass')
+
+	def test_rows_and_instances_share_format(self):
+		message = Message.objects.create(salon=self.salon, auteur=self.user, contenu='été',
+			fichier='chat_files/a.txt', fichier_nom='a.txt')
+		row = message_rows(Message.objects.filter(pk=message.pk)).get()
+		self.assertEqual(message_data(row), instance_data(message))
+		body = self.client.get(reverse('api_messages_list', args=['format'])).content
+		# Encodage compact, UTF-8 et dates ISO 8601
+		self.assertIn('"auteur":"zoé","contenu":"été"'.encode(), body)
+		self.assertIn(message.date_envoi.isoformat().encode(), body)
+
+	def test_encoder_setting(self):
+		Message.objects.create(salon=self.salon, auteur=self.user, contenu='x')
+		with override_settings(CHAT_JSON_ENCODER='chat.tests._encode_reversed'):
+			self.assertIs(get_dumps(), _encode_reversed)
+			body = self.client.get(reverse('api_messages_list', args=['format'])).content
+		self.assertEqual(json.loads(body[::-1])['messages'][0]['contenu'], 'x')
+		self.assertEqual(get_dumps()({'a': 1}), b'{"a":1}')
+
+	async def test_stream_messages_chunks(self):
+		async def messages():
+			for i in range(5):
+				yield {'id': i}
+		chunks = [chunk async for chunk in astream_messages(messages(), limit=3, chunk_size=1)]
+		# Un bloc par message, puis la fin du document
+		self.assertEqual(len(chunks), 4)
+		self.assertEqual(json.loads(b''.join(chunks)), {'messages': [{'id': 0}, {'id': 1}, {'id': 2}], 'has_more': True})
+		self.assertEqual(list(stream_messages(({'id': i} for i in range(5)), limit=3, chunk_size=1)), chunks)
+
+	def test_bench_serialization(self):
+		Message.objects.create(salon=self.salon, auteur=self.user, contenu='x')
+		out = io.StringIO()
+		call_command('bench_serialization', salon='format', rounds=1, stdout=out)
+		self.assertIn('values+json', out.getvalue())
+
+
+class ConversationsTestCase(TestCase):
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user(username='lou', password='pass')
+		cls.salon = Salon.objects.create(nom='Conv', slug='conv', createur=cls.user)
+		cls.channel = Channel.objects.create(nom='Fil', slug='fil', salon=cls.salon)
+
+	def test_channel_resolved_in_one_query(self):
+		with self.assertNumQueries(1):
+			conversation = resolve('conv', 'fil')
+			self.assertEqual(conversation.salon.nom, 'Conv')
+		self.assertEqual(conversation.topic, topic_for(channel_id=self.channel.id))
+		self.assertEqual(conversation.owner, {'channel': self.channel})
+
+		self.client.login(username='lou', password='pass')
+		posted = self.client.post(reverse('api_channel_messages_post', args=['conv', 'fil']),
+			data=json.dumps({'contenu': 'x'}), content_type='application/json').json()
+		message = Message.objects.get(pk=posted['id'])
+		self.assertEqual((message.salon_id, message.channel_id), (None, self.channel.id))
+		# Fonction d'ETag et vue partagent la même résolution
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get(reverse('api_channel_messages_list', args=['conv', 'fil']))
+		self.assertEqual([m['id'] for m in resp.json()['messages']], [message.id])
+		self.assertEqual(sum('"chat_channel"' in q['sql'] for q in ctx.captured_queries), 1)
+		self.assertEqual(self.client.get(reverse('api_channel_messages_list', args=['autre', 'fil'])).status_code, 404)
+
+	def test_message_needs_exactly_one_conversation(self):
+		for fields in ({}, {'salon': self.salon, 'channel': self.channel}):
+			with self.assertRaises(IntegrityError), transaction.atomic():
+				Message.objects.create(auteur=self.user, contenu='x', **fields)
@@ -0,0 +1,143 @@
+"""Miniatures des images jointes aux messages.
+
+À la création d'un message avec une image, la génération est soumise à un
+pool de threads une fois la transaction validée : la requête d'envoi ne
+décode jamais l'image. Le thread lit les dimensions, réduit l'image (décodage
+JPEG à échelle réduite via `draft`), l'enregistre en WebP dans
+`chat_thumbs/` (une seule fois par image, le stockage étant adressé par
+contenu), puis diffuse `message.updated` pour que les clients
+remplacent l'image pleine taille par la miniature.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .models import Message, StoredFile
+from .realtime import publish_message_event
+from .serializers import instance_data
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+# Orientations EXIF qui échangent largeur et hauteur
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def is_image(name):
+    return os.path.splitext(name or '')[1].lower() in IMAGE_EXTENSIONS
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'CHAT_THUMBNAIL_WORKERS', 2),
+                    thread_name_prefix='chat-thumbnails',
+                )
+    return _executor
+
+
+def schedule_thumbnail(message):
+    """Planifie la miniature d'un message après la validation de la transaction."""
+    if not message.fichier or not is_image(message.fichier.name):
+        return
+    transaction.on_commit(lambda: _submit(message.pk))
+
+
+def _submit(message_id):
+    if getattr(settings, 'CHAT_THUMBNAILS_SYNC', False):
+        generate_thumbnail(message_id)
+    else:
+        get_executor().submit(_run_in_worker, message_id)
+
+
+def _run_in_worker(message_id):
+    try:
+        generate_thumbnail(message_id)
+    except Exception:
+        logger.exception("Thumbnail generation failed for message %s", message_id)
+    finally:
+        # Connexion propre au thread du pool
+        connection.close()
+
+
+def render_thumbnail(fh, size):
+    """Retourne ((largeur, hauteur), octets WebP ou None) pour un fichier image.
+
+    Pas de miniature pour les images animées ni pour celles qui tiennent
+    déjà dans `size` : le client affiche alors l'original.
+    """
+    with Image.open(fh) as img:
+        width, height = img.size
+        if img.getexif().get(0x0112) in ROTATED_ORIENTATIONS:
+            width, height = height, width
+        if getattr(img, 'is_animated', False) or (width <= size and height <= size):
+            return (width, height), None
+        img.draft('RGB', (size, size))
+        thumb = ImageOps.exif_transpose(img)
+        thumb.thumbnail((size, size))
+        if thumb.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in thumb.mode or 'transparency' in thumb.info
+            thumb = thumb.convert('RGBA' if has_alpha else 'RGB')
+        out = io.BytesIO()
+        thumb.save(out, 'WEBP', quality=80)
+        return (width, height), out.getvalue()
+
+
+def generate_thumbnail(message_id):
+    """Calcule dimensions et miniature d'un message. Retourne True si enregistrées."""
+    message = Message.objects.select_related('auteur').filter(pk=message_id).first()
+    if message is None or not message.fichier or not is_image(message.fichier.name):
+        return False
+    size = getattr(settings, 'CHAT_THUMBNAIL_SIZE', 600)
+    # Fichier déjà partagé (stockage par contenu) : on reprend sa miniature
+    known = (Message.objects.filter(fichier=message.fichier.name, largeur__isnull=False)
+             .exclude(pk=message.pk).values_list('miniature', 'largeur', 'hauteur').first())
+    if known is not None:
+        name, width, height = known
+        name = name or None
+        if name:
+            StoredFile.acquire(name)
+    else:
+        try:
+            with message.fichier.open('rb') as fh:
+                (width, height), data = render_thumbnail(fh, size)
+        except (OSError, Image.DecompressionBombError) as exc:
+            logger.warning("Cannot thumbnail %s: %s", message.fichier.name, exc)
+            return False
+        name = None
+        if data is not None:
+            stem = os.path.splitext(os.path.basename(message.fichier.name))[0]
+            with transaction.atomic():
+                name = message.miniature.storage.save(f'chat_thumbs/{stem}.webp', ContentFile(data))
+                StoredFile.acquire(name)
+
+    previous = message.miniature.name or None
+    # Mise à jour ciblée : ne pas écraser une modification du contenu entre-temps
+    updated = Message.objects.filter(pk=message.pk, fichier=message.fichier.name).update(
+        miniature=name, largeur=width, hauteur=height,
+    )
+    if not updated:
+        if name:
+            StoredFile.release(name)
+        return False
+    if previous:
+        StoredFile.release(previous)
+
+    message.miniature.name = name
+    message.largeur, message.hauteur = width, height
+    message.bump_version(changed=True)
+    publish_message_event(message, 'message.updated', instance_data(message))
+    return True
@@ -0,0 +1,241 @@
+"""Export et import d'un salon au format NDJSON (une ligne JSON par enregistrement).
+
+L'export lit les messages par `iterator(chunk_size=...)` et les écrit au fil
+de l'eau : la mémoire utilisée ne dépend pas de la taille du salon. L'import
+relit le flux ligne par ligne et insère les messages par `bulk_create`, un
+lot par transaction ; les utilisateurs sont retrouvés par nom (et créés,
+sans mot de passe utilisable, s'ils n'existent pas). Si l'import échoue en
+cours de route, le salon créé est supprimé avec tout ce qu'il contient :
+le même fichier, corrigé, peut être réimporté.
+
+Les pièces jointes ne sont pas copiées : seuls leurs noms dans le stockage
+sont exportés, les fichiers de MEDIA_ROOT se transfèrent à part.
+
+Ordre des lignes : `salon`, puis `channel`, `role`, `ban`, puis `message`.
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import Salon, Channel, Message, SalonMembership, SalonRole, Ban, StoredFile
+
+FORMAT_VERSION = 1
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 5000
+MESSAGE_FIELDS = ('auteur__username', 'contenu', 'date_envoi', 'fichier', 'fichier_nom',
+                  'miniature', 'largeur', 'hauteur')
+
+
+class TransferError(ValueError):
+    """Flux d'import invalide."""
+
+
+def _line(record):
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _message_lines(qs, channel_slug, chunk_size):
+    for auteur, contenu, date_envoi, fichier, fichier_nom, miniature, largeur, hauteur in (
+            qs.order_by('id').values_list(*MESSAGE_FIELDS).iterator(chunk_size=chunk_size)):
+        record = {'type': 'message', 'channel': channel_slug, 'auteur': auteur,
+                  'contenu': contenu, 'date_envoi': date_envoi.isoformat()}
+        if fichier:
+            record.update(fichier=fichier, fichier_nom=fichier_nom, miniature=miniature or None,
+                          largeur=largeur, hauteur=hauteur)
+        yield _line(record)
+
+
+def export_salon(salon, chunk_size=EXPORT_CHUNK_SIZE):
+    """Génère les lignes NDJSON (str) du salon, de ses canaux, rôles, bannissements et messages."""
+    yield _line({
+        'type': 'salon', 'version': FORMAT_VERSION, 'nom': salon.nom, 'slug': salon.slug,
+        'description': salon.description, 'createur': salon.createur.username,
+    })
+    channels = list(salon.channels.order_by('id').values('id', 'nom', 'slug', 'description'))
+    for channel in channels:
+        yield _line({'type': 'channel', 'nom': channel['nom'], 'slug': channel['slug'],
+                     'description': channel['description']})
+    for username, role in salon.roles.order_by('id').values_list('user__username', 'role'):
+        yield _line({'type': 'role', 'user': username, 'role': role})
+    bans = salon.bans.order_by('id').values_list(
+        'user__username', 'banned_by__username', 'reason', 'date_ban', 'is_active')
+    for username, banned_by, reason, date_ban, is_active in bans:
+        yield _line({'type': 'ban', 'user': username, 'banned_by': banned_by, 'reason': reason,
+                     'date_ban': date_ban.isoformat(), 'is_active': is_active})
+
+    yield from _message_lines(Message.objects.filter(salon=salon), None, chunk_size)
+    for channel in channels:
+        yield from _message_lines(Message.objects.filter(channel_id=channel['id']), channel['slug'], chunk_size)
+
+
+def chunked(lines, size=64 * 1024):
+    """Regroupe les lignes en blocs d'environ `size` octets (réponse HTTP en streaming)."""
+    buffer, length = [], 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _unique_slug(model, slug):
+    candidate, suffix = slug, 0
+    while model.objects.filter(slug=candidate).exists():
+        suffix += 1
+        candidate = f"{slug}-{suffix}"
+    return candidate
+
+
+class UserResolver:
+    """Ids des utilisateurs par nom, créés au besoin (un lot de requêtes par lot de noms)."""
+
+    def __init__(self):
+        self.ids = {}
+        self.created = 0
+
+    def resolve(self, usernames):
+        missing = {u for u in usernames if u not in self.ids}
+        if not missing:
+            return
+        self.ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        new = [User(username=u, password='!') for u in missing if u not in self.ids]
+        if new:
+            User.objects.bulk_create(new, ignore_conflicts=True)
+            self.created += len(new)
+            self.ids.update(User.objects.filter(username__in=[u.username for u in new]).values_list('username', 'id'))
+
+    def __getitem__(self, username):
+        if username not in self.ids:
+            self.resolve([username])
+        return self.ids[username]
+
+
+def _records(lines):
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode()
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise TransferError(f"Ligne {number} : JSON invalide.")
+        if not isinstance(record, dict) or 'type' not in record:
+            raise TransferError(f"Ligne {number} : enregistrement sans type.")
+        yield number, record
+
+
+def import_salon(lines, slug=None, nom=None, batch_size=IMPORT_BATCH_SIZE):
+    """Crée un salon à partir d'un flux NDJSON produit par `export_salon`.
+
+    `slug` / `nom` remplacent ceux du fichier (pour importer une copie).
+    Retourne (salon, statistiques).
+    """
+    users = UserResolver()
+    records = _records(lines)
+    try:
+        number, header = next(records)
+    except StopIteration:
+        raise TransferError("Fichier vide.")
+    if header['type'] != 'salon' or header.get('version') != FORMAT_VERSION:
+        raise TransferError("La première ligne doit décrire le salon (format version 1).")
+    nom = nom or header['nom']
+    if Salon.objects.filter(nom=nom).exists():
+        raise TransferError(f"Un salon nommé '{nom}' existe déjà.")
+    slug = slug or header['slug']
+    if Salon.objects.filter(slug=slug).exists():
+        raise TransferError(f"Le salon '{slug}' existe déjà.")
+
+    stats = {'channels': 0, 'roles': 0, 'bans': 0, 'messages': 0}
+    memberships = {}
+    batch = []
+
+    def flush():
+        users.resolve({m['auteur'] for m in batch})
+        rows, files = [], {}
+        for m in batch:
+            user_id = users[m['auteur']]
+            date_envoi = parse_datetime(m['date_envoi'])
+            rows.append(Message(
+                salon=None if m['channel'] else salon, channel=channels.get(m['channel']),
+                auteur_id=user_id, contenu=m.get('contenu', ''), date_envoi=date_envoi,
+                fichier=m.get('fichier') or None, fichier_nom=m.get('fichier_nom') or '',
+                miniature=m.get('miniature') or None, largeur=m.get('largeur'), hauteur=m.get('hauteur'),
+            ))
+            membership = memberships.setdefault(user_id, [0, date_envoi, date_envoi])
+            membership[0] += 1
+            membership[1] = min(membership[1], date_envoi)
+            membership[2] = max(membership[2], date_envoi)
+            for name in (m.get('fichier'), m.get('miniature')):
+                if name:
+                    files[name] = files.get(name, 0) + 1
+        with transaction.atomic():
+            Message.objects.bulk_create(rows)
+            # Références comptées avec le lot : la suppression du salon en
+            # cas d'échec les relâche message par message
+            for name, count in files.items():
+                StoredFile.acquire(name, count)
+        stats['messages'] += len(rows)
+        batch.clear()
+
+    with transaction.atomic():
+        salon = Salon.objects.create(nom=nom, slug=slug, description=header.get('description'),
+                                     createur_id=users[header['createur']])
+    try:
+        channels = {}
+        for number, record in records:
+            kind = record['type']
+            try:
+                if kind == 'message':
+                    missing = [f for f in ('channel', 'auteur', 'date_envoi') if f not in record]
+                    if missing:
+                        raise TransferError(f"Ligne {number} : champ '{missing[0]}' manquant.")
+                    if record['channel'] and record['channel'] not in channels:
+                        raise TransferError(f"Ligne {number} : canal '{record['channel']}' inconnu.")
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        flush()
+                elif batch:
+                    raise TransferError(f"Ligne {number} : '{kind}' après les messages.")
+                elif kind == 'channel':
+                    channels[record['slug']] = Channel.objects.create(
+                        salon=salon, nom=record['nom'], slug=_unique_slug(Channel, record['slug']),
+                        description=record.get('description'))
+                    stats['channels'] += 1
+                elif kind == 'role':
+                    SalonRole.objects.create(salon=salon, user_id=users[record['user']], role=record['role'])
+                    stats['roles'] += 1
+                elif kind == 'ban':
+                    ban = Ban.objects.create(salon=salon, user_id=users[record['user']],
+                                             banned_by_id=users[record['banned_by']],
+                                             reason=record.get('reason', ''), is_active=record.get('is_active', True))
+                    # `auto_now_add` impose la date du jour à la création
+                    Ban.objects.filter(pk=ban.pk).update(date_ban=parse_datetime(record['date_ban']))
+                    stats['bans'] += 1
+                else:
+                    raise TransferError(f"Ligne {number} : type '{kind}' inconnu.")
+            except KeyError as exc:
+                raise TransferError(f"Ligne {number} : champ {exc} manquant.")
+        if batch:
+            flush()
+
+        with transaction.atomic():
+            SalonMembership.objects.bulk_create([
+                SalonMembership(salon=salon, user_id=user_id, message_count=count,
+                                first_message_at=first, last_message_at=last)
+                for user_id, (count, first, last) in memberships.items()
+            ], batch_size=batch_size)
+            salon.reconcile_counters()
+    except BaseException:
+        # Import partiel : canaux, messages, rôles et bannissements partent
+        # avec le salon (les utilisateurs créés restent)
+        salon.delete()
+        raise
+    stats['users_created'] = users.created
+    return salon, stats
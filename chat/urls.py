@@ -1,5 +1,20 @@
 from django.urls import path
-from . import views_pages, views_api, views
+from . import views_pages, views_api, views, views_media
+from .ratelimit import ratelimit
+
+# Limites de débit (chat/ratelimit.py) : envoi par utilisateur et, pour
+# l'ensemble d'un salon, modération, export et historique en streaming par
+# utilisateur, connexion et inscription par IP
+post_limits = [ratelimit('20/10s', key='user', scope='post'), ratelimit('200/10s', key='salon', scope='post-salon')]
+moderation_limit = ratelimit('30/m', key='user', scope='moderation')
+stream_limit = ratelimit('10/m', key='user+salon', scope='stream')
+
+
+def limited(view, *limits):
+    for limit in reversed(limits):
+        view = limit(view)
+    return view
+
 
 urlpatterns = [
     # Pages du site
@@ -15,8 +30,8 @@ urlpatterns = [
     path('salon/<slug:salon_slug>/<slug:channel_slug>/supprimer/', views_pages.supprimer_channel, name='channel_delete'),
 
     # Auth (tes routes)
-    path('inscription/', views_pages.inscription, name='register'),
-    path('connexion/', views_pages.connexion, name='login'),
+    path('inscription/', limited(views_pages.inscription, ratelimit('5/h', key='ip', methods=('POST',))), name='register'),
+    path('connexion/', limited(views_pages.connexion, ratelimit('10/m', key='ip', methods=('POST',))), name='login'),
     path('deconnexion/', views_pages.deconnexion, name='logout'),
 
     #Compat Django : évite le 404 sur /accounts/login/ quand login_required redirige
@@ -26,21 +41,32 @@ urlpatterns = [
     # API (Partie AJAX)
     path('api/exemple/', views_api.api_exemple, name='api_exemple'),
 
-    # Messages API for the salon
-    path('api/salon/<slug:slug>/messages/', views.messages_list, name='api_messages_list'),
-    path('api/salon/<slug:slug>/messages/send/', views.messages_post, name='api_messages_post'),
+    # Messages API : une vue par opération pour le salon et ses canaux
+    # (chat/conversations.py), les noms et URL historiques sont conservés
+    path('api/salon/<slug:salon_slug>/messages/', views.messages_list, name='api_messages_list'),
+    path('api/salon/<slug:salon_slug>/messages/send/', limited(views.messages_post, *post_limits), name='api_messages_post'),
+    path('api/salon/<slug:salon_slug>/messages/wait/', views.messages_wait, name='api_messages_wait'),
+    path('api/salon/<slug:salon_slug>/messages/stream/', limited(views.messages_stream, stream_limit), name='api_messages_stream'),
+    path('api/salon/<slug:salon_slug>/search/', views.messages_search, name='api_messages_search'),
+
+    path('api/salon/<slug:salon_slug>/<slug:channel_slug>/messages/', views.messages_list, name='api_channel_messages_list'),
+    path('api/salon/<slug:salon_slug>/<slug:channel_slug>/messages/send/', limited(views.messages_post, *post_limits), name='api_channel_messages_post'),
+    path('api/salon/<slug:salon_slug>/<slug:channel_slug>/messages/wait/', views.messages_wait, name='api_channel_messages_wait'),
+    path('api/salon/<slug:salon_slug>/<slug:channel_slug>/messages/stream/', limited(views.messages_stream, stream_limit), name='api_channel_messages_stream'),
+    path('api/salon/<slug:salon_slug>/<slug:channel_slug>/search/', views.messages_search, name='api_channel_messages_search'),
 
-    # Messages API for channels
-    path('api/salon/<slug:salon_slug>/<slug:channel_slug>/messages/', views.channel_messages_list, name='api_channel_messages_list'),
-    path('api/salon/<slug:salon_slug>/<slug:channel_slug>/messages/send/', views.channel_messages_post, name='api_channel_messages_post'),
+    path('api/messages/<int:message_id>/edit/', limited(views.messages_edit, ratelimit('30/m', key='user', scope='edit')), name='api_messages_edit'),
+    path('api/messages/<int:message_id>/delete/', limited(views.messages_delete, ratelimit('30/m', key='user', scope='edit')), name='api_messages_delete'),
 
-    path('api/messages/<int:message_id>/edit/', views.messages_edit, name='api_messages_edit'),
-    path('api/messages/<int:message_id>/delete/', views.messages_delete, name='api_messages_delete'),
+    # Pièces jointes (contrôle du bannissement, Range, X-Accel-Redirect)
+    path('fichiers/<int:message_id>/<str:field>/', views_media.message_media, name='message_media'),
 
     # Moderation API
-    path('api/salon/<slug:salon_slug>/ban/', views.salon_ban_user, name='api_salon_ban'),
-    path('api/salon/<slug:salon_slug>/unban/', views.salon_unban_user, name='api_salon_unban'),
-    path('api/salon/<slug:salon_slug>/promote/', views.salon_promote_user, name='api_salon_promote'),
-    path('api/salon/<slug:salon_slug>/demote/', views.salon_demote_user, name='api_salon_demote'),
+    path('api/salon/<slug:salon_slug>/ban/', limited(views.salon_ban_user, moderation_limit), name='api_salon_ban'),
+    path('api/salon/<slug:salon_slug>/unban/', limited(views.salon_unban_user, moderation_limit), name='api_salon_unban'),
+    path('api/salon/<slug:salon_slug>/promote/', limited(views.salon_promote_user, moderation_limit), name='api_salon_promote'),
+    path('api/salon/<slug:salon_slug>/demote/', limited(views.salon_demote_user, moderation_limit), name='api_salon_demote'),
     path('api/salon/<slug:salon_slug>/users/', views.salon_users, name='api_salon_users'),
+    path('api/salon/<slug:salon_slug>/me/', views.salon_my_permissions, name='api_salon_my_permissions'),
+    path('api/salon/<slug:salon_slug>/export/', limited(views.salon_export, ratelimit('5/h', key='user+salon')), name='api_salon_export'),
 ]
@@ -1,106 +1,345 @@
-from django.http import JsonResponse, HttpResponseBadRequest
-from django.views.decorators.http import require_GET, require_POST
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_GET, require_POST, condition
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.decorators import login_required
-from .models import Salon, Channel, Message, SalonRole, Ban
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Salon, Message, SalonRole, Ban
+from .permissions import get_permissions
+from .realtime import get_broker, publish_message_event
+from .conversations import aresolve, get_conversation
+from .ingestion import get_ingester, write_behind_enabled
+from .search import search_messages
+from .thumbnails import schedule_thumbnail
+from .transfer import chunked, export_salon
+from .archive import aarchived_entries, archived_entries, archived_message_data, archived_page
+from .serializers import astream_messages, instance_data, json_response, message_data, message_rows, stream_messages
+from asgiref.sync import sync_to_async
+from contextlib import aclosing
+from itertools import chain, islice
+from datetime import datetime, time
+import asyncio
+import hashlib
 import json
 
+# Taille des pages renvoyées par les listes de messages
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
 
-@require_GET
-def messages_list(request, slug):
-    """Return JSON list of messages for a salon."""
-    salon = get_object_or_404(Salon, slug=slug)
-    qs = salon.messages.select_related('auteur').order_by('date_envoi')
-    data = []
-    for m in qs:
-        msg_data = {
-            'id': m.id,
-            'auteur': m.auteur.username,
-            'contenu': m.contenu,
-            'date_envoi': m.date_envoi.isoformat(),
-        }
-        if m.fichier:
-            msg_data['fichier_url'] = m.fichier.url
-            msg_data['fichier_nom'] = m.fichier.name.split('/')[-1]
-        data.append(msg_data)
-    return JsonResponse({'messages': data})
+# Attente maximale d'un long-poll (secondes)
+LONG_POLL_TIMEOUT = 25
+LONG_POLL_MAX_TIMEOUT = 55
 
+# Lignes lues par aller-retour en base dans les réponses en streaming
+STREAM_FETCH_SIZE = 2000
 
-@require_GET
-def channel_messages_list(request, salon_slug, channel_slug):
-    """Return JSON list of messages for a channel."""
-    salon = get_object_or_404(Salon, slug=salon_slug)
-    channel = get_object_or_404(Channel, slug=channel_slug, salon=salon)
-    qs = channel.messages.select_related('auteur').order_by('date_envoi')
-    data = []
-    for m in qs:
-        msg_data = {
-            'id': m.id,
-            'auteur': m.auteur.username,
-            'contenu': m.contenu,
-            'date_envoi': m.date_envoi.isoformat(),
-        }
-        if m.fichier:
-            msg_data['fichier_url'] = m.fichier.url
-            msg_data['fichier_nom'] = m.fichier.name.split('/')[-1]
-        data.append(msg_data)
-    return JsonResponse({'messages': data})
 
+def _page_params(request):
+    """`(after_id, before_id, limit)` from the query string, or None when invalid."""
+    try:
+        after_id = int(request.GET['after_id']) if 'after_id' in request.GET else None
+        before_id = int(request.GET['before_id']) if 'before_id' in request.GET else None
+        limit = int(request.GET.get('limit', MESSAGES_PAGE_SIZE))
+    except ValueError:
+        return None
+    if limit < 1:
+        return None
+    return after_id, before_id, min(limit, MESSAGES_MAX_PAGE_SIZE)
 
-@require_POST
-@login_required
-def messages_post(request, slug):
-    """Create a new message in the salon. Accepts JSON or form-encoded `contenu` and/or file."""
-    salon = get_object_or_404(Salon, slug=slug)
 
-    # Check if user is banned
-    if salon.is_banned(request.user):
-        return JsonResponse({'error': 'Vous êtes banni de ce salon.'}, status=403)
+def _with_archive(request, data, has_more, conversation):
+    """Continue a history page into the archive (see chat/archive.py).
 
-    contenu = None
-    fichier = None
+    Only for pages going back in time that the hot table could not fill.
+    """
+    after_id, before_id, limit = _page_params(request)
+    if after_id is not None or has_more:
+        return data, has_more
+    before = data[0]['id'] if data else before_id
+    older, has_more = archived_page(before_id=before, count=limit - len(data), **conversation.owner)
+    return [archived_message_data(entry) for entry in older] + data, has_more
 
-    # Try JSON body first
+
+def _paginate_messages(request, qs):
+    """Keyset pagination on message ids.
+
+    `after_id` returns the messages posted after the given id (used by the
+    polling client), `before_id` the page just before it (history), and no
+    cursor the latest page. Returns `(messages, has_more)` in chronological
+    order, or None when the parameters are invalid.
+    """
+    params = _page_params(request)
+    if params is None:
+        return None
+    after_id, before_id, limit = params
+
+    if after_id is not None:
+        qs = qs.filter(id__gt=after_id)
+        if before_id is not None:
+            qs = qs.filter(id__lt=before_id)
+        messages = list(qs.order_by('id')[:limit + 1])
+        has_more = len(messages) > limit
+        return messages[:limit], has_more
+
+    if before_id is not None:
+        qs = qs.filter(id__lt=before_id)
+    messages = list(qs.order_by('-id')[:limit + 1])
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    messages.reverse()
+    return messages, has_more
+
+
+def _etag(request, kind, pk, version):
+    """ETag of a list: the version counter plus the query string (cursor, limit)."""
+    query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()[:12]
+    return f'{kind}-{pk}-{version}-{query}'
+
+
+def _messages_etag(request, salon_slug, channel_slug=None):
+    conversation = get_conversation(request, salon_slug, channel_slug)
+    return _etag(request, conversation.kind, conversation.entity.pk, conversation.version)
+
+
+def _salon_users_etag(request, salon_slug):
+    row = Salon.objects.filter(slug=salon_slug).values_list('id', 'users_version').first()
+    return _etag(request, 'users', *row) if row else None
+
+
+def _my_permissions_etag(request, salon_slug):
+    # users_version change aussi à chaque rôle ou bannissement
+    row = Salon.objects.filter(slug=salon_slug).values_list('id', 'users_version').first()
+    return _etag(request, f'perms{request.user.pk}', *row) if row else None
+
+
+@require_GET
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_messages_etag)
+def messages_list(request, salon_slug, channel_slug=None):
+    """Return a JSON page of messages for a salon or channel (see `_paginate_messages`).
+
+    The conversation is loaded once, by the ETag function, and reused here.
+    """
+    conversation = get_conversation(request, salon_slug, channel_slug)
+    page = _paginate_messages(request, message_rows(conversation.messages()))
+    if page is None:
+        return JsonResponse({'error': 'Paramètres de pagination invalides.'}, status=400)
+    rows, has_more = page
+    data, has_more = _with_archive(request, [message_data(row) for row in rows], has_more, conversation)
+    return json_response({'messages': data, 'has_more': has_more, 'changes_version': conversation.changes_version})
+
+
+async def _wait_for_messages(request, conversation):
+    """Long-poll: answers as soon as a message newer than `after_id` exists.
+
+    With `changes` (the `changes_version` the client last saw), it also
+    answers as soon as a message is edited or deleted, so that the client
+    reloads the messages it displays. Waits on the realtime broker (no
+    thread held while waiting). Under WSGI a waiting request would pin a
+    worker, so the view answers immediately with `long_poll: false` and the
+    client goes back to periodic polling.
+    """
     try:
-        if request.content_type == 'application/json':
-            payload = json.loads(request.body.decode() or '{}')
-            contenu = payload.get('contenu')
-    except Exception:
-        contenu = None
+        after_id = int(request.GET['after_id'])
+        timeout = float(request.GET.get('timeout', LONG_POLL_TIMEOUT))
+        changes = int(request.GET['changes']) if 'changes' in request.GET else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Paramètres after_id / timeout / changes invalides.'}, status=400)
+    timeout = max(0.0, min(timeout, LONG_POLL_MAX_TIMEOUT))
+    supported = isinstance(request, ASGIRequest)
+    qs = message_rows(conversation.messages().filter(id__gt=after_id).order_by('id'))[:MESSAGES_PAGE_SIZE + 1]
+    wake_on = ('message.created',) if changes is None else ('message.created', 'message.updated', 'message.deleted')
+
+    broker = get_broker()
+    # S'abonner avant de lire la base : aucun message ne peut passer entre les deux
+    subscription = broker.subscribe(conversation.topic) if supported else None
+    try:
+        messages = [m async for m in qs]
+        changes_version = conversation.changes_version
+        if changes is not None:
+            changes_version = await _current_changes_version(conversation)
+        if not messages and changes in (None, changes_version) and supported:
+            try:
+                await asyncio.wait_for(_next_event(subscription, wake_on), timeout)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                messages = [m async for m in qs.all()]
+                changes_version = await _current_changes_version(conversation)
+    finally:
+        if subscription is not None:
+            broker.unsubscribe(subscription)
+
+    has_more = len(messages) > MESSAGES_PAGE_SIZE
+    data = [message_data(row) for row in messages[:MESSAGES_PAGE_SIZE]]
+    return json_response({'messages': data, 'has_more': has_more, 'long_poll': supported,
+                          'changes_version': changes_version})
+
+
+async def _current_changes_version(conversation):
+    entity = conversation.entity
+    return await type(entity).objects.filter(pk=entity.pk).values_list('changes_version', flat=True).afirst()
+
+
+async def _next_event(subscription, types):
+    while True:
+        event = await subscription.get()
+        if event.get('type') in types:
+            return event
 
-    # Fallback to POST form data
-    if not contenu:
-        contenu = request.POST.get('contenu')
 
-    # Handle file upload
-    if 'fichier' in request.FILES:
-        fichier = request.FILES['fichier']
+@require_GET
+async def messages_wait(request, salon_slug, channel_slug=None):
+    """Long-poll variant of messages_list: `after_id` is required, `timeout` in seconds, `changes` optional."""
+    return await _wait_for_messages(request, await aresolve(salon_slug, channel_slug))
+
+
+def _window_rows(conversation, after_id, before_id, count):
+    qs = conversation.messages()
+    if after_id is not None:
+        qs = qs.filter(id__gt=after_id)
+    if before_id is not None:
+        qs = qs.filter(id__lt=before_id)
+    rows = message_rows(qs.order_by('id'))
+    return rows if count is None else rows[:count]
+
+
+def _window_messages(conversation, after_id, before_id, count):
+    """JSON of the messages of a window, archived ones first, `count` at most (None: all)."""
+    archived = archived_entries(after_id=after_id, before_id=before_id, **conversation.owner)
+    rows = _window_rows(conversation, after_id, before_id, count).iterator(chunk_size=STREAM_FETCH_SIZE)
+    return islice(chain(map(archived_message_data, archived), map(message_data, rows)), count)
+
+
+async def _awindow_messages(conversation, after_id, before_id, count):
+    """Async variant of `_window_messages`, for ASGI."""
+    async with aclosing(aarchived_entries(after_id=after_id, before_id=before_id, **conversation.owner)) as archived:
+        async for entry in archived:
+            if count == 0:
+                return
+            yield archived_message_data(entry)
+            if count is not None:
+                count -= 1
+    async for row in _window_rows(conversation, after_id, before_id, count).aiterator(chunk_size=STREAM_FETCH_SIZE):
+        yield message_data(row)
+
+
+def _streaming_body(request, chunks):
+    """`chunks` (a sync iterator reading the database) as a streaming body.
+
+    Under ASGI the iterator is advanced one chunk at a time in the
+    thread-sensitive executor: Django would otherwise read a sync iterator
+    entirely into memory before sending it.
+    """
+    if not isinstance(request, ASGIRequest):
+        return chunks
+    next_chunk = sync_to_async(next)
+
+    async def body():
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    return body()
+
+
+def _stream_messages(request, conversation):
+    """Stream a history window as JSON, for large fetches (admins, export clients).
+
+    Messages with `after_id < id < before_id` (both optional) in chronological
+    order, archive included; at most `limit` of them (default: the whole
+    window), `has_more` telling whether the window was cut. Rows are read by
+    chunks through a server-side cursor and sent as they are encoded, so
+    memory does not grow with the window: the body is an async iterator
+    under ASGI and a plain one under WSGI, each server buffering the other
+    kind. Same JSON document as messages_list, with one message per line for
+    progressive parsing.
+    """
+    try:
+        after_id = int(request.GET['after_id']) if 'after_id' in request.GET else None
+        before_id = int(request.GET['before_id']) if 'before_id' in request.GET else None
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'Paramètres after_id / before_id / limit invalides.'}, status=400)
+    if limit is not None and limit < 1:
+        return JsonResponse({'error': 'Paramètres after_id / before_id / limit invalides.'}, status=400)
+    # Un message de plus que `limit` pour savoir s'il en reste
+    count = None if limit is None else limit + 1
+    if isinstance(request, ASGIRequest):
+        body = astream_messages(_awindow_messages(conversation, after_id, before_id, count), limit)
+    else:
+        body = stream_messages(_window_messages(conversation, after_id, before_id, count), limit)
+    response = StreamingHttpResponse(body, content_type='application/json')
+    # Sans tampon côté proxy (nginx) : le client affiche les messages au fil de l'eau
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
-    if not contenu and not fichier:
-        return HttpResponseBadRequest('Missing contenu or fichier')
 
-    msg = Message.objects.create(salon=salon, auteur=request.user, contenu=contenu or '', fichier=fichier)
-    response_data = {
-        'id': msg.id,
-        'auteur': msg.auteur.username,
-        'contenu': msg.contenu,
-        'date_envoi': msg.date_envoi.isoformat(),
-    }
-    if msg.fichier:
-        response_data['fichier_url'] = msg.fichier.url
-        response_data['fichier_nom'] = msg.fichier.name.split('/')[-1]
-    return JsonResponse(response_data)
+@require_GET
+async def messages_stream(request, salon_slug, channel_slug=None):
+    """Streaming variant of messages_list for large windows (see `_stream_messages`)."""
+    return _stream_messages(request, await aresolve(salon_slug, channel_slug))
+
+
+def _parse_search_date(value, end_of_day=False):
+    """ISO datetime or date (a bare `until` date includes the whole day)."""
+    dt = parse_datetime(value)
+    if dt is None:
+        d = parse_date(value)
+        if d is None:
+            raise ValueError(value)
+        dt = datetime.combine(d, time.max if end_of_day else time.min)
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+@require_GET
+def messages_search(request, salon_slug, channel_slug=None):
+    """Full-text search in a salon and its channels, or in one channel.
+
+    `q` is required; `channel` (slug, salon search only), `auteur` (username),
+    `since` and `until` (ISO dates) narrow the results, which are paginated
+    like the message lists.
+    """
+    conversation = get_conversation(request, salon_slug, channel_slug)
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'Paramètre q requis.'}, status=400)
+
+    qs = conversation.scope()
+    if request.GET.get('channel') and conversation.channel is None:
+        qs = qs.filter(channel__slug=request.GET['channel'])
+    if request.GET.get('auteur'):
+        qs = qs.filter(auteur__username=request.GET['auteur'])
+    try:
+        if request.GET.get('since'):
+            qs = qs.filter(date_envoi__gte=_parse_search_date(request.GET['since']))
+        if request.GET.get('until'):
+            qs = qs.filter(date_envoi__lte=_parse_search_date(request.GET['until'], end_of_day=True))
+    except ValueError:
+        return JsonResponse({'error': 'Date invalide.'}, status=400)
+
+    page = _paginate_messages(request, message_rows(search_messages(qs, query), 'channel__slug'))
+    if page is None:
+        return JsonResponse({'error': 'Paramètres de pagination invalides.'}, status=400)
+    rows, has_more = page
+    data = [dict(message_data(row), channel=row['channel__slug']) for row in rows]
+    return json_response({'messages': data, 'has_more': has_more})
 
 
 @require_POST
 @login_required
-def channel_messages_post(request, salon_slug, channel_slug):
-    """Create a new message in the channel. Accepts JSON or form-encoded `contenu` and/or file."""
-    salon = get_object_or_404(Salon, slug=salon_slug)
-    channel = get_object_or_404(Channel, slug=channel_slug, salon=salon)
+def messages_post(request, salon_slug, channel_slug=None):
+    """Create a new message in a salon or channel. Accepts JSON or form-encoded `contenu` and/or file."""
+    conversation = get_conversation(request, salon_slug, channel_slug)
+    salon = conversation.salon
 
     # Check if user is banned
-    if salon.is_banned(request.user):
+    if get_permissions(request, salon).is_banned:
         return JsonResponse({'error': 'Vous êtes banni de ce salon.'}, status=403)
 
     contenu = None
@@ -125,32 +364,44 @@ def channel_messages_post(request, salon_slug, channel_slug):
     if not contenu and not fichier:
         return HttpResponseBadRequest('Missing contenu or fichier')
 
-    msg = Message.objects.create(channel=channel, auteur=request.user, contenu=contenu or '', fichier=fichier)
-    response_data = {
-        'id': msg.id,
-        'auteur': msg.auteur.username,
-        'contenu': msg.contenu,
-        'date_envoi': msg.date_envoi.isoformat(),
-    }
-    if msg.fichier:
-        response_data['fichier_url'] = msg.fichier.url
-        response_data['fichier_nom'] = msg.fichier.name.split('/')[-1]
-    return JsonResponse(response_data)
+    def create(message_id=None):
+        # Fichier enregistré et référence comptée (signal post_save) dans la
+        # même transaction : voir chat/storage.py
+        with transaction.atomic():
+            return Message.objects.create(id=message_id, **conversation.owner, auteur=request.user,
+                                          contenu=contenu or '', fichier=fichier,
+                                          fichier_nom=fichier.name[:255] if fichier else '')
+
+    if not write_behind_enabled():
+        msg = create()
+    elif not fichier:
+        # Écriture différée (chat/ingestion.py) : réponse dès la journalisation
+        return json_response(get_ingester().submit(request.user, contenu, **conversation.owner_ids), status=202)
+    else:
+        # À son rang dans la file, pour garder les ids dans l'ordre d'insertion
+        msg = get_ingester().write_now(create)
+    Salon.count_messages(salon.id, msg.channel_id, 1, msg.id, msg.date_envoi)
+    schedule_thumbnail(msg)
+    response_data = instance_data(msg)
+    publish_message_event(msg, 'message.created', response_data)
+    return json_response(response_data)
 
 
 @require_POST
 @login_required
 def messages_edit(request, message_id):
     """Edit a message. Only the author can edit their message."""
-    message = get_object_or_404(Message, id=message_id)
-    salon = message.get_chat_entity() if hasattr(message, 'get_chat_entity') else message.salon
+    if write_behind_enabled():
+        get_ingester().ensure_written(message_id)
+    message = get_object_or_404(Message.objects.select_related('auteur', 'salon', 'channel__salon'), id=message_id)
+    salon = message.get_salon()
 
     # Check if user is the author
     if message.auteur != request.user:
         return JsonResponse({'error': 'Vous ne pouvez modifier que vos propres messages.'}, status=403)
 
     # Check if user is banned
-    if salon and salon.is_banned(request.user):
+    if get_permissions(request, salon).is_banned:
         return JsonResponse({'error': 'Vous êtes banni de ce salon.'}, status=403)
 
     # Get new content
@@ -171,30 +422,33 @@ def messages_edit(request, message_id):
     message.contenu = contenu
     message.save()
 
-    return JsonResponse({
-        'id': message.id,
-        'auteur': message.auteur.username,
-        'contenu': message.contenu,
-        'date_envoi': message.date_envoi.isoformat(),
-    })
+    response_data = instance_data(message)
+    publish_message_event(message, 'message.updated', response_data)
+    return json_response(response_data)
 
 
 @require_POST
 @login_required
 def messages_delete(request, message_id):
     """Delete a message. Author or moderators can delete messages."""
-    message = get_object_or_404(Message, id=message_id)
-    salon = message.get_chat_entity() if hasattr(message, 'get_chat_entity') else message.salon
+    if write_behind_enabled():
+        get_ingester().ensure_written(message_id)
+    message = get_object_or_404(Message.objects.select_related('auteur', 'salon', 'channel__salon'), id=message_id)
+    salon = message.get_salon()
 
     # Check if user is the author or a moderator
-    if message.auteur != request.user and (not salon or not salon.can_moderate(request.user)):
+    if message.auteur != request.user and not get_permissions(request, salon).can_moderate:
         return JsonResponse({'error': 'Vous ne pouvez supprimer que vos propres messages ou devez être modérateur.'}, status=403)
 
     # Check if user is banned
-    if salon and salon.is_banned(request.user):
+    if get_permissions(request, salon).is_banned:
         return JsonResponse({'error': 'Vous êtes banni de ce salon.'}, status=403)
 
     message.delete()
+    Salon.count_messages(salon.id, message.channel_id, -1)
+    if message_id in (salon.last_message_id, message.channel and message.channel.last_message_id):
+        Salon.refresh_last_message(salon.id, message.channel_id)
+    publish_message_event(message, 'message.deleted', {'id': message_id})
 
     return JsonResponse({'success': True})
 
@@ -206,7 +460,7 @@ def salon_ban_user(request, salon_slug):
     salon = get_object_or_404(Salon, slug=salon_slug)
 
     # Check permissions
-    if not salon.can_moderate(request.user):
+    if not get_permissions(request, salon).can_moderate:
         return JsonResponse({'error': 'Vous devez être modérateur pour bannir des utilisateurs.'}, status=403)
 
     try:
@@ -217,7 +471,6 @@ def salon_ban_user(request, salon_slug):
         if not user_id:
             return JsonResponse({'error': 'ID utilisateur requis.'}, status=400)
 
-        from django.contrib.auth.models import User
         user_to_ban = get_object_or_404(User, id=user_id)
 
         # Can't ban yourself
@@ -254,7 +507,7 @@ def salon_unban_user(request, salon_slug):
     salon = get_object_or_404(Salon, slug=salon_slug)
 
     # Check permissions
-    if not salon.can_moderate(request.user):
+    if not get_permissions(request, salon).can_moderate:
         return JsonResponse({'error': 'Vous devez être modérateur pour débannir des utilisateurs.'}, status=403)
 
     try:
@@ -264,7 +517,6 @@ def salon_unban_user(request, salon_slug):
         if not user_id:
             return JsonResponse({'error': 'ID utilisateur requis.'}, status=400)
 
-        from django.contrib.auth.models import User
         user_to_unban = get_object_or_404(User, id=user_id)
 
         ban = Ban.objects.filter(salon=salon, user=user_to_unban, is_active=True).first()
@@ -287,7 +539,7 @@ def salon_promote_user(request, salon_slug):
     salon = get_object_or_404(Salon, slug=salon_slug)
 
     # Check permissions
-    if not salon.can_manage_users(request.user):
+    if not get_permissions(request, salon).can_manage_users:
         return JsonResponse({'error': 'Vous devez être administrateur pour promouvoir des utilisateurs.'}, status=403)
 
     try:
@@ -301,7 +553,6 @@ def salon_promote_user(request, salon_slug):
         if role not in ['moderator']:
             return JsonResponse({'error': 'Rôle invalide.'}, status=400)
 
-        from django.contrib.auth.models import User
         user_to_promote = get_object_or_404(User, id=user_id)
 
         # Can't promote yourself (unless you're the creator)
@@ -332,7 +583,7 @@ def salon_demote_user(request, salon_slug):
     salon = get_object_or_404(Salon, slug=salon_slug)
 
     # Check permissions
-    if not salon.can_manage_users(request.user):
+    if not get_permissions(request, salon).can_manage_users:
         return JsonResponse({'error': 'Vous devez être administrateur pour rétrograder des utilisateurs.'}, status=403)
 
     try:
@@ -342,7 +593,6 @@ def salon_demote_user(request, salon_slug):
         if not user_id:
             return JsonResponse({'error': 'ID utilisateur requis.'}, status=400)
 
-        from django.contrib.auth.models import User
         user_to_demote = get_object_or_404(User, id=user_id)
 
         # Can't demote the creator
@@ -363,41 +613,67 @@ def salon_demote_user(request, salon_slug):
 
 @require_GET
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_salon_users_etag)
 def salon_users(request, salon_slug):
-    """Get list of users in a salon with their roles and ban status (incl. channels)."""
-    salon = get_object_or_404(Salon, slug=salon_slug)
-
-    users = set()
-
-    # toujours inclure le créateur
-    users.add(salon.createur)
+    """Get list of users in a salon with their roles and ban status (incl. channels).
 
-    # messages directement liés au salon
-    for message in salon.messages.select_related("auteur").all():
-        users.add(message.auteur)
+    Runs a fixed number of queries whatever the number of users or messages.
+    """
+    salon = get_object_or_404(Salon, slug=salon_slug)
 
-    # messages des channels du salon (LA CAUSE PRINCIPALE DU BUG)
-    for message in Message.objects.filter(channel__salon=salon).select_related("auteur"):
-        users.add(message.auteur)
+    # rôles (admin/modérateur) et bannis actifs, une requête chacun
+    roles = dict(salon.roles.values_list('user_id', 'role'))
+    banned = set(salon.bans.filter(is_active=True).values_list('user_id', flat=True))
 
-    # rôles (admin/modérateur)
-    for role in salon.roles.select_related("user").all():
-        users.add(role.user)
+    # auteurs des messages du salon et de ses canaux
+    author_ids = salon.memberships.values_list('user_id', flat=True)
 
-    # bannis actifs
-    for ban in salon.bans.filter(is_active=True).select_related("user"):
-        users.add(ban.user)
+    # toujours inclure le créateur
+    users = User.objects.filter(
+        Q(id__in=author_ids) | Q(id__in=roles.keys()) | Q(id__in=banned) | Q(id=salon.createur_id)
+    ).only('id', 'username').order_by('username')
 
     user_data = []
     for user in users:
-        role_obj = salon.roles.filter(user=user).first()
+        role = roles.get(user.id)
+        is_admin = user.id == salon.createur_id or role == 'admin'
         user_data.append({
             "id": user.id,
             "username": user.username,
-            "is_admin": salon.is_admin(user),
-            "is_moderator": salon.is_moderator(user),
-            "is_banned": salon.is_banned(user),
-            "role": role_obj.role if role_obj else None,
+            "is_admin": is_admin,
+            "is_moderator": is_admin or role == 'moderator',
+            "is_banned": user.id in banned,
+            "role": role,
         })
 
     return JsonResponse({"users": user_data})
+
+
+@require_GET
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_my_permissions_etag)
+def salon_my_permissions(request, salon_slug):
+    """Return the current user's permissions in a salon (one query, or none when cached).
+
+    Lighter than salon_users for clients that only need their own rights;
+    they refetch it on a `permissions.changed` event for their user id.
+    """
+    salon = get_object_or_404(Salon.objects.only('id', 'createur_id'), slug=salon_slug)
+    data = get_permissions(request, salon).as_dict()
+    data['user_id'] = request.user.pk
+    return JsonResponse(data)
+
+
+@require_GET
+@login_required
+def salon_export(request, salon_slug):
+    """Stream the salon as NDJSON (see chat/transfer.py). Salon admins only."""
+    salon = get_object_or_404(Salon.objects.select_related('createur'), slug=salon_slug)
+    if not get_permissions(request, salon).is_admin:
+        return JsonResponse({'error': 'Vous devez être administrateur pour exporter ce salon.'}, status=403)
+    response = StreamingHttpResponse(_streaming_body(request, chunked(export_salon(salon))),
+                                     content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="{salon.slug}.ndjson"'
+    return response
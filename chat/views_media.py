@@ -0,0 +1,153 @@
+"""Service des pièces jointes des messages.
+
+Chaque fichier est servi via son message : on vérifie que l'utilisateur
+n'est pas banni du salon avant d'envoyer quoi que ce soit. Deux modes :
+
+- par défaut, Django répond avec un `FileResponse` (ETag, requêtes
+  conditionnelles, `Range` sur un intervalle). Le fichier ouvert est passé
+  tel quel au serveur, qui peut utiliser `os.sendfile` (gunicorn le fait
+  via `wsgi.file_wrapper`) ;
+- avec `CHAT_MEDIA_ACCEL_REDIRECT`, Django ne fait que la vérification et
+  délègue l'envoi au serveur web (`X-Accel-Redirect` de nginx) : le worker
+  est libéré tout de suite, même pour une vidéo de plusieurs Go.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from .archive import find_archived
+from .models import Message
+from .permissions import get_permissions
+from .storage import attachment_storage, is_hashed_name
+
+MEDIA_FIELDS = ('fichier', 'miniature')
+MEDIA_BLOCK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _file_etag(name, stat):
+    # Nom adressé par contenu : l'empreinte est l'ETag
+    if is_hashed_name(name):
+        return quote_etag(os.path.splitext(os.path.basename(name))[0])
+    return quote_etag(f'{stat.st_size:x}-{int(stat.st_mtime):x}')
+
+
+def parse_range(header, size):
+    """Intervalle (début, fin inclusive) d'un en-tête `Range` à un seul intervalle.
+
+    None si l'en-tête est absent ou non géré (on répond alors en entier),
+    ValueError si l'intervalle est hors du fichier.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # Suffixe : les N derniers octets
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class RangeFile:
+    """Lecture limitée à `length` octets d'un fichier déjà positionné."""
+
+    def __init__(self, fh, length):
+        self.fh = fh
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fh.close()
+
+
+@require_safe
+def message_media(request, message_id, field):
+    """Serve a message attachment (`fichier`) or its thumbnail (`miniature`)."""
+    if field not in MEDIA_FIELDS:
+        raise Http404
+    message = Message.objects.select_related('salon', 'channel__salon').filter(id=message_id).first()
+    if message is not None:
+        salon, name, fichier_nom = message.get_salon(), getattr(message, field).name, message.fichier_nom
+    else:
+        # Message déplacé dans l'archive (chat/archive.py)
+        archived = find_archived(message_id)
+        if archived is None:
+            raise Http404
+        salon, entry = archived
+        name, fichier_nom = entry.get(field), entry.get('fichier_nom')
+    if not name:
+        raise Http404
+    if get_permissions(request, salon).is_banned:
+        return JsonResponse({'error': 'Vous êtes banni de ce salon.'}, status=403)
+
+    filename = (fichier_nom or os.path.basename(name)) if field == 'fichier' else os.path.basename(name)
+    accel_prefix = getattr(settings, 'CHAT_MEDIA_ACCEL_REDIRECT', '')
+    if accel_prefix:
+        # Le serveur web gère lui-même Range, ETag et l'envoi du fichier
+        response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(name)
+        response['Content-Disposition'] = f"inline; filename*=utf-8''{quote(filename)}"
+        response['Cache-Control'] = 'private, max-age=3600'
+        return response
+
+    try:
+        path = attachment_storage.path(name)
+        stat = os.stat(path)
+    except (NotImplementedError, OSError):
+        raise Http404
+    etag = _file_etag(name, stat)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    fh = open(path, 'rb')
+    if byte_range is None or byte_range == (0, size - 1):
+        response = FileResponse(fh, filename=filename)
+    else:
+        start, end = byte_range
+        fh.seek(start)
+        if end == size - 1:
+            # Jusqu'à la fin (cas des lecteurs vidéo) : le fichier reste
+            # envoyable par sendfile, Content-Length part de la position
+            response = FileResponse(fh, filename=filename, status=206)
+        else:
+            response = FileResponse(RangeFile(fh, end - start + 1), filename=filename, status=206)
+            response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response.block_size = MEDIA_BLOCK_SIZE
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
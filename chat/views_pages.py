@@ -1,27 +1,47 @@
 from django.shortcuts import render, redirect
+from django.db.models import F, PositiveIntegerField, Value
+from django.db.models.functions import Greatest
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 from .forms import RegisterForm, LoginForm 
 from .models import Salon, Channel
+from .directory import directory_page, directory_version, page_number
+from .permissions import get_permissions
+from .conversations import resolve
 from django.shortcuts import get_object_or_404
 from django.utils.text import slugify
 
 # Page d'accueil
 def index(request):
-    salons = []
+    context = {}
     # On affiche la liste seulement si le gars est connecté
     if request.user.is_authenticated:
-        salons = Salon.objects.all()
-    
-    return render(request, 'chat/index.html', {'salons': salons})
+        q = request.GET.get('q', '').strip()[:100]
+        number = page_number(request.GET.get('page'))
+        context = {
+            'q': q,
+            'page_number': number,
+            'directory_version': directory_version(),
+            'directory_ttl': settings.CHAT_DIRECTORY_CACHE_TTL,
+            # Évaluée seulement si le fragment n'est pas en cache (chat/directory.py)
+            'page': SimpleLazyObject(lambda: directory_page(q, number)),
+        }
+
+    return render(request, 'chat/index.html', context)
 
 # Page du salon (protégée)
 @login_required 
 @login_required
 def room(request, slug):
     salon = get_object_or_404(Salon, slug=slug)
-    return render(request, 'chat/room.html', {'slug': slug, 'salon': salon})
+    return render(request, 'chat/room.html', {
+        'slug': slug,
+        'salon': salon,
+        'permissions': get_permissions(request, salon),
+    })
 
 
 @login_required
@@ -84,6 +104,7 @@ def creer_channel(request, salon_slug):
                 unique_slug = f"{slug}-{suffix}"
 
             channel = Channel.objects.create(nom=nom, slug=unique_slug, description=description, salon=salon)
+            Salon.objects.filter(pk=salon.pk).update(channel_count=F('channel_count') + 1)
             messages.success(request, f"Canal '{channel.nom}' créé dans '{salon.nom}'.")
             return redirect('channel', salon_slug=salon.slug, channel_slug=channel.slug)
 
@@ -93,31 +114,41 @@ def creer_channel(request, salon_slug):
 @login_required
 def channel(request, salon_slug, channel_slug):
     """Page du canal (protégée)."""
-    salon = get_object_or_404(Salon, slug=salon_slug)
-    channel = get_object_or_404(Channel, slug=channel_slug, salon=salon)
+    conversation = resolve(salon_slug, channel_slug)
+    salon, channel = conversation.salon, conversation.channel
     return render(request, 'chat/channel.html', {
         'salon_slug': salon_slug, 
         'channel_slug': channel_slug, 
         'salon': salon,
-        'channel': channel
+        'channel': channel,
+        'permissions': get_permissions(request, salon),
     })
 
 
 @login_required
 def supprimer_channel(request, salon_slug, channel_slug):
     """Delete a Channel."""
-    salon = get_object_or_404(Salon, slug=salon_slug)
-    channel = get_object_or_404(Channel, slug=channel_slug, salon=salon)
+    conversation = resolve(salon_slug, channel_slug)
+    salon, channel = conversation.salon, conversation.channel
     
     if request.method == 'POST':
         channel.delete()
+        # Les messages du canal partent avec lui
+        Salon.objects.filter(pk=salon.pk).update(
+            channel_count=Greatest(F('channel_count') - 1, Value(0), output_field=PositiveIntegerField()),
+            message_count=Greatest(F('message_count') - channel.message_count, Value(0),
+                                   output_field=PositiveIntegerField()),
+        )
+        if channel.last_message_id is not None and channel.last_message_id == salon.last_message_id:
+            Salon.refresh_last_message(salon.pk)
         messages.success(request, f"Canal '{channel.nom}' supprimé.")
         return redirect('room', slug=salon.slug)
     
     # GET request - show confirmation page
     return render(request, 'chat/delete_channel.html', {
         'salon': salon,
-        'channel': channel
+        'channel': channel,
+        'permissions': get_permissions(request, salon),
     })
 
 # --- Authentification ---
@@ -0,0 +1,64 @@
+"""Point d'entrée WebSocket (ASGI brut) pour suivre un salon ou un canal.
+
+URL : `/ws/salon/<slug>/` ou `/ws/salon/<salon_slug>/<channel_slug>/`.
+Le serveur n'envoie que des événements JSON (voir `chat.realtime`) ; les
+messages reçus du client sont ignorés, l'envoi passe toujours par l'API HTTP.
+"""
+import asyncio
+import re
+
+from django.http import Http404
+
+from .conversations import aresolve
+from .realtime import get_broker
+from .serializers import get_dumps
+
+WEBSOCKET_PATH = re.compile(r'^/ws/salon/(?P<salon_slug>[-\w]+)/(?:(?P<channel_slug>[-\w]+)/)?$')
+
+# Codes de fermeture applicatifs (plage 4000-4999)
+CLOSE_NOT_FOUND = 4404
+
+
+async def resolve_topic(path):
+    """Retourne le sujet correspondant au chemin, ou None s'il n'existe pas."""
+    match = WEBSOCKET_PATH.match(path)
+    if not match:
+        return None
+    try:
+        conversation = await aresolve(match.group('salon_slug'), match.group('channel_slug'))
+    except Http404:
+        return None
+    return conversation.topic
+
+
+async def websocket_application(scope, receive, send):
+    """Application ASGI pour les connexions `websocket`."""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    topic = await resolve_topic(scope['path'])
+    if topic is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    broker = get_broker()
+    subscription = broker.subscribe(topic)
+    await send({'type': 'websocket.accept'})
+
+    receiver = asyncio.ensure_future(receive())
+    getter = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                await send({'type': 'websocket.send', 'text': get_dumps()(getter.result()).decode()})
+                getter = asyncio.ensure_future(subscription.get())
+            if receiver in done:
+                if receiver.result()['type'] == 'websocket.disconnect':
+                    break
+                receiver = asyncio.ensure_future(receive())
+    finally:
+        receiver.cancel()
+        getter.cancel()
+        broker.unsubscribe(subscription)
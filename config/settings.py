@@ -36,7 +36,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Ajouté ici directement
+    'chat.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise, compatible avec les vues async
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -63,15 +63,60 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Choisie par variables d'environnement : DB_ENGINE=sqlite (défaut) ou postgresql
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    # Nécessite psycopg 3 (`pip install "psycopg[binary,pool]"`).
+    # DB_POOL=True : pool de connexions natif (Django 5.1+), partagé par les
+    # threads d'un worker ; sinon connexions persistantes (DB_CONN_MAX_AGE).
+    DB_POOL = os.environ.get('DB_POOL', 'True') == 'True'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'chat'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            # Le pool et CONN_MAX_AGE sont incompatibles
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+                    'timeout': 10,
+                },
+            } if DB_POOL else {},
+        }
+    }
+else:
+    # WAL : les lectures ne bloquent plus les écritures (et inversement) entre
+    # workers gunicorn ; busy_timeout fait attendre un écrivain au lieu
+    # d'échouer sur « database is locked » ; synchronous=NORMAL suffit en WAL ;
+    # mmap évite des copies en lecture. IMMEDIATE prend le verrou d'écriture
+    # dès le début d'une transaction, sans impasse lors de sa promotion.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))};"
+                    'PRAGMA synchronous=NORMAL;'
+                    f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024)))};"
+                    'PRAGMA cache_size=-20000;'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
-}
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -107,6 +152,54 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Les fichiers envoyés sont écrits sur disque par blocs au fil de la requête,
+# jamais gardés en entier en mémoire, et leur SHA-256 est calculé au passage
+# pour le stockage adressé par contenu (chat/storage.py)
+FILE_UPLOAD_HANDLERS = ['chat.storage.HashingFileUploadHandler']
+
+# Envoi des pièces jointes délégué au serveur web : préfixe d'une location
+# interne nginx pointant sur MEDIA_ROOT, ex. `location /protected-media/ {
+# internal; alias /srv/app/media/; }`. Vide = fichiers envoyés par Django
+CHAT_MEDIA_ACCEL_REDIRECT = os.environ.get('CHAT_MEDIA_ACCEL_REDIRECT', '')
+
+# Miniatures des images jointes (chat/thumbnails.py) : côté max en pixels,
+# threads de génération ; CHAT_THUMBNAILS_SYNC=True les génère dans la requête
+CHAT_THUMBNAIL_SIZE = int(os.environ.get('CHAT_THUMBNAIL_SIZE', '600'))
+CHAT_THUMBNAIL_WORKERS = int(os.environ.get('CHAT_THUMBNAIL_WORKERS', '2'))
+CHAT_THUMBNAILS_SYNC = os.environ.get('CHAT_THUMBNAILS_SYNC', 'False') == 'True'
+
+# Temps réel : broker utilisé pour diffuser les événements aux WebSockets
+# (chat.realtime.InMemoryBroker = un seul processus ASGI)
+CHAT_REALTIME_BACKEND = os.environ.get('CHAT_REALTIME_BACKEND', 'chat.realtime.InMemoryBroker')
+
+# Écriture différée des messages texte (chat/ingestion.py) : réponse 202 dès
+# que le message est journalisé sur disque, insertion par lots en tâche de
+# fond. Un seul processus par base (comme InMemoryBroker)
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', 'False') == 'True'
+CHAT_WRITE_BEHIND_JOURNAL = os.environ.get('CHAT_WRITE_BEHIND_JOURNAL', str(BASE_DIR / 'ingest-journal'))
+CHAT_WRITE_BEHIND_BATCH = int(os.environ.get('CHAT_WRITE_BEHIND_BATCH', '500'))
+CHAT_WRITE_BEHIND_INTERVAL = float(os.environ.get('CHAT_WRITE_BEHIND_INTERVAL', '0.05'))
+CHAT_WRITE_BEHIND_FSYNC = os.environ.get('CHAT_WRITE_BEHIND_FSYNC', 'True') == 'True'
+
+# Limitation de débit (chat/ratelimit.py, limites posées dans chat/urls.py) :
+# chat.ratelimit.LocalBucketStore = seaux par processus,
+# chat.ratelimit.CacheBucketStore = cache Django partagé entre workers
+CHAT_RATELIMIT_ENABLED = os.environ.get('CHAT_RATELIMIT_ENABLED', 'True') == 'True'
+CHAT_RATELIMIT_BACKEND = os.environ.get('CHAT_RATELIMIT_BACKEND', 'chat.ratelimit.LocalBucketStore')
+
+# Fragment HTML de l'annuaire des salons (page d'accueil) gardé en cache :
+# invalidé à la création / suppression d'un salon ou d'un canal, les
+# compteurs de messages ont au plus ce retard (secondes)
+CHAT_DIRECTORY_CACHE_TTL = int(os.environ.get('CHAT_DIRECTORY_CACHE_TTL', '60'))
+
+# Encodeur JSON des réponses de messages (chat/serializers.py) :
+# chat.serializers.dumps (bibliothèque standard) ou orjson.dumps (pip install orjson)
+CHAT_JSON_ENCODER = os.environ.get('CHAT_JSON_ENCODER', 'chat.serializers.dumps')
+
+# Permissions par salon gardées en cache partagé (secondes, 0 = désactivé).
+# À n'activer qu'avec un cache commun à tous les workers (Redis, Memcached...)
+CHAT_PERMISSIONS_CACHE_TTL = int(os.environ.get('CHAT_PERMISSIONS_CACHE_TTL', '0'))
+
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'index'
 LOGOUT_REDIRECT_URL = 'index'